@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+import logging
+import heapq
+from collections import OrderedDict
+from importlib import import_module
+
+from twisted.internet import defer
+
+from exchangelib.interfaces import IDataAPI
+from exchangelib.book import OrderBook
+
+log = logging.getLogger(__name__)
+
+# Modules registered by default, imported on first use
+DEFAULT_EXCHANGES = OrderedDict([('bitstamp', 'exchangelib.bitstamp.data'),
+                                 ('bitfinex', 'exchangelib.bitfinex.data'),
+                                 ('btce', 'exchangelib.btce.data_v3'),
+                                 ('huobi', 'exchangelib.huobi.data_v2')])
+
+_exchanges = OrderedDict()
+_defaults_loaded = False
+
+
+def _load_defaults():
+    global _defaults_loaded
+    if not _defaults_loaded:
+        _defaults_loaded = True
+        for name, module in DEFAULT_EXCHANGES.items():
+            _exchanges.setdefault(name, import_module(module))
+
+
+def register(name, api):
+    """
+    Add a data API to the ones queried by fan_out, alongside the DEFAULT_EXCHANGES.
+
+    :param api: an object or module providing IDataAPI
+    :raises ValueError: if api doesn't provide IDataAPI
+    """
+    if not IDataAPI.providedBy(api):
+        raise ValueError("{} does not provide IDataAPI".format(api))
+    _load_defaults()
+    _exchanges[name] = api
+
+
+def unregister(name):
+    _load_defaults()
+    _exchanges.pop(name, None)
+
+
+def exchanges():
+    """:returns: an OrderedDict of name -> data API for every registered exchange"""
+    _load_defaults()
+    return _exchanges
+
+
+def fan_out(method, pairs=None, names=None, deadline=None, on_result=None, clock=None, **kwargs):
+    """
+    Call an IDataAPI method on several exchanges at once.
+
+    :param method: 'ticker', 'orderbook' or 'trades'
+    :param pairs: pair to use for every exchange, or a dict of exchange name -> pair.
+        Exchanges use their own default pair if not given one.
+    :type pairs: str or dict or None
+    :param names: exchange names to query, defaults to all registered ones
+    :param deadline: seconds to wait before firing with whatever results arrived, or None to wait for all
+    :param on_result: called with (name, result) as each exchange's result arrives, before the deadline.
+        Exceptions it raises are logged.
+    :param clock: IReactorTime provider for the deadline, defaults to the reactor
+    :param kwargs: passed on to every call
+
+    :returns: a Deferred firing with a dict of exchange name -> result.
+        Exchanges that failed or missed the deadline are left out, failures get logged.
+        Fails with ValueError if names has one that isn't registered.
+    :rtype: defer.Deferred
+    """
+    apis = exchanges()
+    names = list(names) if names is not None else list(apis)
+    unknown = [name for name in names if name not in apis]
+    if unknown:
+        return defer.fail(ValueError("Unknown exchanges {}, registered are {}".format(
+            ', '.join(unknown), ', '.join(apis))))
+    results = OrderedDict()
+    waiting = set(names)
+    done = defer.Deferred()
+
+    def finish():
+        if not done.called:
+            if timer is not None and timer.active():
+                timer.cancel()
+            if waiting:
+                log.info("No {} results from {} before the deadline".format(method, ', '.join(sorted(waiting))))
+            done.callback(results)
+
+    def got(result, name):
+        if not done.called:
+            results[name] = result
+            if on_result:
+                try:
+                    on_result(name, result)
+                except Exception:
+                    # the result is kept, and the other exchanges' still come in
+                    log.exception("on_result failed for {} from {}".format(method, name))
+
+    def failed(failure, name):
+        log.warning("Could not get {} from {}: {}".format(method, name, failure.getErrorMessage()))
+
+    def completed(_, name):
+        waiting.discard(name)
+        if not waiting:
+            finish()
+
+    timer = None
+    if deadline is not None:
+        if clock is None:
+            from twisted.internet import reactor as clock
+        timer = clock.callLater(deadline, finish)
+
+    for name in names:
+        call_kwargs = dict(kwargs)
+        pair = pairs.get(name) if isinstance(pairs, dict) else pairs
+        if pair is not None:
+            call_kwargs['pair'] = pair
+        d = defer.maybeDeferred(getattr(apis[name], method), **call_kwargs)
+        d.addCallbacks(got, failed, callbackArgs=(name,), errbackArgs=(name,))
+        d.addBoth(completed, name)
+
+    if not names:
+        finish()
+    return done
+
+
+def consolidated_orderbook(pairs='btcusd', names=None, deadline=None, depth=None, **kwargs):
+    """
+    Get orderbooks from several exchanges and merge them into one, see consolidate().
+
+    Only books quoting the same currency can be merged, so without names only the exchanges listing their pair in
+    PAIRS are asked, e.g. Huobi is left out for btcusd.
+
+    :param pairs: pair to use for every exchange, or a dict of exchange name -> pair, which also gives the
+        exchanges to ask if names isn't. Exchanges left out of the dict use btcusd.
+    :type pairs: str or dict
+    :param depth: most levels to get from each exchange and to include in the merged book
+    :returns: a Deferred firing with the merged book.
+        Fails with ValueError if the pairs don't all quote the same currency.
+    :rtype: defer.Deferred
+    """
+    def pair_for(name):
+        return pairs.get(name, 'btcusd') if isinstance(pairs, dict) else pairs
+
+    if names is None:
+        if isinstance(pairs, dict):
+            names = list(pairs)
+        else:
+            # exchanges that don't list their pairs are assumed to have it
+            names = [name for name, api in exchanges().items() if pairs in getattr(api, 'PAIRS', [pairs])]
+    names = list(names)
+    quotes = set(pair_for(name)[-3:] for name in names)
+    if len(quotes) > 1:
+        return defer.fail(ValueError("Can't merge books quoted in different currencies: {}".format(
+            ', '.join('{} {}'.format(name, pair_for(name)) for name in names))))
+    d = fan_out('orderbook', dict((name, pair_for(name)) for name in names), names, deadline, columnar=True,
+                depth=depth, **kwargs)
+    return d.addCallback(consolidate, depth)
+
+
+def consolidate(books, depth=None):
+    """
+    Merge orderbooks from several venues into one, with each level tagged with the venue it came from.
+
+    Each book must already be sorted, best price first, so the merge is a k-way merge rather than a sort.
+
+    :param books: dict of venue name -> book.OrderBook or schemas.OrderBook
+    :param depth: most levels to include for each side
+    :returns: a dict with 'bids' and 'asks', each a list of dicts with keys price, amount and venue
+    """
+    bids = list()
+    asks = list()
+    for venue, book in books.items():
+        if not isinstance(book, OrderBook):
+            book = OrderBook.from_dict(book)
+        # heapq.merge sorts ascending, so negate bid prices to get the highest first
+        bids.append(_tagged_levels(book.bids, venue, negate=True))
+        asks.append(_tagged_levels(book.asks, venue))
+
+    merged = {'bids': [], 'asks': []}
+    for side, negate, iterables in (('bids', True, bids), ('asks', False, asks)):
+        levels = merged[side]
+        for price, venue, amount in heapq.merge(*iterables):
+            if depth is not None and len(levels) >= depth:
+                break
+            levels.append({'price': -price if negate else price, 'amount': amount, 'venue': venue})
+    return merged
+
+
+def _tagged_levels(side, venue, negate=False):
+    """:type side: book.BookSide"""
+    for price, amount in zip(side.prices, side.amounts):
+        yield (-price if negate else price), venue, amount
@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+"""
+asyncio backend, for Python 3. Nothing here imports Twisted.
+
+The data API functions are shared with the Twisted backend: call() runs one with utils.capture set, so the
+request it makes with utils.get_json (or get or post) is handed back instead of being sent, along with the
+callbacks the function adds to it. The request is then made with aiohttp, or urllib in a thread if aiohttp isn't
+installed, and the same callbacks (reflowing, remapping and schema validation) are run on the response::
+
+    bitstamp = aio.DataAPI('exchangelib.bitstamp.data')
+    ticker = await bitstamp.ticker()
+
+Requests made here don't go through Twisted's connection pool, response cache or rate limiting.
+"""
+
+import asyncio
+import functools
+import logging
+import socket
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+from importlib import import_module
+
+from exchangelib import utils, metrics
+from exchangelib.compat import urlencode
+from exchangelib.errors import HTTPError, ConnectionError
+from exchangelib.version import VERSION
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+log = logging.getLogger(__name__)
+
+# seconds before a request is given up on
+TIMEOUT = 30
+
+
+async def get_json(url, params=None, **kwargs):
+    """
+    GET a URL, parsing it as JSON with utils.parse_json.
+
+    :raises HTTPError: if the response status wasn't 200
+    :raises ConnectionError: if the connection failed or timed out
+    """
+    return utils.parse_json(await get(url, params, **kwargs))
+
+
+async def get(url, params=None, **kwargs):
+    """
+    GET a URL.
+
+    :returns: the response body
+    :rtype: bytes
+    """
+    return await _request('get', url, params=params, **kwargs)
+
+
+async def post(url, **kwargs):
+    return await _request('post', url, **kwargs)
+
+
+async def _request(method, url, params=None, headers=None, data=None, timeout=TIMEOUT, priority=None,
+                   collector=None, signer=None, span=None):
+    """
+    Make an HTTP request. Timings are added to span, or to the current metrics.Span if there is one.
+
+    :param priority: accepted for compatibility with utils, but there is no rate limiting here
+    :param collector: called with the body in chunks as it arrives (all at once with urllib), like utils._request,
+        and None is returned instead of the body
+    :param signer: returns headers and/or data to add right before the request is sent, like utils._request
+    :param span: the metrics.Span the request was set up under, as it's no longer current once the request is
+        awaited
+    """
+    if span is None:
+        span = metrics.current_span()
+    headers = dict(headers or {})
+    headers.setdefault('User-Agent', 'exchangelib/{}'.format(VERSION))
+    if signer is not None:
+        signed = signer()
+        headers.update(signed.get('headers', {}))
+        data = signed.get('data', data)
+    if isinstance(data, dict):
+        data = urlencode(data)
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    if params:
+        url += ('&' if '?' in url else '?') + urlencode(params)
+
+    sent_at = metrics.now()
+    if aiohttp is not None:
+        status, body, headers_at = await _aiohttp_request(method, url, headers, data, timeout, collector)
+    else:
+        loop = asyncio.get_running_loop()
+        status, body, headers_at = await loop.run_in_executor(
+            None, _urllib_request, method, url, headers, data, timeout)
+        if status == 200 and collector is not None:
+            collector(body)
+            body = None
+    if span is not None:
+        span.record('ttfb', headers_at - sent_at)
+        span.record('body', metrics.now() - headers_at)
+
+    if status != 200:
+        log.debug(body)
+        raise HTTPError("Bad status code: {} for URL '{}'".format(status, url), status, body)
+    return body
+
+
+_session = None
+
+
+def _get_session():
+    global _session
+    loop = asyncio.get_running_loop()
+    # sessions belong to the event loop they were created in
+    if _session is None or _session.closed or _session._loop is not loop:
+        _session = aiohttp.ClientSession()
+    return _session
+
+
+async def _aiohttp_request(method, url, headers, data, timeout, collector=None):
+    try:
+        async with _get_session().request(method.upper(), url, headers=headers, data=data,
+                                          timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            headers_at = metrics.now()
+            if response.status != 200 or collector is None:
+                return response.status, await response.read(), headers_at
+            async for chunk in response.content.iter_any():
+                collector(chunk)
+            return response.status, None, headers_at
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise ConnectionError("Request to '{}' failed: {!r}".format(url, e))
+
+
+def _urllib_request(method, url, headers, data, timeout):
+    request = urllib.request.Request(url, data=data, headers=headers, method=method.upper())
+    try:
+        response = urllib.request.urlopen(request, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        return e.code, e.read(), metrics.now()
+    except (urllib.error.URLError, socket.timeout, OSError) as e:
+        raise ConnectionError("Request to '{}' failed: {!r}".format(url, e))
+    with response:
+        headers_at = metrics.now()
+        return response.status, response.read(), headers_at
+
+
+async def close():
+    """Close the aiohttp session, if one was opened."""
+    global _session
+    if _session is not None:
+        session, _session = _session, None
+        await session.close()
+
+
+##########
+# Running the data API functions
+
+class _Failure(object):
+    """The parts of twisted.python.failure.Failure that errbacks in the data API modules use."""
+
+    def __init__(self, exception):
+        self.value = exception
+        self.type = type(exception)
+
+    def check(self, *types):
+        for kind in types:
+            if isinstance(self.value, kind):
+                return kind
+        return None
+
+    def trap(self, *types):
+        kind = self.check(*types)
+        if kind is None:
+            raise self.value
+        return kind
+
+    def getErrorMessage(self):
+        return str(self.value)
+
+    def raiseException(self):
+        raise self.value
+
+
+class _Pending(object):
+    """
+    Stands in for the Deferred that a data API function gets from utils. Callbacks added to it are collected,
+    and run by complete() once the request has been made.
+    """
+
+    def __init__(self, method, url, kwargs, parse_json, span):
+        self.method = method
+        self.url = url
+        self.kwargs = kwargs
+        self.parse_json = parse_json
+        self.span = span
+        self._chain = list()
+
+    def addCallbacks(self, callback, errback=None, callbackArgs=(), callbackKeywords=None,
+                     errbackArgs=(), errbackKeywords=None):
+        self._chain.append(((callback, callbackArgs, callbackKeywords or {}),
+                            (errback, errbackArgs, errbackKeywords or {})))
+        return self
+
+    def addCallback(self, callback, *args, **kwargs):
+        return self.addCallbacks(callback, None, args, kwargs)
+
+    def addErrback(self, errback, *args, **kwargs):
+        return self.addCallbacks(None, errback, errbackArgs=args, errbackKeywords=kwargs)
+
+    def addBoth(self, callback, *args, **kwargs):
+        return self.addCallbacks(callback, callback, args, kwargs, args, kwargs)
+
+    async def complete(self):
+        """
+        Make the request and run the callbacks on the response, like the Deferred would have.
+
+        :returns: the result of the last callback
+        :raises: whatever the request or callbacks raised, if no errback handled it
+        """
+        try:
+            span = self.span.child() if self.span is not None else None
+            result = await _request(self.method, self.url, span=span, **self.kwargs)
+            if self.parse_json:
+                start = metrics.now()
+                result = utils.parse_json(result)
+                if self.span is not None:
+                    self.span.parsed_at = metrics.now()
+                    self.span.record('parse', self.span.parsed_at - start)
+        except Exception as e:
+            result = _Failure(e)
+
+        for callback, errback in self._chain:
+            func, args, kwargs = errback if isinstance(result, _Failure) else callback
+            if func is None:
+                continue
+            try:
+                with capturing():
+                    result = func(result, *args, **kwargs)
+                # a callback that makes another request
+                if isinstance(result, _Pending):
+                    result = await result.complete()
+            except Exception as e:
+                result = _Failure(e)
+
+        if isinstance(result, _Failure):
+            result.raiseException()
+        return result
+
+
+def _capture(method, url, parse_json=False, **kwargs):
+    return _Pending(method, url, kwargs, parse_json, metrics.current_span())
+
+
+@contextmanager
+def capturing():
+    """
+    Make requests through utils return a _Pending instead of being sent with Twisted.
+
+    Only held while synchronous code runs, so coroutines running in between never see it.
+    """
+    previous, utils.capture = utils.capture, _capture
+    try:
+        yield
+    finally:
+        utils.capture = previous
+
+
+async def call(func, *args, **kwargs):
+    """
+    Run a data API function (or anything else that gets its data through utils) on asyncio.
+
+    :returns: what the Deferred returned by func would have fired with
+    """
+    with capturing():
+        result = func(*args, **kwargs)
+    if isinstance(result, _Pending):
+        result = await result.complete()
+    return result
+
+
+class DataAPI(object):
+    """
+    Awaitable versions of the functions in a data API module::
+
+        huobi = DataAPI('exchangelib.huobi.data_v2')
+        book = await huobi.orderbook(columnar=True)
+    """
+
+    def __init__(self, module):
+        """:param module: a module providing IDataAPI, or its name"""
+        self.module = import_module(module) if isinstance(module, str) else module
+
+    def __getattr__(self, name):
+        func = getattr(self.module, name)
+        if not callable(func):
+            return func
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await call(func, *args, **kwargs)
+        setattr(self, name, wrapper)
+        return wrapper
+
+
+##########
+# Forex
+
+async def update(source):
+    """
+    Update a forex data source, see forex.BaseForexDataSource.update
+
+    :returns: the new rates, or None if the source didn't need updating
+    """
+    if not source.needs_update():
+        return None
+    return await call(source.update)
+
+
+async def update_rates(converter):
+    """
+    Update every data source of a forex.ForexConverter and rebuild its cross-rate matrix, see
+    ForexConverter.update_rates
+
+    :returns: dict of data source name -> new rates, None, or the exception that updating raised
+    """
+    names = list(converter.datasources)
+    results = await asyncio.gather(*[update(converter.datasources[name]) for name in names],
+                                   return_exceptions=True)
+    for name, result in zip(names, results):
+        if isinstance(result, Exception):
+            log.warning("Could not update rates from {}: {!r}".format(name, result))
+        elif result:
+            log.info("Got new rates from {}".format(name))
+    converter.rebuild_matrix()
+    return dict(zip(names, results))
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+"""
+Compare the JSON decoders usable by utils.parse_json.
+
+Usage: python -m exchangelib.bench.bench_json [payload name ...]
+"""
+
+import sys
+import timeit
+
+from exchangelib import utils
+from exchangelib.bench import payloads
+
+DEFAULT_PAYLOADS = ('bitstamp_orderbook', 'btce_orderbook')
+
+
+def main(names=None):
+    names = names or DEFAULT_PAYLOADS
+    original = utils.json_decoder
+    try:
+        for name in names:
+            data = payloads.load(name)
+            print("{} ({} bytes)".format(name, len(data)))
+            for decoder in utils.JSON_DECODERS:
+                try:
+                    utils.use_json_decoder(decoder)
+                except ValueError:
+                    print("  {:<12} not installed".format(decoder))
+                    continue
+                runs = timeit.repeat(lambda: utils.parse_json(data), number=10, repeat=3)
+                print("  {:<12} {:8.2f} ms/parse".format(decoder, min(runs) / 10 * 1000))
+    finally:
+        utils.use_json_decoder(original)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
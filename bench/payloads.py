@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+"""
+Payloads for the offline benchmarks.
+
+Responses recorded from the exchanges can be saved in bench/payloads/ as <name>.json (fxcm_rates is XML, but keeps
+the extension), and are used instead of
+the generated stand-ins below. The stand-ins mimic the real responses in shape and size (full-depth books are
+thousands of levels deep), so they're good enough for comparing implementations against each other.
+"""
+
+import os
+import json
+import random
+
+PAYLOAD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'payloads')
+
+
+def load(name):
+    """
+    Get a payload as the raw response body.
+
+    :param name: name of a generator in GENERATORS, or of a file in PAYLOAD_DIR without the extension
+    :rtype: str
+    """
+    path = os.path.join(PAYLOAD_DIR, name + '.json')
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            return f.read()
+    elif name in GENERATORS:
+        return GENERATORS[name](random.Random(name))
+    else:
+        raise ValueError("No payload named '{}'".format(name))
+
+
+def _levels(rnd, start, step, count):
+    levels = list()
+    price = start
+    for _ in range(count):
+        price += step * rnd.randint(1, 20)
+        levels.append(['{:.2f}'.format(price), '{:.8f}'.format(rnd.uniform(0.001, 40))])
+    return levels
+
+
+def bitstamp_orderbook(rnd):
+    # bitstamp sends prices and amounts as strings
+    return json.dumps({'timestamp': '1425040254',
+                       'bids': _levels(rnd, 250.0, -0.01, 6000),
+                       'asks': _levels(rnd, 250.0, 0.01, 6000)})
+
+
+def btce_orderbook(rnd):
+    # btc-e sends numbers, so these end up going through parse_float
+    book = {'bids': [[float(p), float(a)] for p, a in _levels(rnd, 250.0, -0.001, 2000)],
+            'asks': [[float(p), float(a)] for p, a in _levels(rnd, 250.0, 0.001, 2000)]}
+    return json.dumps({'btc_usd': book})
+
+
+def bitstamp_trades(rnd):
+    trades = list()
+    timestamp = 1425040254
+    for tid in range(7000000, 7000000 + 1000):
+        timestamp -= rnd.randint(0, 5)
+        trades.append({'date': str(timestamp), 'tid': tid, 'price': '{:.2f}'.format(rnd.uniform(245, 255)),
+                       'amount': '{:.8f}'.format(rnd.uniform(0.001, 10)), 'type': rnd.randint(0, 1)})
+    return json.dumps(trades)
+
+
+def bitfinex_trades(rnd):
+    trades = list()
+    timestamp = 1425040254
+    for tid in range(4000000, 4000000 + 1000):
+        timestamp -= rnd.randint(0, 5)
+        trades.append({'timestamp': timestamp, 'tid': tid, 'price': '{:.2f}'.format(rnd.uniform(245, 255)),
+                       'amount': '{:.8f}'.format(rnd.uniform(0.001, 10)), 'exchange': 'bitfinex',
+                       'type': rnd.choice(('buy', 'sell'))})
+    return json.dumps(trades)
+
+
+def bitfinex_orderbook(rnd):
+    def orders(levels):
+        return [{'price': p, 'amount': a, 'timestamp': '1425040254.0'} for p, a in levels]
+    return json.dumps({'bids': orders(_levels(rnd, 250.0, -0.01, 2000)),
+                       'asks': orders(_levels(rnd, 250.0, 0.01, 2000))})
+
+
+def huobi_detail(rnd):
+    buy, sell = u'\u4e70\u5165', u'\u5356\u51fa'
+    trades = [{'time': '{:02d}:{:02d}:{:02d}'.format(rnd.randint(0, 23), rnd.randint(0, 59), rnd.randint(0, 59)),
+               'price': round(rnd.uniform(1500, 1600), 2), 'amount': round(rnd.uniform(0.001, 10), 4),
+               'type': rnd.choice((buy, sell))} for _ in range(60)]
+
+    def orders(levels):
+        return [{'price': float(p), 'level': 0, 'amount': float(a)} for p, a in levels]
+    return json.dumps({'sells': orders(_levels(rnd, 1550.0, 0.01, 10)), 'buys': orders(_levels(rnd, 1550.0, -0.01, 10)),
+                       'trades': trades, 'p_new': 1550.01, 'level': -0.52, 'amount': 51234.5, 'total': 79123456.1,
+                       'amp': 2, 'p_open': 1558.1, 'p_high': 1570, 'p_low': 1540.5, 'p_last': 1558.1,
+                       'top_buy': [], 'top_sell': []})
+
+
+def huobi_kline(rnd):
+    candles = list()
+    price = 1550.0
+    for minute in range(2000):
+        prices = [price + rnd.uniform(-2, 2) for _ in range(4)]
+        candles.append(['201503010{:03d}00000'.format(minute), prices[0], max(prices), min(prices), prices[-1],
+                        round(rnd.uniform(0, 500), 4)])
+        price = prices[-1]
+    return json.dumps(candles)
+
+
+# currencies quoted against USD in RatesXML, e.g. EURUSD and USDJPY
+FXCM_SYMBOLS = ['EURUSD', 'USDJPY', 'GBPUSD', 'USDCHF', 'EURCHF', 'AUDUSD', 'USDCAD', 'NZDUSD', 'EURGBP',
+                'EURJPY', 'GBPJPY', 'CHFJPY', 'GBPCHF', 'EURAUD', 'EURCAD', 'AUDCAD', 'AUDJPY', 'CADJPY',
+                'NZDJPY', 'GBPCAD', 'GBPNZD', 'GBPAUD', 'AUDNZD', 'USDSEK', 'EURSEK', 'EURNOK', 'USDNOK',
+                'USDMXN', 'AUDCHF', 'EURNZD', 'USDZAR', 'USDHKD', 'ZARJPY', 'USDTRY', 'EURTRY', 'NZDCHF',
+                'CADCHF', 'NZDCAD', 'TRYJPY', 'USDCNH', 'XAUUSD', 'XAGUSD', 'Copper', 'USOil', 'SPX500']
+
+
+def fxcm_rates(rnd):
+    rates = list()
+    for symbol in FXCM_SYMBOLS:
+        mid = rnd.uniform(0.5, 150)
+        rates.append(('<Rate Symbol="{0}"><Bid>{1:.5f}</Bid><Ask>{2:.5f}</Ask><High>{2:.5f}</High>'
+                      '<Low>{1:.5f}</Low><Direction>1</Direction><Last>05:13:08</Last></Rate>').format(
+                      symbol, mid, mid * 1.0002))
+    return '<?xml version="1.0" encoding="UTF-8"?>\n<Rates>{}</Rates>'.format(''.join(rates))
+
+
+GENERATORS = {'bitstamp_orderbook': bitstamp_orderbook,
+              'bitstamp_trades': bitstamp_trades,
+              'btce_orderbook': btce_orderbook,
+              'bitfinex_orderbook': bitfinex_orderbook,
+              'bitfinex_trades': bitfinex_trades,
+              'huobi_detail': huobi_detail,
+              'huobi_kline': huobi_kline,
+              'fxcm_rates': fxcm_rates}
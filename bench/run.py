@@ -0,0 +1,396 @@
+#!/usr/bin/env python
+"""
+Offline benchmarks for the parsing, schema, dispatch and forex hot paths.
+
+Usage: python -m exchangelib.bench.run [--save] [--baseline FILE] [--threshold PCT] [name ...]
+
+Every benchmark runs against the payloads from bench.payloads, with the HTTP layer swapped out for the
+already-received response, so no network access is needed. Each reports time per operation, throughput, and
+allocations: bytes and blocks with tracemalloc when it is available, or else the number of container objects
+(dicts, lists) created, which tracks the per-level and per-trade dicts that dominate these code paths.
+
+Results are compared against the baseline file when it exists, and the exit status is 1 if anything got
+slower by more than the threshold. Baselines are machine specific, so --save one before making changes.
+"""
+
+import argparse
+import copy
+import gc
+import json
+import os
+import sys
+from collections import OrderedDict
+from contextlib import contextmanager
+from timeit import default_timer
+
+from twisted.internet import defer
+
+from exchangelib import utils, simpleschema, schemas
+from exchangelib.observable import Observable
+from exchangelib.bench import payloads
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# name -> setup function, returning (prepare, run). prepare() makes fresh input for each run and isn't timed,
+# since most of the code under test modifies its input in place.
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+@contextmanager
+def responses(module, body):
+    """Make a data API module's get_json return an already parsed copy of body."""
+    original = module.get_json
+    module.get_json = lambda *args, **kwargs: defer.succeed(utils.parse_json(body))
+    try:
+        yield
+    finally:
+        module.get_json = original
+
+
+def _call_through(module, payload, func, *args, **kwargs):
+    """Benchmark a data API function, including its reflow closures and schema validation."""
+    body = payloads.load(payload)
+
+    def run(_):
+        results = list()
+        with responses(module, body):
+            func(*args, **kwargs).addBoth(results.append)
+        if hasattr(results[0], 'raiseException'):
+            results[0].raiseException()
+        return results[0]
+    return lambda: None, run
+
+
+##########
+# Parsing
+
+@benchmark('parse_json.bitstamp_orderbook')
+def parse_bitstamp_orderbook():
+    body = payloads.load('bitstamp_orderbook')
+    return lambda: body, utils.parse_json
+
+
+@benchmark('parse_json.btce_orderbook')
+def parse_btce_orderbook():
+    body = payloads.load('btce_orderbook')
+    return lambda: body, utils.parse_json
+
+
+##########
+# Schemas
+
+@benchmark('remap.bitstamp_trades')
+def remap_trades():
+    body = payloads.load('bitstamp_trades')
+
+    def run(data):
+        return simpleschema.remap(data, [{'tid': 'id', 'date': 'timestamp'}])
+    return (lambda: utils.parse_json(body)), run
+
+
+@benchmark('validate.orderbook')
+def validate_orderbook():
+    book = utils.parse_json(payloads.load('bitstamp_orderbook'))
+    book['bids'] = [{'price': p, 'amount': a} for p, a in book['bids']]
+    book['asks'] = [{'price': p, 'amount': a} for p, a in book['asks']]
+    return (lambda: copy.deepcopy(book)), lambda data: simpleschema.validate(data, schemas.OrderBook)
+
+
+@benchmark('validate.tradelist')
+def validate_trades():
+    trades = utils.parse_json(payloads.load('bitstamp_trades'))
+    trades = simpleschema.remap(trades, [{'tid': 'id', 'date': 'timestamp'}])
+    return (lambda: copy.deepcopy(trades)), lambda data: simpleschema.validate(data, schemas.TradeList)
+
+
+@benchmark('validate.orderbook_lazy_top10')
+def validate_orderbook_lazy():
+    """Lazy validation, reading only the top ten levels on each side, as most consumers do."""
+    book = utils.parse_json(payloads.load('bitstamp_orderbook'))
+    book['bids'] = [{'price': p, 'amount': a} for p, a in book['bids']]
+    book['asks'] = [{'price': p, 'amount': a} for p, a in book['asks']]
+    wrap = simpleschema.compile_lazy(schemas.OrderBook)
+
+    def run(data):
+        data = wrap(data)
+        return [(level['price'], level['amount']) for side in ('bids', 'asks') for level in data[side][:10]]
+    return (lambda: copy.deepcopy(book)), run
+
+
+@benchmark('validate.tradelist_lazy_top10')
+def validate_trades_lazy():
+    trades = utils.parse_json(payloads.load('bitstamp_trades'))
+    trades = simpleschema.remap(trades, [{'tid': 'id', 'date': 'timestamp'}])
+    wrap = simpleschema.compile_lazy(schemas.TradeList)
+
+    def run(data):
+        return [(trade['price'], trade['amount']) for trade in wrap(data)[:10]]
+    return (lambda: copy.deepcopy(trades)), run
+
+
+##########
+# Exchange data API functions, with reflow closures
+
+@benchmark('bitstamp.orderbook')
+def bitstamp_orderbook():
+    from exchangelib.bitstamp import data
+    return _call_through(data, 'bitstamp_orderbook', data.orderbook)
+
+
+@benchmark('bitstamp.orderbook_columnar')
+def bitstamp_orderbook_columnar():
+    from exchangelib.bitstamp import data
+    return _call_through(data, 'bitstamp_orderbook', data.orderbook, columnar=True)
+
+
+@benchmark('bitstamp.trades')
+def bitstamp_trades():
+    from exchangelib.bitstamp import data
+    return _call_through(data, 'bitstamp_trades', data.trades)
+
+
+@benchmark('btce.orderbook')
+def btce_orderbook():
+    from exchangelib.btce import data_v3
+    return _call_through(data_v3, 'btce_orderbook', data_v3.orderbook_batch, ['btcusd'])
+
+
+@benchmark('bitfinex.orderbook')
+def bitfinex_orderbook():
+    from exchangelib.bitfinex import data
+    return _call_through(data, 'bitfinex_orderbook', data.orderbook)
+
+
+@benchmark('bitfinex.trades')
+def bitfinex_trades():
+    from exchangelib.bitfinex import data
+    return _call_through(data, 'bitfinex_trades', data.trades)
+
+
+@benchmark('huobi.detail')
+def huobi_detail():
+    from exchangelib.huobi import data_v2
+    return _call_through(data_v2, 'huobi_detail', data_v2.detail)
+
+
+@benchmark('huobi.candlestick')
+def huobi_candlestick():
+    from exchangelib.huobi import data_v2
+    return _call_through(data_v2, 'huobi_kline', data_v2.candlestick, period='1m')
+
+
+##########
+# Live order books
+
+@benchmark('book.price_levels_deep_1000x')
+def price_levels_deep():
+    """A thousand level changes (half new levels, half removals) deep inside a 50000 level book side."""
+    from decimal import Decimal
+    from exchangelib.book import PriceLevels
+    levels = PriceLevels(descending=True)
+    for i in range(50000):
+        levels.set(Decimal(i * 2), Decimal(1))
+    prices = [Decimal(i * 2 + 1) for i in range(12000, 12500)]
+
+    def run(_):
+        for price in prices:
+            levels.set(price, Decimal(1))
+        for price in prices:
+            levels.remove(price)
+        return levels
+    return lambda: None, run
+
+
+##########
+# Dispatch
+
+class _Source(Observable):
+    def event(self, data):
+        return data
+
+
+@benchmark('observable.dispatch_1000x10')
+def observable_dispatch():
+    source = _Source()
+    received = list()
+    listeners = [lambda data: received.append(data) for _ in range(10)]
+    for listener in listeners:
+        source.listen('event', listener, weak=False)
+    trade = {'price': 250, 'amount': 1}
+
+    def run(_):
+        for _ in range(1000):
+            source.event(trade)
+        del received[:]
+        return listeners
+    return lambda: None, run
+
+
+##########
+# Forex
+
+def _fxcm_update(fresh):
+    from exchangelib import forex
+    body = payloads.load('fxcm_rates')
+
+    def get(url, params=None, collector=None, **kwargs):
+        collector(body)
+        return defer.succeed(None)
+
+    def update(source):
+        original = forex.utils.get
+        forex.utils.get = get
+        try:
+            return source.update()
+        finally:
+            forex.utils.get = original
+
+    def prepare():
+        source = forex.FXCMData()
+        if not fresh:
+            # same quotes as last time, so nothing to convert
+            update(source)
+            source.last_updated = None
+        return source
+    return prepare, update
+
+
+@benchmark('forex.fxcm_update')
+def fxcm_update():
+    return _fxcm_update(fresh=True)
+
+
+@benchmark('forex.fxcm_update_unchanged')
+def fxcm_update_unchanged():
+    return _fxcm_update(fresh=False)
+
+
+@benchmark('forex.convert_book')
+def forex_convert_book():
+    from exchangelib import forex
+    from exchangelib.bitstamp import data
+    converter = forex.ForexConverter()
+    converter.datasources['FXCM'].rates = {'CNY': '6.2', 'EUR': '0.9'}
+    converter.rebuild_matrix()
+    prepare, fetch = _call_through(data, 'bitstamp_orderbook', data.orderbook)
+    book = fetch(prepare())
+
+    def run(_):
+        return converter.convert_book(book, 'CNY', 'USD')
+    return lambda: None, run
+
+
+##########
+
+def measure(setup, min_time=1.0, min_runs=3):
+    """
+    Time a benchmark.
+
+    :param setup: returns (prepare, run). run should return what it made, so allocations can be counted
+    :returns: dict with seconds (per operation, best of the runs), ops_per_sec, runs and allocation stats
+    """
+    prepare, run = setup()
+    # warm up, also catching any errors before timing
+    run(prepare())
+
+    timings = list()
+    total = 0.0
+    while total < min_time or len(timings) < min_runs:
+        arg = prepare()
+        start = default_timer()
+        run(arg)
+        elapsed = default_timer() - start
+        timings.append(elapsed)
+        total += elapsed
+
+    best = min(timings)
+    result = {'seconds': best, 'ops_per_sec': 1 / best if best else None, 'runs': len(timings)}
+    result.update(allocations(prepare, run))
+    return result
+
+
+def allocations(prepare, run):
+    arg = prepare()
+    if tracemalloc is not None:
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        result = run(arg)
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        stats = after.compare_to(before, 'filename')
+        return {'alloc_bytes': sum(stat.size_diff for stat in stats if stat.size_diff > 0),
+                'alloc_blocks': sum(stat.count_diff for stat in stats if stat.count_diff > 0)}
+    else:
+        gc.collect()
+        gc.disable()
+        try:
+            before = len(gc.get_objects())
+            result = run(arg)
+            after = len(gc.get_objects())
+        finally:
+            gc.enable()
+        del result
+        return {'alloc_objects': after - before}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the offline benchmarks.")
+    parser.add_argument('names', nargs='*', help="benchmarks to run, or prefixes like 'bitstamp.' (default: all)")
+    parser.add_argument('--save', action='store_true', help="save the results as the new baseline")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="baseline file to compare with")
+    parser.add_argument('--threshold', type=float, default=20, help="slowdown in percent to call a regression")
+    parser.add_argument('--min-time', type=float, default=1.0, help="seconds to spend on each benchmark")
+    args = parser.parse_args(argv)
+
+    names = [name for name in BENCHMARKS if not args.names or any(name.startswith(n) for n in args.names)]
+    baseline = dict()
+    if os.path.exists(args.baseline) and not args.save:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = OrderedDict()
+    regressions = list()
+    print("{:<32}{:>12}{:>12}{:>16}{:>10}".format('benchmark', 'ms/op', 'ops/s', 'allocs', 'change'))
+    for name in names:
+        try:
+            result = measure(BENCHMARKS[name], args.min_time)
+        except ImportError as e:
+            print("{:<32}skipped: {}".format(name, e))
+            continue
+        results[name] = result
+
+        allocs = result.get('alloc_blocks', result.get('alloc_objects'))
+        change = ''
+        if name in baseline:
+            pct = (result['seconds'] / baseline[name]['seconds'] - 1) * 100
+            change = '{:+.1f}%'.format(pct)
+            if pct > args.threshold:
+                regressions.append(name)
+                change += ' !'
+        print("{:<32}{:>12.3f}{:>12.1f}{:>16}{:>10}".format(name, result['seconds'] * 1000, result['ops_per_sec'],
+                                                             allocs, change))
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print("Saved baseline to {}".format(args.baseline))
+    if regressions:
+        print("Slower than the baseline by more than {}%: {}".format(args.threshold, ', '.join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
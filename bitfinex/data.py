@@ -6,6 +6,7 @@ from zope.interface import moduleProvides
 from exchangelib.interfaces import IDataAPI
 from exchangelib.utils import get_json
 from exchangelib import simpleschema, schemas
+from exchangelib.book import OrderBook
 
 log = logging.getLogger(__name__)
 moduleProvides(IDataAPI)
@@ -29,9 +30,19 @@ def ticker(pair='btcusd'):
 
 
 @simpleschema.returns(schemas.OrderBook)
-def orderbook(pair='btcusd', limit_orders=50, group=True, limit_bids=None, limit_asks=None):
-    # limit_bids/limit_asks optional, overrides limit_orders
-    return get_json(url=_make_url('book', pair))
+def orderbook(pair='btcusd', limit_orders=50, group=True, limit_bids=None, limit_asks=None, columnar=False,
+              depth=None):
+    # depth (same as limit_orders, for consistency with the other exchanges) is overridden by limit_bids/limit_asks
+    # columnar to return a book.OrderBook instead of a dict
+    if depth is not None:
+        limit_orders = depth
+    params = {'limit_bids': limit_bids if limit_bids is not None else limit_orders,
+              'limit_asks': limit_asks if limit_asks is not None else limit_orders,
+              'group': int(group)}
+    d = get_json(url=_make_url('book', pair), params=params)
+    if columnar:
+        d.addCallback(OrderBook.from_dict)
+    return d
 
 
 @simpleschema.returns(schemas.TradeList)
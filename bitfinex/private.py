@@ -5,13 +5,23 @@ import hmac
 import json
 import base64
 import hashlib
+import os
+import threading
 import time
 
+from exchangelib import utils
 from exchangelib.utils import post
+from exchangelib.errors import HTTPError
+from exchangelib.ratelimit import PRIORITY_HIGH
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 log = logging.getLogger(__name__)
 
-__all__ = ['Auth', 'active_orders']
+__all__ = ['Auth', 'NonceGenerator', 'active_orders']
 
 API_VERSION = 'v1'
 PRIVATE_API_URL = "https://api.bitfinex.com/" + API_VERSION + '/'
@@ -22,13 +32,66 @@ PRIVATE_API_URL = "https://api.bitfinex.com/" + API_VERSION + '/'
 # {"message":"Must specify a 'request' field in the payload that matches the URL path."}
 
 
+class NonceGenerator(object):
+    """
+    Strictly increasing nonces, the time in microseconds unless that would repeat or go back.
+
+    Thread-safe. With a path, nonces are also shared by every process using the same file (which holds the last
+    nonce handed out, under an exclusive lock), so several processes can use one API key.
+    """
+
+    def __init__(self, path=None):
+        """:raises ValueError: if a path is given on a platform without fcntl"""
+        if path is not None and fcntl is None:
+            raise ValueError("Sharing nonces between processes needs fcntl")
+        self.path = path
+        self.last = 0
+        self._lock = threading.Lock()
+
+    def next(self):
+        """:rtype: int"""
+        with self._lock:
+            if self.path is None:
+                self.last = max(self.last + 1, int(time.time() * 1e6))
+                return self.last
+            return self._next_shared()
+
+    def _next_shared(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            stored = os.read(fd, 32).strip()
+            last = max(self.last, int(stored) if stored else 0)
+            self.last = max(last + 1, int(time.time() * 1e6))
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, str(self.last).encode('ascii'))
+            return self.last
+        finally:
+            # closing releases the lock
+            os.close(fd)
+
+
 class Auth(object):
     exchange = 'bitstamp'
 
-    def __init__(self, key, secret):
+    def __init__(self, key, secret, nonce_file=None, max_in_flight=8, nonce_retries=3):
+        """
+        :param nonce_file: file to share nonces through with other processes using this key, see NonceGenerator
+        :param max_in_flight: most private requests sent at once, more wait their turn
+        :param nonce_retries: times to resend a request Bitfinex rejected for its nonce, which can happen when
+            concurrent requests overtake each other on the way
+        """
         self.secret = secret
         self.key = key
         self.nonce = 0
+        self.nonces = NonceGenerator(nonce_file)
+        self.max_in_flight = max_in_flight
+        self.nonce_retries = nonce_retries
+        self.nonce_errors = 0
+        # HMAC state with the key already processed, copied for each signature
+        self._hmac = hmac.new(_to_bytes(secret), digestmod=hashlib.sha384)
+        self._window = None
 
     def sign(self, data):
         """
@@ -36,17 +99,27 @@ class Auth(object):
         :returns: a dict with keys 'headers' and 'data'"""
         data['nonce'] = self.increment_nonce()
 
-        packed = base64.standard_b64encode(json.dumps(data))
-        signature = hmac.new(self.secret, packed, hashlib.sha384).hexdigest()
+        payload = json.dumps(data)
+        packed = base64.standard_b64encode(_to_bytes(payload))
+        signature = self._hmac.copy()
+        signature.update(packed)
         return {'headers': {'X-BFX-APIKEY': self.key,
-                            'X-BFX-PAYLOAD': packed,
-                            'X-BFX-SIGNATURE': signature},
-                'data': json.dumps(data)}
+                            'X-BFX-PAYLOAD': packed if isinstance(packed, str) else packed.decode('ascii'),
+                            'X-BFX-SIGNATURE': signature.hexdigest()},
+                'data': payload}
 
     def increment_nonce(self):
-        self.nonce = str(int(time.time() * 1e6))
+        self.nonce = str(self.nonces.next())
         return self.nonce
 
+    @property
+    def window(self):
+        """Limits the private requests in flight to max_in_flight"""
+        if self._window is None:
+            from twisted.internet import defer
+            self._window = defer.DeferredSemaphore(self.max_in_flight)
+        return self._window
+
 
 def active_orders(auth):
     """:type auth: Auth"""
@@ -56,5 +129,32 @@ def active_orders(auth):
 def _do_post(api_call, auth, **opts):
     opts['request'] = '/' + API_VERSION + '/' + api_call
     url = PRIVATE_API_URL + api_call
-    return post(url=url,
-                **auth.sign(opts))
\ No newline at end of file
+
+    def send():
+        # private calls go ahead of market data requests waiting on the rate limit, and are signed as they're
+        # sent, so their nonces go out in order
+        return post(url=url, priority=PRIORITY_HIGH, signer=lambda: auth.sign(dict(opts)))
+
+    if utils.capture is not None:
+        # aio sends it right away, there's no window or retrying there
+        return send()
+    return auth.window.run(_retry_nonce_errors, send, auth)
+
+
+def _retry_nonce_errors(send, auth):
+    def retry(failure, attempt):
+        if attempt >= auth.nonce_retries or not _is_nonce_error(failure):
+            return failure
+        auth.nonce_errors += 1
+        log.debug("Nonce rejected by Bitfinex, retrying: {}".format(failure.value.body))
+        return send().addErrback(retry, attempt + 1)
+    return send().addErrback(retry, 0)
+
+
+def _is_nonce_error(failure):
+    return (failure.check(HTTPError) is not None and failure.value.code == 400 and
+            b'nonce' in _to_bytes(failure.value.body or b'').lower())
+
+
+def _to_bytes(value):
+    return value if isinstance(value, bytes) else value.encode('utf-8')
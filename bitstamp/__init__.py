@@ -1,6 +1,14 @@
 #!/usr/bin/env python
 
-from exchangelib.bitstamp.observer import BitstampObserver
-from exchangelib.bitstamp.websocket import BitstampWebsocketAPI2
-from exchangelib.bitstamp.websocket import BitstampWebsocketAPI2 as Websocket
 from exchangelib.bitstamp.data import *
+
+try:
+    import twistedpusher as _twistedpusher
+except ImportError:
+    # the websocket API needs twistedpusher, the data API doesn't
+    _twistedpusher = None
+
+if _twistedpusher is not None:
+    from exchangelib.bitstamp.observer import BitstampObserver
+    from exchangelib.bitstamp.websocket import BitstampWebsocketAPI2
+    from exchangelib.bitstamp.websocket import BitstampWebsocketAPI2 as Websocket
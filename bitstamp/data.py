@@ -7,6 +7,7 @@ from zope.interface import moduleProvides
 from exchangelib.interfaces import IDataAPI
 from exchangelib.utils import get_json
 from exchangelib import simpleschema, schemas
+from exchangelib.book import OrderBook
 
 log = logging.getLogger(__name__)
 moduleProvides(IDataAPI)
@@ -43,12 +44,17 @@ def ticker(pair='btcusd'):
 
 
 @simpleschema.returns(schemas.OrderBook)
-def orderbook(pair='btcusd', group=True):
+def orderbook(pair='btcusd', group=True, columnar=False, depth=None):
     """
     Get the full Bitstamp orderbook.
 
     :param group: whether to group orders with the same price.
     :type group: bool
+    :param columnar: return a book.OrderBook instead of a dict
+    :type columnar: bool
+    :param depth: only keep this many levels on each side. Bitstamp always sends them all, but the rest are
+        dropped before they're converted.
+    :type depth: int or None
     :rtype: defer.Deferred
 
     Keys:
@@ -60,8 +66,11 @@ def orderbook(pair='btcusd', group=True):
                    params={'group': int(group)})
 
     def reflow(book):
-        book['bids'] = [{'price': b[0], 'amount': b[1]} for b in book['bids']]
-        book['asks'] = [{'price': a[0], 'amount': a[1]} for a in book['asks']]
+        bids, asks = book['bids'][:depth], book['asks'][:depth]
+        if columnar:
+            return OrderBook.from_levels(bids, asks, book.get('timestamp'))
+        book['bids'] = [{'price': b[0], 'amount': b[1]} for b in bids]
+        book['asks'] = [{'price': a[0], 'amount': a[1]} for a in asks]
         return book
     return raw.addCallback(reflow)
 
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+
+import logging
+from collections import OrderedDict
+
+from exchangelib.book import PriceLevels
+from exchangelib.bitstamp import data
+
+log = logging.getLogger(__name__)
+
+
+class LiveOrderBook(object):
+    """
+    Bitstamp order book kept current from live_orders events (BitstampWebsocketAPI2.orderchange).
+
+    Seeded from the REST orderbook() and then updated per event. Events that arrive while the snapshot is being
+    fetched are held back and replayed on top of it. Snapshots from the order_book channel can be passed to
+    reconcile() to correct drift near the top of the book.
+
+    Order changed events only carry the new amount, so a change to an order that was already resting when the
+    snapshot was taken can't be applied exactly. Those are counted in unknown_changes, and after resync_after of
+    them a new snapshot is fetched. The amounts of orders seen in events are kept across snapshots, so each order
+    is only ever unknown once.
+    """
+
+    # deleted order ids remembered, so repeated delete events aren't applied twice
+    DELETED_MEMORY = 10000
+
+    def __init__(self, resync_after=200, min_resync_interval=60, retry_delay=1, max_retry_delay=60, clock=None):
+        """
+        :param resync_after: unknown order changes since the last snapshot that trigger a new one, or None to never
+            resync
+        :param min_resync_interval: least seconds between a snapshot and a resync
+        :param retry_delay: seconds to wait before retrying a failed snapshot, doubled on each failure in a row
+        :param max_retry_delay: longest wait between snapshot retries
+        :param clock: IReactorTime provider, defaults to the reactor
+        """
+        self.bids = PriceLevels(descending=True)
+        self.asks = PriceLevels()
+        self.synced = False
+        self.snapshot_timestamp = None
+        self.snapshot_microtimestamp = None
+        # clock time of the last snapshot or applied event
+        self.last_update = None
+
+        self.resync_after = resync_after
+        self.min_resync_interval = min_resync_interval
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.clock = clock
+
+        # order id -> (levels, price, amount) for orders seen being created or changed
+        self._orders = dict()
+        # recently deleted order ids
+        self._deleted = OrderedDict()
+        # events held back until the snapshot arrives, or None when not waiting on one
+        self._pending = None
+        self._snapshot = None
+        self._snapshot_at = None
+        self._retry = None
+
+        # Counters for events that couldn't be applied exactly, and levels fixed by reconcile()
+        self.unknown_changes = 0
+        self.reconciled_levels = 0
+        self.failed_snapshots = 0
+        self.resyncs = 0
+        self._unknown_since_snapshot = 0
+
+    @property
+    def best_bid(self):
+        return self.bids.best
+
+    @property
+    def best_ask(self):
+        return self.asks.best
+
+    def start(self, snapshot=data.orderbook):
+        """
+        Fetch a full orderbook snapshot and seed the book with it. Failed snapshots are retried with backoff.
+
+        :param snapshot: function that returns a Deferred firing with a schemas.OrderBook
+        :returns: the first snapshot attempt
+        :rtype: defer.Deferred
+        """
+        self._snapshot = snapshot
+        return self._request_snapshot()
+
+    def stop(self):
+        """Cancel any snapshot retry waiting to happen"""
+        if self._retry is not None and self._retry.active():
+            self._retry.cancel()
+        self._retry = None
+
+    def resync(self):
+        """Fetch a new snapshot, holding events back until it arrives. The book stops being synced meanwhile."""
+        if self._snapshot is None:
+            raise ValueError("Book wasn't started, there's no snapshot to resync from")
+        if self._pending is None:
+            self.resyncs += 1
+            self._request_snapshot()
+
+    def _request_snapshot(self):
+        self._retry = None
+        if self._pending is None:
+            self._pending = list()
+        self.synced = False
+        return self._snapshot().addCallbacks(self.load_snapshot, self._snapshot_failed)
+
+    def _snapshot_failed(self, failure):
+        delay = min(self.retry_delay * 2 ** self.failed_snapshots, self.max_retry_delay)
+        self.failed_snapshots += 1
+        log.error("Could not get a Bitstamp orderbook snapshot, retrying in {}s: {}".format(
+            delay, failure.getErrorMessage()))
+        self._retry = self.clock.callLater(delay, self._request_snapshot)
+
+    def load_snapshot(self, book):
+        """
+        Replace the book's contents with a full snapshot, then apply any events that happened after it.
+
+        :type book: schemas.OrderBook
+        """
+        self.bids.clear()
+        self.asks.clear()
+        for level in book['bids']:
+            self.bids.add(level['price'], level['amount'])
+        for level in book['asks']:
+            self.asks.add(level['price'], level['amount'])
+        self.snapshot_timestamp = book.get('timestamp')
+        microtimestamp = book.get('microtimestamp')
+        self.snapshot_microtimestamp = int(microtimestamp) if microtimestamp is not None else None
+        self.synced = True
+        self.failed_snapshots = 0
+        self._unknown_since_snapshot = 0
+        self._snapshot_at = self.last_update = self.clock.seconds()
+        self._replay_pending()
+
+    def reconcile(self, book):
+        """
+        Correct the levels covered by a partial snapshot, such as the ones from the order_book Pusher channel.
+
+        :type book: schemas.OrderBook
+        :returns: the number of levels that were different
+        """
+        changed = 0
+        for levels, snapshot_levels in ((self.bids, book['bids']), (self.asks, book['asks'])):
+            if snapshot_levels:
+                prices = [level['price'] for level in snapshot_levels]
+                changed += levels.replace_range(snapshot_levels, min(prices), max(prices))
+        if changed:
+            log.debug("Reconciled {} Bitstamp orderbook levels".format(changed))
+            self.reconciled_levels += changed
+        self.last_update = self.clock.seconds()
+        return changed
+
+    def on_order_change(self, change):
+        """
+        Apply a single order change event.
+
+        :type change: schemas.BitstampOrderChange
+        """
+        if self._pending is not None:
+            self._pending.append(change)
+        else:
+            self._apply(change)
+
+    def top(self, depth=None):
+        """:returns: the current book as a schemas.OrderBook, limited to depth levels per side"""
+        return {'bids': self.bids.top(depth), 'asks': self.asks.top(depth)}
+
+    def _replay_pending(self):
+        pending, self._pending = self._pending or [], None
+        for change in pending:
+            if self._after_snapshot(change):
+                self._apply(change)
+            else:
+                # already in the snapshot's levels, but the order's amount is still worth knowing
+                self._apply(change, update_levels=False)
+
+    def _after_snapshot(self, change):
+        if self.snapshot_microtimestamp is not None and change.get('microtimestamp') is not None:
+            return change['microtimestamp'] > self.snapshot_microtimestamp
+        # Only whole seconds to go by: events from the snapshot's own second might or might not be in it. Applying
+        # them can be off by an order at worst, which reconcile() fixes, where dropping them could lose an order.
+        return self.snapshot_timestamp is None or change['timestamp'] >= self.snapshot_timestamp
+
+    def _apply(self, change, update_levels=True):
+        """Apply an event. Repeated events (the same created or deleted order, or amount) are only applied once."""
+        levels = self.bids if change['direction'] == 'bid' else self.asks
+        order_id = change.get('id')
+        price = change['price']
+        amount = change['amount']
+        known = self._orders.get(order_id) if order_id is not None else None
+        if update_levels:
+            self.last_update = self.clock.seconds()
+
+        if change['change'] == 'deleted':
+            if order_id is not None and order_id in self._deleted:
+                return
+            if update_levels:
+                if known:
+                    old_levels, old_price, old_amount = known
+                    old_levels.add(old_price, -old_amount)
+                else:
+                    # deleted events carry the amount the order had left, so unknown orders can still be removed
+                    levels.add(price, -amount)
+            self._orders.pop(order_id, None)
+            if order_id is not None:
+                self._deleted[order_id] = True
+                if len(self._deleted) > self.DELETED_MEMORY:
+                    self._deleted.popitem(last=False)
+            return
+
+        if known:
+            # created again or changed: move the order's amount from what it was to what it is
+            if update_levels:
+                old_levels, old_price, old_amount = known
+                old_levels.add(old_price, -old_amount)
+                levels.add(price, amount)
+        elif change['change'] == 'created':
+            if update_levels:
+                levels.add(price, amount)
+        elif update_levels:
+            # Changed events carry the new remaining amount only, so for an order that was already in the snapshot
+            # the level can't be corrected. Its amount is known from here on, and a resync corrects the level.
+            self.unknown_changes += 1
+            self._unknown_since_snapshot += 1
+            self._maybe_resync()
+        if order_id is not None:
+            self._orders[order_id] = (levels, price, amount)
+
+    def _maybe_resync(self):
+        if self.resync_after is None or self._unknown_since_snapshot < self.resync_after or self._snapshot is None:
+            return
+        if self._snapshot_at is not None and self.clock.seconds() - self._snapshot_at < self.min_resync_interval:
+            return
+        log.info("{} changes to orders from before the Bitstamp orderbook snapshot, resyncing".format(
+            self._unknown_since_snapshot))
+        self.resync()
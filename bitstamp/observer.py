@@ -2,11 +2,11 @@
 
 import logging
 import time
-from collections import deque
-
 
 from exchangelib import schemas, simpleschema
+from exchangelib.tradewindow import TradeWindow
 from exchangelib.bitstamp.websocket import BitstampWebsocketAPI2
+from exchangelib.bitstamp.livebook import LiveOrderBook
 
 log = logging.getLogger(__name__)
 
@@ -18,15 +18,29 @@ log = logging.getLogger(__name__)
 
 
 class BitstampObserver(object):
-    def __init__(self):
-        self.api = BitstampWebsocketAPI2()
+    def __init__(self, seed_book=False, api=None, trade_window=None, max_book_age=60):
+        """
+        :param seed_book: whether to start the live book right away, see start()
+        :param api: websocket API to observe, by default one connected to Bitstamp
+        :type api: BitstampWebsocketAPI2
+        :param trade_window: where recent trades are kept, by default 1, 5 and 15 minute windows
+        :type trade_window: TradeWindow
+        :param max_book_age: seconds without updates after which the live book isn't trusted for prices
+        """
+        self.api = api if api is not None else BitstampWebsocketAPI2()
 
         self._highestbid = None
         self._lowestask = None
 
         self.last_orderbook = None
         self._orderbook = None
-        self.recent_trades = deque()
+        self.trade_window = trade_window if trade_window is not None else TradeWindow()
+
+        # kept up to date from individual order changes
+        self.live_book = LiveOrderBook()
+        self.max_book_age = max_book_age
+        if seed_book:
+            self.start()
 
         self.trade_listeners = set()
 
@@ -34,16 +48,40 @@ class BitstampObserver(object):
         self.api.listen('orderbook', self.on_orderbook)
         self.api.listen('orderchange', self.on_order_change)
 
+    def start(self):
+        """
+        Fetch a REST orderbook snapshot to start the live book from. Until it's synced, and whenever it hasn't been
+        updated for max_book_age, highestbid and lowestask come from the order_book channel instead.
+        :rtype: defer.Deferred
+        """
+        return self.live_book.start()
+
     @property
     def highestbid(self):
-        if self._is_orderbook_fresh():
+        if self._is_live_book_fresh():
+            return self.live_book.best_bid
+        elif self._is_orderbook_fresh():
             return self._highestbid
 
     @property
     def lowestask(self):
-        if self._is_orderbook_fresh():
+        if self._is_live_book_fresh():
+            return self.live_book.best_ask
+        elif self._is_orderbook_fresh():
             return self._lowestask
 
+    @property
+    def recent_trades(self):
+        """Trades still in the trade window, newest first"""
+        return self.trade_window.trades()
+
+    def trade_stats(self, window=None):
+        """
+        Volume, VWAP, trade count and buy/sell imbalance over a window, see TradeWindow.stats
+        :param window: window length in seconds, by default the shortest
+        """
+        return self.trade_window.stats(window, now=time.time())
+
     @property
     def orderbook(self):
         if self._orderbook and self._is_orderbook_fresh():
@@ -52,46 +90,41 @@ class BitstampObserver(object):
     def on_orderbook(self, data):
         """
         Callback, called when new bitstamp orderbook data available.
-        :type data: datatypes.OrderBook
+        :type data: schemas.OrderBook
         """
-
-        #if 'bids' in data and 'asks' in data and len(data['bids']) > 0 and len(data['asks']) > 0:
         try:
-            self._highestbid = data.bids[0].price
-            self._lowestask = data.asks[0].price
-        except (KeyError, AttributeError, IndexError):
+            self._highestbid = data['bids'][0]['price']
+            self._lowestask = data['asks'][0]['price']
+        except (KeyError, TypeError, IndexError):
             log.error("Bad orderbook data received", exc_info=True)
         else:
             # todo replace time.time call with utc
             self._orderbook = data
             self.last_orderbook = time.time()
+            if self.live_book.synced:
+                self.live_book.reconcile(data)
 
     def on_trade(self, data):
         """
         Callback, called when new bitstamp trade events
-        Data persisted in self.recent_trades.
-        :type data: datatypes.Trade
+        Data persisted in self.trade_window, then passed on to the trade listeners.
+        Trades that couldn't be tagged as buy or sell have no is_buy, and don't count towards the imbalance.
+        :type data: schemas.Trade
         """
         self._determine_trade_direction(data)
-        if not 'is_buy' in data:
-           # short circuit if not tagged as buy or sell
-            return
-        else:
-            self.recent_trades.appendleft(data)
-            # todo pop old ones??
-            for cb in self.trade_listeners:
-                pass
+        self.trade_window.add_trade(data)
+        for listener in list(self.trade_listeners):
+            try:
+                listener(data)
+            except Exception:
+                log.exception("Trade listener {!r} failed".format(listener))
 
     def on_order_change(self, data):
         """
-        :type data: datatypes.OrderChange
+        Callback, called on every order created, changed or deleted.
+        :type data: schemas.BitstampOrderChange
         """
-        try:
-            if self.orderbook.bids[-1].price < data.price < self.orderbook.asks[-1].price:
-                pass
-            #todo update orderbook with this info
-        except (IndexError, AttributeError):
-            pass
+        self.live_book.on_order_change(data)
 
     def add_trade_listener(self, listener):
         if callable(listener):
@@ -99,6 +132,12 @@ class BitstampObserver(object):
         else:
             raise ValueError("Listener must be a callable")
 
+    def _is_live_book_fresh(self):
+        """:returns: whether the live book is synced and has been updated within max_book_age"""
+        book = self.live_book
+        return (book.synced and book.last_update is not None and
+                book.clock.seconds() - book.last_update <= self.max_book_age)
+
     def _is_orderbook_fresh(self):
         """
         Check that the orderbook data is fresh.
@@ -117,7 +156,7 @@ class BitstampObserver(object):
         """
         Decides whether a given trade was a buy or sell, based on orderbook data.
         Exists because Bitstamp doesn't say whether an executed trade is a bid or an ask.
-        :type trade: datatypes.Trade
+        :type trade: schemas.Trade
         """
         bid = self.highestbid
         ask = self.lowestask
@@ -125,12 +164,12 @@ class BitstampObserver(object):
         if not bid or not ask:
             return
 
-        if trade.price <= bid:
+        if trade['price'] <= bid:
             # order executed under or at bid, so it's a sell
-            trade.is_buy = False
-        if trade.price >= ask:
+            trade['is_buy'] = False
+        if trade['price'] >= ask:
             # order executed at or above ask, so it's a buy
-            trade.is_buy = True
+            trade['is_buy'] = True
 
 
 #####################
@@ -143,13 +182,14 @@ def main():
 
     logging.basicConfig(level=logging.DEBUG)
 
-    obs = BitstampObserver()
+    obs = BitstampObserver(seed_book=True)
 
     def inform():
-        if len(obs.orderbook.bids) > 0:
+        if obs.orderbook and len(obs.orderbook['bids']) > 0:
             try:
                 print("Highest bid {:.2f}, lowest ask {:.2f}; lowest bid {:.2f} and highest ask {:.2f}.".format(
-                      obs.highestbid, obs.lowestask, obs.orderbook.bids[-1].price, obs.orderbook.asks[-1].price))
+                      obs.highestbid, obs.lowestask, obs.orderbook['bids'][-1]['price'],
+                      obs.orderbook['asks'][-1]['price']))
                 pass
             except TypeError as e:
                 log.debug("Error: {0}".format(e.message))
@@ -2,12 +2,11 @@
 
 import logging
 import time
-import json
-from decimal import Decimal
 
 from twistedpusher import Pusher
 
 from exchangelib import schemas, simpleschema
+from exchangelib.utils import parse_json
 from exchangelib.observable import Observable
 
 log = logging.getLogger(__name__)
@@ -20,7 +19,8 @@ log = logging.getLogger(__name__)
 class BitstampWebsocketAPI2(Observable):
     APP_KEY = "de504dc5763aeef9ff52"  # Bitstamp's Pusher API key
 
-    def __init__(self):
+    def __init__(self, pusher=None):
+        """:param pusher: Pusher client to use instead of connecting to Bitstamp, e.g. a replay.FakePusher"""
         super(BitstampWebsocketAPI2, self).__init__()
 
         # Pusher channels for live trades, order book, and live orders (order changes)
@@ -29,7 +29,7 @@ class BitstampWebsocketAPI2(Observable):
         self.orderchange_channel = None
 
         # todo consider moving back out to class variable...
-        self._pusher = Pusher(BitstampWebsocketAPI2.APP_KEY)
+        self._pusher = pusher if pusher is not None else Pusher(BitstampWebsocketAPI2.APP_KEY)
 
         # moving this back to being an instance variable, instead of class.
         # Initializing _pusher in class (where =None) instead of init makes it blow up spectacularly.
@@ -38,21 +38,21 @@ class BitstampWebsocketAPI2(Observable):
         #    pass
 
     # todo switch from time.time to utc
-    @simpleschema.returns(schemas.Trade)
+    @simpleschema.returns(schemas.Trade, timed=False)
     def trade(self, event):
-        data = json.loads(event.data, parse_float=Decimal)
+        data = parse_json(event.data)
         data['timestamp'] = time.time()
         return data
 
-    @simpleschema.returns(schemas.OrderBook)
+    @simpleschema.returns(schemas.OrderBook, timed=False)
     def orderbook(self, event):
         book = dict()
         book['bids'] = [{'price': pr, 'amount': amt} for pr, amt in event.data['bids']]
-        book['asks'] = [{'price': pr, 'amount': amt} for pr, amt in event.data['bids']]
+        book['asks'] = [{'price': pr, 'amount': amt} for pr, amt in event.data['asks']]
 
         return book
 
-    @simpleschema.returns(schemas.BitstampOrderChange)
+    @simpleschema.returns(schemas.BitstampOrderChange, timed=False)
     def orderchange(self, event):
         change = event.data
         if event.name == 'order_created':
@@ -94,11 +94,11 @@ def main():
 
     def inform(trade):
         print('{:<8d}{:<6.2f} @ ${:.2f}'.format(trade['id'], trade['amount'], trade['price']))
-    api.listen('trade', inform)
+    api.listen('trade', inform, weak=False)
 
     def inform_order(order):
         print('{:<8}{:<6.2f} @ ${:<10.2f}{}'.format(order['change'], order['amount'], order['price'], order['timestamp']))
-    api.listen('orderchange', inform_order)
+    api.listen('orderchange', inform_order, weak=False)
 
     from twisted.internet import reactor
     reactor.run()
@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+
+import logging
+import random
+from decimal import Decimal
+from itertools import islice, takewhile
+
+from exchangelib.simpleschema import Validated
+
+log = logging.getLogger(__name__)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class BookSide(object):
+    """
+    One side of an order book, stored as parallel lists of Decimal prices and amounts, best price first.
+    """
+    __slots__ = ('prices', 'amounts')
+
+    def __init__(self, prices=None, amounts=None):
+        self.prices = list(prices or ())
+        self.amounts = list(amounts or ())
+        if len(self.prices) != len(self.amounts):
+            raise ValueError("Got {} prices but {} amounts".format(len(self.prices), len(self.amounts)))
+
+    @classmethod
+    def from_levels(cls, levels):
+        """
+        Make a side out of [price, amount] pairs, as returned by most exchange APIs.
+        """
+        side = cls()
+        if levels:
+            prices, amounts = zip(*[level[:2] for level in levels])
+            side.prices = [_to_decimal(p) for p in prices]
+            side.amounts = [_to_decimal(a) for a in amounts]
+        return side
+
+    @classmethod
+    def from_orders(cls, orders):
+        """Make a side out of a list of schemas.Order dicts."""
+        return cls.from_levels([(order['price'], order['amount']) for order in orders])
+
+    def to_list(self):
+        """Convert to a list of schemas.Order dicts."""
+        return [{'price': p, 'amount': a} for p, a in zip(self.prices, self.amounts)]
+
+    def as_numpy(self):
+        """
+        Get the side as a float64 array with shape (levels, 2), prices in the first column.
+
+        :raises ImportError: if numpy isn't installed
+        """
+        if numpy is None:
+            raise ImportError("numpy is required for as_numpy()")
+        array = numpy.empty((len(self.prices), 2), dtype=numpy.float64)
+        array[:, 0] = self.prices
+        array[:, 1] = self.amounts
+        return array
+
+    def truncate(self, depth):
+        """Drop every level after the first depth levels."""
+        del self.prices[depth:]
+        del self.amounts[depth:]
+
+    def __len__(self):
+        return len(self.prices)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return BookSide(self.prices[index], self.amounts[index])
+        return {'price': self.prices[index], 'amount': self.amounts[index]}
+
+    def __iter__(self):
+        for price, amount in zip(self.prices, self.amounts):
+            yield {'price': price, 'amount': amount}
+
+    def __repr__(self):
+        return '<BookSide with {} levels>'.format(len(self))
+
+
+class OrderBook(Validated):
+    """
+    Columnar order book, an alternative to the schemas.OrderBook list-of-dicts structure that avoids making a dict
+    for every level. Bids are sorted highest first and asks lowest first.
+
+    Data API orderbook() functions return one of these when called with columnar=True.
+    """
+    __slots__ = ('bids', 'asks', 'timestamp')
+
+    def __init__(self, bids=None, asks=None, timestamp=None):
+        """
+        :type bids: BookSide
+        :type asks: BookSide
+        :type timestamp: int or None
+        """
+        self.bids = bids if bids is not None else BookSide()
+        self.asks = asks if asks is not None else BookSide()
+        self.timestamp = int(timestamp) if timestamp is not None else None
+
+    @classmethod
+    def from_levels(cls, bids, asks, timestamp=None):
+        """Make an order book out of lists of [price, amount] pairs."""
+        return cls(BookSide.from_levels(bids), BookSide.from_levels(asks), timestamp)
+
+    @classmethod
+    def from_dict(cls, book):
+        """Make an order book out of a dict like schemas.OrderBook."""
+        return cls(BookSide.from_orders(book['bids']), BookSide.from_orders(book['asks']), book.get('timestamp'))
+
+    def to_dict(self):
+        """Convert to the schemas.OrderBook structure."""
+        book = {'bids': self.bids.to_list(), 'asks': self.asks.to_list()}
+        if self.timestamp is not None:
+            book['timestamp'] = self.timestamp
+        return book
+
+    def as_numpy(self):
+        """:returns: a tuple of (bids, asks) arrays, see BookSide.as_numpy"""
+        return self.bids.as_numpy(), self.asks.as_numpy()
+
+    def truncate(self, depth):
+        """Keep only the best depth levels on each side."""
+        self.bids.truncate(depth)
+        self.asks.truncate(depth)
+        return self
+
+    @property
+    def best_bid(self):
+        return self.bids.prices[0] if self.bids.prices else None
+
+    @property
+    def best_ask(self):
+        return self.asks.prices[0] if self.asks.prices else None
+
+    @property
+    def spread(self):
+        if self.bids.prices and self.asks.prices:
+            return self.asks.prices[0] - self.bids.prices[0]
+
+    @property
+    def mid(self):
+        if self.bids.prices and self.asks.prices:
+            return (self.asks.prices[0] + self.bids.prices[0]) / 2
+
+    def __getitem__(self, key):
+        # allow dict-style access, so code written against schemas.OrderBook mostly keeps working
+        if key in OrderBook.__slots__:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __repr__(self):
+        return '<OrderBook with {} bids and {} asks>'.format(len(self.bids), len(self.asks))
+
+
+def _to_decimal(value):
+    if type(value) is Decimal:
+        return value
+    return Decimal(value)
+
+
+class _SkipList(object):
+    """
+    Sorted keys with expected O(log n) inserts, removals and lookups of where a range starts, and iteration in
+    order from there.
+
+    Nodes are [key, forward pointers] lists, with one pointer per level the node is on.
+    """
+    MAX_LEVEL = 16  # plenty for 4 ** 16 keys
+
+    def __init__(self):
+        self._head = [None, [None] * self.MAX_LEVEL]
+        self._level = 1
+        self._len = 0
+
+    def _predecessors(self, key):
+        """The last node before key on each level"""
+        update = [self._head] * self.MAX_LEVEL
+        node = self._head
+        for i in range(self._level - 1, -1, -1):
+            following = node[1][i]
+            while following is not None and following[0] < key:
+                node = following
+                following = node[1][i]
+            update[i] = node
+        return update
+
+    def insert(self, key):
+        """Add a key, which must not be in the list already"""
+        update = self._predecessors(key)
+        level = 1
+        while level < self.MAX_LEVEL and random.random() < 0.25:
+            level += 1
+        self._level = max(self._level, level)
+        node = [key, [None] * level]
+        for i in range(level):
+            node[1][i] = update[i][1][i]
+            update[i][1][i] = node
+        self._len += 1
+
+    def remove(self, key):
+        """:returns: whether the key was there"""
+        update = self._predecessors(key)
+        node = update[0][1][0]
+        if node is None or node[0] != key:
+            return False
+        for i in range(len(node[1])):
+            update[i][1][i] = node[1][i]
+        while self._level > 1 and self._head[1][self._level - 1] is None:
+            self._level -= 1
+        self._len -= 1
+        return True
+
+    def first(self):
+        node = self._head[1][0]
+        return node[0] if node is not None else None
+
+    def iter_from(self, key=None):
+        """Keys in order, starting from the first one that isn't below key"""
+        node = self._head[1][0] if key is None else self._predecessors(key)[0][1][0]
+        while node is not None:
+            yield node[0]
+            node = node[1][0]
+
+    def __len__(self):
+        return self._len
+
+
+class PriceLevels(object):
+    """
+    Price-indexed levels for one side of a live order book.
+
+    Prices are kept in a skip list ordered best first and amounts in a dict, so changing a level is expected
+    O(log n) however deep the book is, and the best price is always the first in the list.
+    """
+
+    def __init__(self, descending=False):
+        """:param descending: True for bids, where the highest price is the best"""
+        self.descending = descending
+        self._prices = _SkipList()
+        self._amounts = dict()
+
+    def _key(self, price):
+        # bids are stored negated, so the skip list's order is best first on both sides
+        return -price if self.descending else price
+
+    @property
+    def best(self):
+        """The best price, or None if there are no levels."""
+        key = self._prices.first()
+        if key is None:
+            return None
+        return self._key(key)
+
+    def amount(self, price):
+        return self._amounts.get(price, Decimal(0))
+
+    def set(self, price, amount):
+        """Set the total amount at a price, removing the level if the amount is zero or less."""
+        if amount <= 0:
+            self.remove(price)
+        elif price in self._amounts:
+            self._amounts[price] = amount
+        else:
+            self._prices.insert(self._key(price))
+            self._amounts[price] = amount
+
+    def add(self, price, amount):
+        """Change the amount at a price by amount, which can be negative."""
+        self.set(price, self.amount(price) + amount)
+
+    def remove(self, price):
+        if self._amounts.pop(price, None) is not None:
+            self._prices.remove(self._key(price))
+
+    def replace_range(self, levels, low, high):
+        """
+        Make the levels between low and high (inclusive) match the given ones.
+
+        :param levels: schemas.Order dicts, all with prices between low and high
+        :returns: the number of levels that had to be changed
+        """
+        wanted = dict((level['price'], level['amount']) for level in levels)
+        first, last = (-high, -low) if self.descending else (low, high)
+        in_range = list(takewhile(lambda key: key <= last, self._prices.iter_from(first)))
+        changed = 0
+        for key in in_range:
+            price = self._key(key)
+            if price not in wanted:
+                self.remove(price)
+                changed += 1
+        for price, amount in wanted.items():
+            if self._amounts.get(price) != amount:
+                self.set(price, amount)
+                changed += 1
+        return changed
+
+    def clear(self):
+        self._prices = _SkipList()
+        self._amounts = dict()
+
+    def top(self, depth=None):
+        """:returns: the best depth levels (or all of them) as schemas.Order dicts, best first"""
+        return [{'price': price, 'amount': self._amounts[price]}
+                for price in (self._key(key) for key in islice(self._prices.iter_from(), depth))]
+
+    def __len__(self):
+        return len(self._prices)
+
+    def __contains__(self, price):
+        return price in self._amounts
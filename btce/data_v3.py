@@ -1,56 +1,88 @@
 # !/usr/bin/env python
 
 import logging
+import copy
+from collections import OrderedDict
 from zope.interface import moduleProvides
 
 from exchangelib.interfaces import IDataAPI
+from exchangelib import utils
 from exchangelib.utils import get_json
+from exchangelib.compat import string_types
+from exchangelib.errors import APIError
 from exchangelib import schemas, simpleschema
+from exchangelib.book import OrderBook
 
 log = logging.getLogger(__name__)
 moduleProvides(IDataAPI)
 
-__all__ = ['ticker', 'orderbook', 'trades', 'pair_info']
+__all__ = ['ticker', 'orderbook', 'trades', 'pair_info', 'ticker_batch', 'orderbook_batch', 'trades_batch']
 
 # todo pairs/currencies
 PAIRS = ['btcusd']
 DATA_API_URL = "https://btc-e.com/api/3/"
 
 # API v3
-# todo support multi-pair queries
 # todo add options
 # todo pull out the pair key e.g. btc_usd
 
+# Single pair calls made in the same reactor iteration are combined into one request, since the v3 API
+# takes multiple pairs like btc_usd-ltc_usd. The *_batch functions request a list of pairs directly.
+
 
 # todo add basis_volume to dec conversion? float so done auto for now
 @simpleschema.returns(schemas.Ticker)
 def ticker(pair='btcusd'):
     # api fails with code 200 and     {u'error': u'Invalid method', u'success': 0}
-    def process(data):
-        new = data[_convert_pair(pair)]
-        return simpleschema.remap(new, {'buy': 'bid', 'sell': 'ask', 'updated': 'timestamp',
-                                        'vol': 'volume', 'vol_cur': 'basis_volume', 'avg': 'mid'})
-    return get_json(url=_make_url('ticker', pair)).addCallback(process)
+    return _batcher.fetch('ticker', pair).addCallback(_process_ticker)
 
 
 @simpleschema.returns(schemas.OrderBook)
-def orderbook(pair='btcusd', limit_orders=150):
-    def process(data):
-        new = data[_convert_pair(pair)]
-        new['bids'] = [{'price': b[0], 'amount': b[1]} for b in new['bids']]
-        new['asks'] = [{'price': a[0], 'amount': a[1]} for a in new['asks']]
-        return new
-    return get_json(url=_make_url('depth', pair)).addCallback(process)
+def orderbook(pair='btcusd', limit_orders=150, columnar=False, depth=None):
+    # depth is the same as limit_orders, for consistency with the other exchanges
+    params = {'limit': depth if depth is not None else limit_orders}
+    return _batcher.fetch('depth', pair, params).addCallback(_process_orderbook, columnar)
 
 
 @simpleschema.returns(schemas.TradeList)
 def trades(pair='btcusd', limit_trades=150):
+    return _batcher.fetch('trades', pair).addCallback(_process_trades)
+
+
+def ticker_batch(pairs):
+    """
+    Get tickers for several pairs in one request.
+
+    :type pairs: list of str
+    :returns: a Deferred firing with a dict of pair -> schemas.Ticker
+    :rtype: defer.Deferred
+    """
+    return _get_batch('ticker', pairs, _process_ticker, _validate_ticker)
+
+
+def orderbook_batch(pairs, limit_orders=150, columnar=False):
+    """
+    Get orderbooks for several pairs in one request.
+
+    :type pairs: list of str
+    :param limit_orders: levels on each side, for every pair
+    :returns: a Deferred firing with a dict of pair -> schemas.OrderBook (or book.OrderBook if columnar)
+    :rtype: defer.Deferred
+    """
     def process(data):
-        new = data[_convert_pair(pair)]
-        for trade in new:
-            trade['direction'] = bool(trade.pop('type') == 'bid')
-        return simpleschema.remap(new, [{'tid': 'id'}])
-    return get_json(url=_make_url('trades', pair)).addCallback(process)
+        return _process_orderbook(data, columnar)
+    return _get_batch('depth', pairs, process, _validate_orderbook, params={'limit': limit_orders})
+
+
+def trades_batch(pairs, limit_trades=150):
+    """
+    Get recent trades for several pairs in one request.
+
+    :type pairs: list of str
+    :returns: a Deferred firing with a dict of pair -> schemas.TradeList
+    :rtype: defer.Deferred
+    """
+    return _get_batch('trades', pairs, _process_trades, _validate_trades)
 
 
 # todo naming of this ( + entry in __all__)
@@ -59,6 +91,118 @@ def pair_info(pair='btcusd'):
     return get_json(url=_make_url('info', pair))
 
 
+def _process_ticker(data):
+    return simpleschema.remap(data, {'buy': 'bid', 'sell': 'ask', 'updated': 'timestamp',
+                                     'vol': 'volume', 'vol_cur': 'basis_volume', 'avg': 'mid'})
+
+
+def _process_orderbook(data, columnar=False):
+    if columnar:
+        return OrderBook.from_levels(data['bids'], data['asks'])
+    data['bids'] = [{'price': b[0], 'amount': b[1]} for b in data['bids']]
+    data['asks'] = [{'price': a[0], 'amount': a[1]} for a in data['asks']]
+    return data
+
+
+def _process_trades(data):
+    for trade in data:
+        trade['direction'] = bool(trade.pop('type') == 'bid')
+    return simpleschema.remap(data, [{'tid': 'id'}])
+
+_validate_ticker = simpleschema.compile(schemas.Ticker)
+_validate_orderbook = simpleschema.compile(schemas.OrderBook)
+_validate_trades = simpleschema.compile(schemas.TradeList)
+
+
+def _get_batch(api_call, pairs, process, validate, params=None):
+    def split(data):
+        _check_error(data)
+        results = dict()
+        for pair in pairs:
+            try:
+                result = process(data[_convert_pair(pair)])
+            except KeyError:
+                raise APIError("No BTC-e {} data for pair {}".format(api_call, pair))
+            results[pair] = result if isinstance(result, simpleschema.Validated) else validate(result)
+        return results
+    return get_json(url=_make_url(api_call, pairs), params=params).addCallback(split)
+
+
+def _check_error(data):
+    if 'error' in data and data.get('success') == 0:
+        raise APIError("BTC-e API error: {}".format(data['error']))
+    return data
+
+
+def _pair_data(data, api_call, pair):
+    pair_data = data.get(_convert_pair(pair))
+    if pair_data is None:
+        raise APIError("No BTC-e {} data for pair {}".format(api_call, pair))
+    return pair_data
+
+
+class _PairBatcher(object):
+    """Combines requests for single pairs made in the same reactor iteration into one multi-pair request."""
+
+    def __init__(self):
+        # (api_call, params) -> OrderedDict of pair -> list of Deferreds waiting for that pair's data
+        self._pending = dict()
+
+    def fetch(self, api_call, pair, params=None):
+        """
+        :returns: a Deferred firing with the unprocessed data for a single pair
+        :rtype: defer.Deferred
+        """
+        if utils.capture is not None:
+            # running under aio, outside the reactor, so there's nothing to batch with
+            d = get_json(url=_make_url(api_call, pair), params=params)
+            return d.addCallback(_check_error).addCallback(_pair_data, api_call, pair)
+
+        from twisted.internet import defer, reactor
+        # a bad pair fails this call now, rather than the whole batch later
+        _convert_pair(pair)
+        key = (api_call, tuple(sorted((params or {}).items())))
+        if key not in self._pending:
+            self._pending[key] = OrderedDict()
+            reactor.callLater(0, self._flush, key)
+        d = defer.Deferred()
+        self._pending[key].setdefault(pair, []).append(d)
+        return d
+
+    def _flush(self, key):
+        from twisted.internet import defer
+        waiting = self._pending.pop(key)
+        api_call, params = key
+
+        def distribute(data):
+            _check_error(data)
+            for pair, deferreds in waiting.items():
+                try:
+                    pair_data = _pair_data(data, api_call, pair)
+                except APIError as error:
+                    for d in deferreds:
+                        d.errback(error)
+                    continue
+                # each caller processes the data in place, so all but the first get their own copy, made before
+                # any of them has had a chance to change it
+                results = [pair_data] + [copy.deepcopy(pair_data) for _ in deferreds[1:]]
+                for d, result in zip(deferreds, results):
+                    d.callback(result)
+
+        def failed(failure):
+            for deferreds in waiting.values():
+                for d in deferreds:
+                    if not d.called:
+                        d.errback(failure)
+
+        # flushed outside of any caller's metrics.Span, so labelled by API call rather than by this function
+        d = defer.maybeDeferred(lambda: get_json(url=_make_url(api_call, list(waiting)), params=dict(params) or None,
+                                                 label='btce.data_v3.batched_' + api_call))
+        d.addCallback(distribute).addErrback(failed)
+
+_batcher = _PairBatcher()
+
+
 def _convert_pair(pair):
     if len(pair) == 6:
         return pair[:3] + '_' + pair[3:]
@@ -67,5 +211,11 @@ def _convert_pair(pair):
         raise ValueError("Cannot convert pair {} because it isn't 6 chars".format(pair))
 
 
-def _make_url(api_call, pair=None):
-    return DATA_API_URL + api_call + '/' + _convert_pair(pair) + '/'
+def _make_url(api_call, pairs=None):
+    """:type pairs: str or list of str"""
+    url = DATA_API_URL + api_call + '/'
+    if pairs:
+        if isinstance(pairs, string_types):
+            pairs = [pairs]
+        url += '-'.join(_convert_pair(pair) for pair in pairs) + '/'
+    return url
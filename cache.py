@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+import logging
+import time
+from collections import OrderedDict
+
+from twisted.internet import defer
+from twisted.python.failure import Failure
+
+log = logging.getLogger(__name__)
+
+
+class ResponseCache(object):
+    """
+    Caches response bodies for GET requests, and makes concurrent identical requests share one fetch.
+
+    Bodies are cached rather than parsed data, since callers tend to modify the parsed data in place.
+    Entries are kept for the TTL of the longest matching URL prefix (default_ttl if none match),
+    and the least recently used entry is dropped once there are more than max_entries.
+    A TTL of 0 means responses aren't cached, but identical requests that are in flight at the same time
+    are still coalesced.
+    """
+
+    def __init__(self, max_entries=256, default_ttl=0, now=time.time):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.now = now
+        self.ttls = dict()
+
+        self._entries = OrderedDict()
+        self._in_flight = dict()
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def set_ttl(self, url_prefix, ttl):
+        """
+        Set how long responses from URLs starting with url_prefix are cached for.
+
+        :type url_prefix: str
+        :param ttl: seconds, or 0 to not cache
+        :type ttl: int or float
+        """
+        self.ttls[url_prefix] = ttl
+
+    def ttl(self, url):
+        matches = [prefix for prefix in self.ttls if url.startswith(prefix)]
+        if matches:
+            return self.ttls[max(matches, key=len)]
+        return self.default_ttl
+
+    def fetch(self, fetcher, url, params=None):
+        """
+        Get a response body from the cache, or using fetcher(url, params) if it isn't cached.
+
+        :param fetcher: function returning a Deferred that fires with the body, such as utils.get
+        :returns: a Deferred for each caller, all firing with the same body
+        :rtype: defer.Deferred
+        """
+        key = _key(url, params)
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires, body = entry
+            if expires > self.now():
+                self.hits += 1
+                # move to the end, so it is the most recently used
+                self._entries[key] = self._entries.pop(key)
+                return defer.succeed(body)
+            else:
+                del self._entries[key]
+
+        waiting = defer.Deferred(lambda d: self._cancelled(key, d))
+        if key in self._in_flight:
+            self.coalesced += 1
+            self._in_flight[key].append(waiting)
+            return waiting
+
+        self.misses += 1
+        self._in_flight[key] = [waiting]
+
+        def done(result):
+            waiters = self._in_flight.pop(key)
+            if isinstance(result, Failure):
+                for d in waiters:
+                    d.errback(result)
+            else:
+                self._store(key, result, self.ttl(url))
+                for d in waiters:
+                    d.callback(result)
+        fetcher(url, params).addBoth(done)
+        return waiting
+
+    def _cancelled(self, key, waiting):
+        # the fetch carries on for the other callers, and is still cached
+        waiters = self._in_flight.get(key)
+        if waiters is not None and waiting in waiters:
+            waiters.remove(waiting)
+
+    def purge(self):
+        """Drop every cached response. Requests in flight are unaffected."""
+        self._entries.clear()
+
+    def _store(self, key, body, ttl):
+        if ttl <= 0:
+            return
+        self._entries[key] = (self.now() + ttl, body)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _key(url, params):
+    # list values (e.g. for repeated parameters) as tuples, so the key is hashable
+    items = (params or {}).items()
+    return url, tuple(sorted((name, tuple(value) if isinstance(value, list) else value) for name, value in items))
+
+
+# Shared by utils.get_json
+response_cache = ResponseCache()
+
+
+def set_ttl(url_prefix, ttl):
+    """Set the TTL for URLs starting with url_prefix in the shared cache, see ResponseCache.set_ttl"""
+    response_cache.set_ttl(url_prefix, ttl)
+
+
+def purge():
+    """Empty the shared cache."""
+    response_cache.purge()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+import logging
+from collections import deque
+
+from exchangelib.observable import Observable
+
+log = logging.getLogger(__name__)
+
+# candle periods, in seconds
+PERIODS = {'1m': 60, '5m': 300, '15m': 900, '30m': 1800, '1h': 3600, '4h': 14400, '1d': 86400}
+
+
+class CandleBuilder(Observable):
+    """
+    Builds OHLC candles from a stream of trades, for several periods at once.
+
+    Listen to 'candle' for candles as they close, optionally for one period only::
+
+        builder = CandleBuilder()
+        builder.follow(BitstampWebsocketAPI2())
+        builder.listen('candle', on_hourly_candle, period=3600)
+
+    Candles are schemas.OHLCData with a 'period' (in seconds), timestamped at the start of their period.
+    Periods without trades get no candle.
+
+    A candle closes when the first trade of a later period comes in, or when close_due is called (on a timer by
+    start) after its period ends. Trades for a candle that has already been closed are counted in `late` and left
+    out, since its listeners have had it.
+
+    Trades with an id are only added once. The ids are remembered for as long as some candle could still take
+    the trade, so repeats are caught whatever order trades come in.
+    """
+
+    def __init__(self, periods=('1m', '5m', '15m', '1h', '4h', '1d')):
+        """
+        :param periods: names from PERIODS, or lengths in seconds
+        :raises ValueError: on an unknown period name
+        """
+        super(CandleBuilder, self).__init__()
+        try:
+            self.periods = sorted(set(PERIODS[p] if p in PERIODS else int(p) for p in periods))
+        except ValueError:
+            raise ValueError("Unknown candle period in {!r}, expected one of {}".format(periods, sorted(PERIODS)))
+        # period -> the open candle
+        self._open = dict()
+        # period -> start of the last candle closed, so late trades aren't put into a new candle for it
+        self._closed = dict()
+        # ids of the trades added that some candle could still take, to skip trades repeated by overlapping polls,
+        # and (timestamp, id) in the order they were added, to forget them by
+        self._seen = set()
+        self._seen_order = deque()
+        self.late = 0
+        self._job = None
+
+    def candle(self, candle):
+        """
+        Called with each candle as it closes, listen to this.
+        :type candle: schemas.OHLCData
+        """
+        return candle
+
+    def add_trade(self, trade):
+        """
+        Update the open candles with a trade, closing the ones it comes after.
+        :type trade: schemas.Trade
+        """
+        timestamp, price, amount = trade['timestamp'], trade['price'], trade['amount']
+        trade_id = trade.get('id')
+        if trade_id is not None:
+            if trade_id in self._seen:
+                return
+            self._seen.add(trade_id)
+            self._seen_order.append((timestamp, trade_id))
+
+        for period in self.periods:
+            start = int(timestamp) // period * period
+            candle = self._open.get(period)
+            if candle is not None and start > candle['timestamp']:
+                self._close(period)
+                candle = None
+
+            if candle is None:
+                if start <= self._closed.get(period, start - 1):
+                    self.late += 1
+                    continue
+                self._open[period] = {'period': period, 'timestamp': start, 'open': price, 'high': price,
+                                      'low': price, 'close': price, 'volume': amount}
+            elif start < candle['timestamp']:
+                self.late += 1
+            else:
+                if price > candle['high']:
+                    candle['high'] = price
+                elif price < candle['low']:
+                    candle['low'] = price
+                candle['close'] = price
+                candle['volume'] += amount
+
+    def add_trades(self, trades):
+        """
+        Add a list of trades, e.g. from a polled trades(). They're added oldest first, whatever order they're in,
+        and ones already added are skipped (by id).
+        :type trades: schemas.TradeList
+        :returns: trades, to be used as a callback
+        """
+        for trade in sorted(trades, key=lambda t: (t['timestamp'], t.get('id', -1))):
+            self.add_trade(trade)
+        return trades
+
+    def close_due(self, now):
+        """
+        Close candles whose period has ended, even if no trade has come in to close them.
+        :param now: unix time
+        """
+        for period in self.periods:
+            candle = self._open.get(period)
+            if candle is not None and candle['timestamp'] + period <= now:
+                self._close(period)
+
+    def open_candle(self, period):
+        """
+        :param period: name from PERIODS, or length in seconds
+        :returns: a copy of the candle being built, or None if it has no trades yet
+        :rtype: schemas.OHLCData
+        """
+        candle = self._open.get(PERIODS.get(period, period))
+        return dict(candle) if candle is not None else None
+
+    def follow(self, api):
+        """Build candles from every trade of an observable, e.g. a BitstampWebsocketAPI2"""
+        return api.listen('trade', self.add_trade)
+
+    def start(self, interval=1, poll_scheduler=None):
+        """
+        Call close_due every interval seconds, so candles close on time in quiet markets.
+
+        :param poll_scheduler: scheduler.PollScheduler to run on, defaults to the shared one
+        """
+        from exchangelib import scheduler
+        if poll_scheduler is None:
+            poll_scheduler = scheduler.default_scheduler()
+        clock = poll_scheduler.clock
+        self._job = poll_scheduler.add(interval, lambda: self.close_due(clock.seconds()), now=False)
+
+    def stop(self):
+        if self._job is not None:
+            self._job.stop()
+        self._job = None
+
+    def _close(self, period):
+        candle = self._open.pop(period)
+        self._closed[period] = candle['timestamp']
+        self._forget_ids()
+        self.candle(candle)
+
+    def _forget_ids(self):
+        # trades from before every open candle, and every period closed already, are late for all of them
+        horizon = None
+        for period in self.periods:
+            if period in self._open:
+                start = self._open[period]['timestamp']
+            elif period in self._closed:
+                start = self._closed[period] + period
+            else:
+                return
+            horizon = start if horizon is None else min(horizon, start)
+        while self._seen_order and self._seen_order[0][0] < horizon:
+            self._seen.discard(self._seen_order.popleft()[1])
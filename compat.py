@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+"""Names that differ between Python 2 and 3, for the modules shared with the asyncio backend (see aio)."""
+
+try:
+    string_types = basestring
+    text_type = unicode
+except NameError:
+    string_types = str
+    text_type = str
+
+
+def native_str(value):
+    """Text or bytes as the native str type, converted with UTF-8 where they aren't already"""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value.encode('utf-8')
+
+
+try:
+    from urlparse import urlparse, parse_qsl
+    from urllib import urlencode
+except ImportError:
+    from urllib.parse import urlparse, parse_qsl, urlencode
+
+try:
+    from collections.abc import Iterable
+except ImportError:
+    from collections import Iterable
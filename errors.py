@@ -6,10 +6,11 @@ class APIError(IOError):
 
 
 class HTTPError(IOError):
-    """Problem with an HTTP resonse, such as a 400 code."""
-    def __init__(self, message, code=None):
+    """Problem with an HTTP resonse, such as a 400 code. body is the response body, if it could be read."""
+    def __init__(self, message, code=None, body=None):
         super(HTTPError, self).__init__(message)
         self.code = code
+        self.body = body
 
 
 class ConnectionError(IOError):
@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 
+import json
 import logging
+import os
+import tempfile
 from decimal import Decimal, InvalidOperation
 from collections import OrderedDict
 try:
@@ -8,10 +11,21 @@ try:
 except ImportError:
     from xml.etree import ElementTree
 
-from twisted.internet import defer
-from twisted.application import service
+try:
+    from twisted.internet import defer
+    from twisted.application import service
+except ImportError:
+    # without Twisted, only aio can update the data sources and there is no ForexConverterService
+    defer = service = None
 
 from exchangelib import utils, errors
+from exchangelib.book import OrderBook, BookSide
+from exchangelib.observable import Observable
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 log = logging.getLogger(__name__)
 
@@ -19,18 +33,30 @@ log = logging.getLogger(__name__)
 # todo consider changing to a money.exchange backend
 # todo allow passing a data source object?
 class ForexConverter(object):
-    def __init__(self, open_exchange_rates_appid=None):
+    def __init__(self, open_exchange_rates_appid=None, snapshot_dir=None):
+        """
+        :param snapshot_dir: directory the data sources save their rates in, so they're available right away on
+            the next start (see BaseForexDataSource)
+        """
         self.oer_id = open_exchange_rates_appid
 
         self.datasources = OrderedDict()
 
-        self.datasources['FXCM'] = FXCMData()
+        self.datasources['FXCM'] = FXCMData(snapshot_dir)
         if self.oer_id:
-            self.datasources['OpenExchangeRates'] = OERData(self.oer_id)
+            self.datasources['OpenExchangeRates'] = OERData(self.oer_id, snapshot_dir)
         # Yahoo quotes don't have enough sig figs. Especially obvious with stuff like XAU
-        self.datasources['Yahoo'] = YahooFXData()
+        self.datasources['Yahoo'] = YahooFXData(snapshot_dir)
         # These ECB rates are daily reference rates
-        self.datasources['ECB'] = ECBData()
+        self.datasources['ECB'] = ECBData(snapshot_dir)
+
+        # base -> quote -> rate, for every pair any data source has, rebuilt by rebuild_matrix
+        self._matrix = dict()
+        for datasource in self.datasources.values():
+            datasource.listen('rates_changed', self._refresher(datasource), weak=False)
+        if any(datasource.rates for datasource in self.datasources.values()):
+            # loaded from snapshots
+            self.rebuild_matrix()
 
         # Some other data sources http://currencysystem.com/currencyserver/feeds/
         # themoneyconverter.com?
@@ -54,14 +80,21 @@ class ForexConverter(object):
         return amount * self.rate(base, quote)
 
     def rate(self, base, quote):
-        """Exchange rate for a currency pair"""
+        """
+        Exchange rate for a currency pair.
+        Looked up in the cross-rate matrix, falling back to asking each data source in turn for pairs that aren't in
+        it (when rates were updated without going through update_rates).
+        """
         try:
             base = base.upper()
             quote = quote.upper()
         except (SyntaxError, AttributeError):
             raise TypeError("A currency name was not a string: '{}' and '{}'".format(base, quote))
+        row = self._matrix.get(base)
+        if row is not None and quote in row:
+            return row[quote]
 
-        for dsname, datasource in self.datasources.iteritems():
+        for dsname, datasource in self.datasources.items():
             try:
                 rate = datasource.current_rate(base, quote)
             except ValueError:
@@ -71,48 +104,171 @@ class ForexConverter(object):
                 return rate
         raise ValueError("Unknown currency pair {}{}".format(base, quote))
 
+    def convert_many(self, amounts, base, quote):
+        """
+        Convert a sequence of amounts with a single rate lookup.
+
+        Numpy arrays of Decimals (dtype object) are converted exactly. Arrays of floats are multiplied by the rate
+        as a float, so they lose precision past the 15-17 significant digits a float has, as float arrays always do.
+
+        :param amounts: Decimals, or a numpy array
+        :returns: a list of Decimals, or a numpy array of the same dtype if given one
+        :raises ValueError: on an unknown currency pair
+        """
+        rate = self.rate(base, quote)
+        if numpy is not None and isinstance(amounts, numpy.ndarray):
+            return amounts * (rate if amounts.dtype == object else float(rate))
+        return [amount * rate for amount in amounts]
+
+    def convert_book(self, book, base, quote):
+        """
+        Convert the prices of an order book from one currency to another, e.g. a BTC/CNY book to BTC/USD.
+        Amounts are left as they are.
+
+        :param book: schemas.OrderBook, or a columnar book.OrderBook
+        :returns: a new order book of the same kind
+        :raises ValueError: on an unknown currency pair
+        """
+        rate = self.rate(base, quote)
+        if isinstance(book, OrderBook):
+            return OrderBook(BookSide([price * rate for price in book.bids.prices], book.bids.amounts),
+                             BookSide([price * rate for price in book.asks.prices], book.asks.amounts),
+                             book.timestamp)
+        converted = dict(book)
+        for side in ('bids', 'asks'):
+            converted[side] = [dict(order, price=order['price'] * rate) for order in book[side]]
+        return converted
+
+    def convert_trades(self, trades, base, quote):
+        """
+        Convert the prices of a list of trades, see convert_book
+
+        :type trades: schemas.TradeList
+        :rtype: schemas.TradeList
+        """
+        rate = self.rate(base, quote)
+        return [dict(trade, price=trade['price'] * rate) for trade in trades]
+
+    def rebuild_matrix(self):
+        """
+        Work out the rate of every pair from the data sources' current rates, each from the first data source
+        (in order of preference) that has both currencies. Called once update_rates is done.
+        """
+        matrix = dict()
+        # least preferred first, so better data sources overwrite their rates
+        for datasource in reversed(list(self.datasources.values())):
+            rates = [(currency, rate) for currency, rate in datasource.rates.items()
+                     if isinstance(rate, Decimal) and rate]
+            for base, base_rate in rates:
+                row = matrix.setdefault(base, dict())
+                for quote, quote_rate in rates:
+                    row[quote] = quote_rate / base_rate
+        self._matrix = matrix
+        return matrix
+
+    def _refresher(self, datasource):
+        def refresh(changed):
+            if not self._matrix:
+                # nothing to refresh until the matrix is first built
+                return
+            if None in changed.values():
+                # currencies were dropped, and their pairs might come from another data source now
+                self.rebuild_matrix()
+            else:
+                self._refresh_matrix(datasource, changed)
+        return refresh
+
+    def _refresh_matrix(self, datasource, changed):
+        """Update the pairs of changed currencies that datasource is the preferred source of"""
+        sources = list(self.datasources.values())
+        preferred = [other.rates for other in sources[:sources.index(datasource)]]
+        rates = [(currency, rate) for currency, rate in datasource.rates.items()
+                 if isinstance(rate, Decimal) and rate]
+        for currency, currency_rate in changed.items():
+            if not isinstance(currency_rate, Decimal) or not currency_rate:
+                continue
+            row = self._matrix.setdefault(currency, dict())
+            for other, other_rate in rates:
+                if any(currency in better and other in better for better in preferred):
+                    continue
+                row[other] = other_rate / currency_rate
+                self._matrix.setdefault(other, dict())[currency] = currency_rate / other_rate
+
     def update_rates(self):
-        """Update exchange rate data"""
+        """Update exchange rate data, then rebuild the cross-rate matrix"""
         waitfor = list()
-        for name, datasource in self.datasources.iteritems():
+        for name, datasource in self.datasources.items():
             def announce(data, dsname):
                 if data:
                     log.info("Got new rates from {}".format(dsname, data))
             d = datasource.update()
             d.addCallback(announce, name)
             waitfor.append(d)
-        return defer.DeferredList(waitfor)
 
+        def rebuild(results):
+            self.rebuild_matrix()
+            return results
+        return defer.DeferredList(waitfor).addCallback(rebuild)
 
-class ForexConverterService(ForexConverter, service.Service):
-    name = 'ForexService'
 
-    def __init__(self, *args, **kwargs):
-        super(ForexConverterService, self).__init__(*args, **kwargs)
-        self.updater = None
-        """:type: LoopingCall"""
+if service is not None:
+    class ForexConverterService(ForexConverter, service.Service):
+        name = 'ForexService'
 
-    def startService(self):
-        super(ForexConverterService, self).startService()
-        if not self.updater:
-            self.updater = utils.poll(5*60, self.update_rates, lambda x: x)
-
-    def stopService(self):
-        super(ForexConverterService, self).stopService()
-        if self.updater:
-            self.updater.stop()
+        def __init__(self, *args, **kwargs):
+            super(ForexConverterService, self).__init__(*args, **kwargs)
             self.updater = None
+            """:type: exchangelib.scheduler.PollJob"""
+
+            # FXCM is realtime and cheap to update, so it's polled on its own in between
+            self.fxcm_updater = None
+
+        def startService(self):
+            super(ForexConverterService, self).startService()
+            if not self.updater:
+                self.updater = utils.poll(5*60, self.update_rates, lambda x: x)
+            fxcm = self.datasources['FXCM']
+            if not self.fxcm_updater:
+                self.fxcm_updater = utils.poll(fxcm.update_freq, fxcm.update, lambda x: x)
+
+        def stopService(self):
+            super(ForexConverterService, self).stopService()
+            for updater in (self.updater, self.fxcm_updater):
+                if updater:
+                    updater.stop()
+            self.updater = self.fxcm_updater = None
+            for datasource in self.datasources.values():
+                datasource.flush_snapshot()
 
 
 # todo store data age, yahoo and fxcm have times for each pair, ecb and oer have one for all the data
 # todo naming of these classes
 # todo rework failure handling i.e. when updates are not successful (for all data sources)
-class BaseForexDataSource(object):
-    def __init__(self):
+class BaseForexDataSource(Observable):
+    """
+    With a snapshot_dir, rates and last_updated are saved to <snapshot_dir>/<class name>.json after updates (at
+    most once per snapshot_interval) and loaded back when the data source is made, unless they're older than
+    max_snapshot_age. Loaded rates are used until they're updated, which only happens once they're older than
+    update_freq.
+    """
+
+    # least seconds between snapshot saves, updates in between are saved by flush_snapshot()
+    snapshot_interval = 0
+    # snapshots with rates older than this many seconds are ignored
+    max_snapshot_age = 7*24*60*60
+
+    def __init__(self, snapshot_dir=None):
+        super(BaseForexDataSource, self).__init__()
         self.base = 'USD'
         self.last_updated = None
         self._rates = dict()
         self.update_freq = None
+        self.snapshot_path = None
+        self._snapshot_saved_at = None
+        self._snapshot_unsaved = False
+        if snapshot_dir is not None:
+            self.snapshot_path = os.path.join(snapshot_dir, '{}.json'.format(type(self).__name__))
+            self.load_snapshot()
 
     # todo have this accept Pair objects and maybe return something that includes data age
     def current_rate(self, base, quote):
@@ -124,6 +280,76 @@ class BaseForexDataSource(object):
     def update(self):
         raise NotImplementedError()
 
+    def rates_changed(self, changed):
+        """
+        Called with the currencies whose rates changed in an update, listen to this.
+        :param changed: dict of currency -> new rate, or None for currencies that were dropped
+        """
+        return changed
+
+    def needs_update(self):
+        """Whether update() would fetch new data, rather than returning None right away"""
+        return self._should_update()
+
+    def load_snapshot(self):
+        """:returns: whether rates were loaded"""
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+            rates = dict((currency, Decimal(rate)) for currency, rate in snapshot['rates'].items())
+            last_updated = snapshot['last_updated']
+        except (IOError, OSError):
+            return False
+        except (ValueError, KeyError, TypeError, AttributeError, InvalidOperation):
+            log.warning("Ignoring unreadable forex snapshot {}".format(self.snapshot_path), exc_info=True)
+            return False
+        if not isinstance(last_updated, (int, float)) or \
+                utils.now_in_utc_secs() - last_updated > self.max_snapshot_age:
+            log.warning("Ignoring forex snapshot {} with rates from {}, older than {}s".format(
+                self.snapshot_path, last_updated, self.max_snapshot_age))
+            return False
+        self._rates = rates
+        self.last_updated = last_updated
+        return True
+
+    def save_snapshot(self, force=False):
+        """
+        Save the rates to snapshot_path, if there is one. Errors are logged rather than raised.
+        :param force: save even if the last save was less than snapshot_interval ago
+        """
+        if self.snapshot_path is None:
+            return
+        now = utils.now_in_utc_secs()
+        if not force and self._snapshot_saved_at is not None and now - self._snapshot_saved_at < self.snapshot_interval:
+            self._snapshot_unsaved = True
+            return
+        snapshot = {'rates': dict((currency, str(rate)) for currency, rate in self._rates.items()),
+                    'last_updated': self.last_updated}
+        partial = None
+        try:
+            directory = os.path.dirname(self.snapshot_path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            # a name of its own, so concurrent saves of the same snapshot can't write into each other's file
+            fd, partial = tempfile.mkstemp(suffix='.tmp', prefix=os.path.basename(self.snapshot_path) + '.',
+                                           dir=directory or None)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(snapshot, f)
+            # written in full first, so a crash never leaves half a snapshot
+            _replace(partial, self.snapshot_path)
+        except (IOError, OSError):
+            log.warning("Could not save forex snapshot {}".format(self.snapshot_path), exc_info=True)
+            if partial is not None and os.path.exists(partial):
+                os.remove(partial)
+            return
+        self._snapshot_saved_at = now
+        self._snapshot_unsaved = False
+
+    def flush_snapshot(self):
+        """Save the rates if an update since the last save hasn't been saved yet, e.g. when stopping"""
+        if self._snapshot_unsaved:
+            self.save_snapshot(force=True)
+
     def _should_update(self):
         if self.last_updated and utils.now_in_utc_secs() - self.last_updated < self.update_freq:
             return False
@@ -136,24 +362,27 @@ class BaseForexDataSource(object):
     @rates.setter
     def rates(self, table):
         """:type table: dict"""
-        for k, v in table.iteritems():
+        for k, v in list(table.items()):
             try:
                 table[k] = Decimal(v)
             except InvalidOperation:
                 log.debug('invalid op: k {} v {]'.format(k, v))
         table[self.base] = Decimal(1)
-        self._rates = table
+        previous, self._rates = self._rates, table
+        changed = dict((k, v) for k, v in table.items() if previous.get(k) != v)
+        changed.update((k, None) for k in previous if k not in table)
+        self.rates_changed(changed)
 
 
 class ECBData(BaseForexDataSource):
-    def __init__(self):
-        super(ECBData, self).__init__()
+    def __init__(self, snapshot_dir=None):
+        super(ECBData, self).__init__(snapshot_dir)
         self.url = 'https://api.fixer.io/latest?base=USD'
         # data updated every 24 hrs
         self.update_freq = 6*60*60
 
     def update(self):
-        if not self._should_update():
+        if not self.needs_update():
             return defer.succeed(None)
         d = utils.get_json(self.url)
 
@@ -161,6 +390,7 @@ class ECBData(BaseForexDataSource):
             if 'rates' in data:
                 self.rates = data['rates']
                 self.last_updated = utils.now_in_utc_secs()
+                self.save_snapshot()
                 return self.rates
             else:
                 log.info("Could not retrieve ECB forex data")
@@ -176,17 +406,18 @@ class OERData(BaseForexDataSource):
 
     # used by 796/BraveNewCoin
 
-    def __init__(self, app_id):
-        super(OERData, self).__init__()
+    def __init__(self, app_id, snapshot_dir=None):
+        super(OERData, self).__init__(snapshot_dir)
         self.app_id = app_id
         self.url = 'https://openexchangerates.org/api/latest.json?app_id={}'.format(self.app_id)
         self.update_freq = 60*60
         self.can_update = True
 
+    def needs_update(self):
+        return self.can_update and self._should_update()
+
     def update(self):
-        if not self._should_update():
-            return defer.succeed(None)
-        elif not self.can_update:
+        if not self.needs_update():
             return defer.succeed(None)
         d = utils.get_json(self.url)
 
@@ -194,6 +425,7 @@ class OERData(BaseForexDataSource):
             if 'rates' in data:
                 self.rates = data['rates']
                 self.last_updated = int(data['timestamp'])
+                self.save_snapshot()
                 return self.rates
             else:
                 log.info("Could not retrieve OER forex data")
@@ -211,51 +443,116 @@ class OERData(BaseForexDataSource):
 
 class FXCMData(BaseForexDataSource):
     # http://rates.fxcm.com/RatesXML
-    def __init__(self):
-        super(FXCMData, self).__init__()
+    # updates every few seconds, and losing a minute of them on a crash costs nothing
+    snapshot_interval = 60
+
+    def __init__(self, snapshot_dir=None):
+        super(FXCMData, self).__init__(snapshot_dir)
         self.url = 'http://rates.fxcm.com/RatesXML'
-        # realtime data
-        self.update_freq = 5*60
+        # realtime data, and updates only parse what changed
+        self.update_freq = 5
+        # symbol -> (bid, ask) text, as of the last update
+        self._quotes = dict()
 
     def update(self):
-        if not self._should_update():
+        """
+        Parse the rates as the response comes in, converting only the ones whose bid or ask changed.
+        Currencies missing from the response are dropped. Nothing is kept from a response that fails or
+        can't be parsed in full.
+        :returns: a Deferred firing with the changed rates (see rates_changed), or None if nothing changed
+        """
+        if not self.needs_update():
             return defer.succeed(None)
-        d = utils.get(self.url)
-
-        def process(data):
-            rates = dict()
-            tree = ElementTree.ElementTree(ElementTree.fromstring(data))
-            for el in tree.iterfind('Rate'):
-                pair = el.get('Symbol')
-                bid = Decimal(el[0].text)
-                ask = Decimal(el[1].text)
-                rate = (bid+ask)/2
-
-                if pair == 'Copper':
-                    pair = 'XCPUSD'
-                if len(pair) == 6 and pair.startswith('USD'):
-                    rates[pair[3:]] = rate
-                elif len(pair) == 6 and pair.endswith('USD'):
-                    rates[pair[:3]] = 1/rate
-                else:
-                    # these are indicies/natural gas/oil/etc. Could include if I really wanted to.
-                    pass
-            self.rates = rates
+        # symbol -> (bid, ask) and the currencies in this response, and the rates that changed
+        quotes, present, changed = dict(), set(), dict()
+        parser = ElementTree.XMLParser(target=_RatesXMLTarget(
+            lambda *quote: self._on_quote(quotes, present, changed, *quote)))
+        d = utils.get(self.url, collector=parser.feed)
+
+        def process(_):
+            parser.close()
+            self._quotes = quotes
             self.last_updated = utils.now_in_utc_secs()
-            return rates
+            for currency in list(self._rates):
+                if currency != self.base and currency not in present:
+                    del self._rates[currency]
+                    changed[currency] = None
+            if not changed:
+                return None
+            self._rates.update((k, v) for k, v in changed.items() if v is not None)
+            self._rates[self.base] = Decimal(1)
+            self.rates_changed(changed)
+            # not saved when nothing changed, since that happens every few seconds
+            self.save_snapshot()
+            return changed
         return d.addCallback(process)
 
+    def _on_quote(self, quotes, present, changed, symbol, bid, ask):
+        quotes[symbol] = (bid, ask)
+        unchanged = self._quotes.get(symbol) == (bid, ask)
+        if symbol == 'Copper':
+            symbol = 'XCPUSD'
+        if len(symbol) != 6 or 'USD' not in (symbol[:3], symbol[3:]):
+            # these are indicies/natural gas/oil/etc. Could include if I really wanted to.
+            return
+        currency = symbol[3:] if symbol.startswith('USD') else symbol[:3]
+        present.add(currency)
+        if unchanged and currency in self._rates:
+            return
+        if symbol.startswith('USD'):
+            changed[currency] = (Decimal(bid) + Decimal(ask)) / 2
+        else:
+            changed[currency] = 1 / ((Decimal(bid) + Decimal(ask)) / 2)
+
+
+class _RatesXMLTarget(object):
+    """
+    ElementTree parser target for FXCM's RatesXML, calling on_quote(symbol, bid, ask) with the text of each
+    Rate element as soon as it has been parsed.
+    """
+
+    def __init__(self, on_quote):
+        self.on_quote = on_quote
+        self._symbol = None
+        self._field = None
+        self._text = list()
+        self._quote = dict()
+
+    def start(self, tag, attrib):
+        if tag == 'Rate':
+            self._symbol = attrib.get('Symbol')
+            self._quote = dict()
+        elif self._symbol is not None and tag in ('Bid', 'Ask'):
+            self._field = tag
+            self._text = list()
+
+    def data(self, text):
+        if self._field is not None:
+            self._text.append(text)
+
+    def end(self, tag):
+        if tag == self._field:
+            self._quote[tag] = ''.join(self._text).strip()
+            self._field = None
+        elif tag == 'Rate':
+            if self._symbol and 'Bid' in self._quote and 'Ask' in self._quote:
+                self.on_quote(self._symbol, self._quote['Bid'], self._quote['Ask'])
+            self._symbol = None
+
+    def close(self):
+        pass
+
 
 class YahooFXData(BaseForexDataSource):
     # https://stackoverflow.com/questions/5108399/yahoo-finance-all-currencies-quote-api-documentation
     # maybe https://pypi.python.org/pypi/yahoo-finance/1.0.1
-    def __init__(self):
-        super(YahooFXData, self).__init__()
+    def __init__(self, snapshot_dir=None):
+        super(YahooFXData, self).__init__(snapshot_dir)
         self.url = 'https://finance.yahoo.com/webservice/v1/symbols/allcurrencies/quote?format=json'
         self.update_freq = 15*60
 
     def update(self):
-        if not self._should_update():
+        if not self.needs_update():
             return defer.succeed(None)
         d = utils.get_json(self.url)
 
@@ -267,5 +564,16 @@ class YahooFXData(BaseForexDataSource):
                 rates[currency] = Decimal(quote['price'])
             self.rates = rates
             self.last_updated = utils.now_in_utc_secs()
+            self.save_snapshot()
             return rates
         return d.addCallback(process)
+
+
+def _replace(source, destination):
+    try:
+        os.replace(source, destination)
+    except AttributeError:
+        # Python 2, where rename doesn't replace existing files on Windows
+        if os.name == 'nt' and os.path.exists(destination):
+            os.remove(destination)
+        os.rename(source, destination)
@@ -9,6 +9,7 @@ from zope.interface import moduleProvides
 from exchangelib.interfaces import IDataAPI
 from exchangelib.utils import get_json
 from exchangelib import schemas, simpleschema
+from exchangelib.book import OrderBook
 
 log = logging.getLogger(__name__)
 moduleProvides(IDataAPI)
@@ -35,10 +36,14 @@ def ticker(pair='btccny'):
 
 
 @simpleschema.returns(schemas.OrderBook)
-def orderbook(pair='btccny'):
+def orderbook(pair='btccny', columnar=False, depth=None):
+    # the depth file is static, so levels past depth are dropped before they're converted
     def process(data):
-        data['bids'] = [{'price': price, 'amount': amount} for price, amount in data['bids']]
-        data['asks'] = [{'price': price, 'amount': amount} for price, amount in data['asks']]
+        bids, asks = data['bids'][:depth], data['asks'][:depth]
+        if columnar:
+            return OrderBook.from_levels(bids, asks)
+        data['bids'] = [{'price': price, 'amount': amount} for price, amount in bids]
+        data['asks'] = [{'price': price, 'amount': amount} for price, amount in asks]
         return data
     return get_json(url=_create_url('depth', pair)).addCallback(process)
 
@@ -9,7 +9,7 @@ from twisted.internet import reactor, stdio, defer
 from twisted.protocols.basic import LineReceiver
 import twisted.python.log as twisted_log
 
-from exchangelib import bitstamp, bitfinex, btce, huobi
+from exchangelib import bitstamp, bitfinex, btce, huobi, cache
 
 log = logging.getLogger(__name__)
 
@@ -50,8 +50,8 @@ class ApiRepl(LineReceiver):
         elif cmd == 'exit' or cmd == 'q' or cmd == 'quit':
             self.quit()
         elif cmd == 'purge cache':
-            # todo cache purge command
-            pass
+            cache.purge()
+            self.writeln("Cache purged.")
         else:
             return self.exchange_cmd(cmd)
         # todo a watch (+ un watch) command for polling
@@ -7,8 +7,8 @@ class IDataAPI(Interface):
     def ticker(pair='btcusd'):
         """"""
 
-    def orderbook(pair='btcusd'):
-        """"""
+    def orderbook(pair='btcusd', depth=None):
+        """depth limits the levels on each side, None for all of them"""
 
     def trades(pair='btcusd'):
         """"""
\ No newline at end of file
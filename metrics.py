@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+import logging
+import math
+from contextlib import contextmanager
+from timeit import default_timer as now
+
+log = logging.getLogger(__name__)
+
+# Stages of a request, in the order they happen
+STAGES = ('queue', 'connect', 'ttfb', 'body', 'parse', 'remap', 'validate', 'total')
+
+
+class Histogram(object):
+    """
+    Log-bucketed histogram for latencies, in seconds. Recording is one log() and a list increment,
+    and percentiles are accurate to the bucket width (about 9%).
+    """
+    MIN = 1e-6
+    MAX = 1e3
+    # buckets per doubling
+    RESOLUTION = 8
+
+    def __init__(self):
+        self._factor = math.log(2) / self.RESOLUTION
+        self.buckets = [0] * (int(math.log(self.MAX / self.MIN) / self._factor) + 2)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if value <= self.MIN:
+            index = 0
+        else:
+            index = min(len(self.buckets) - 1, int(math.log(value / self.MIN) / self._factor) + 1)
+        self.buckets[index] += 1
+
+    def percentile(self, percent):
+        """
+        :param percent: 0 to 100
+        :returns: the upper bound of the bucket the percentile falls in, or None if nothing was recorded
+        """
+        if not self.count:
+            return None
+        target = max(1, int(math.ceil(self.count * percent / 100.0)))
+        seen = 0
+        for index, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= target:
+                upper = self.MIN * math.exp(index * self._factor)
+                return min(max(upper, self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+
+class Span(object):
+    """
+    Timings for a single request, recorded into the histograms for its endpoint label as they come in.
+
+    A call that makes several HTTP requests gets a child span for each (see child), so stages like connect can be
+    told apart per request while still adding up in the parent.
+    """
+
+    def __init__(self, label, parent=None):
+        self.label = label
+        self.parent = parent
+        self.started = now()
+        self.stages = dict()
+        # when the response was parsed, so the time spent remapping it can be worked out
+        self.parsed_at = None
+
+    def record(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0) + seconds
+        if self.parent is not None:
+            self.parent.record(stage, seconds)
+        else:
+            record(self.label, stage, seconds)
+
+    def child(self):
+        """:returns: a Span for one part of this one, whose timings are also added to this one"""
+        return Span(self.label, parent=self)
+
+
+_histograms = dict()
+_current = None
+
+
+def record(label, stage, seconds):
+    key = (label, stage)
+    if key not in _histograms:
+        _histograms[key] = Histogram()
+    _histograms[key].record(seconds)
+
+
+def current_span():
+    """:returns: the Span for the request being set up right now, or None"""
+    return _current
+
+
+@contextmanager
+def activate(span):
+    """
+    Make span the current span while setting up a request.
+
+    Request setup happens synchronously (in the reactor thread), so code further down like utils.get_json
+    and the connection pool can find the span to add their timings to without it being passed around.
+    """
+    global _current
+    previous, _current = _current, span
+    try:
+        yield span
+    finally:
+        _current = previous
+
+
+def histogram(label, stage):
+    """:rtype: Histogram or None"""
+    return _histograms.get((label, stage))
+
+
+def percentiles(label, stage, percents=(50, 90, 99)):
+    """:returns: a dict of percent -> seconds, empty if nothing was recorded"""
+    hist = _histograms.get((label, stage))
+    if not hist:
+        return {}
+    return dict((p, hist.percentile(p)) for p in percents)
+
+
+def labels():
+    return sorted(set(label for label, _ in _histograms))
+
+
+def summary(percents=(50, 90, 99)):
+    """
+    :returns: dict of label -> stage -> dict with count, mean, max and each percentile
+    """
+    result = dict()
+    for (label, stage), hist in _histograms.items():
+        stats = {'count': hist.count, 'mean': hist.mean, 'max': hist.max}
+        stats.update((p, hist.percentile(p)) for p in percents)
+        result.setdefault(label, {})[stage] = stats
+    return result
+
+
+def export_text(percents=(50, 90, 99)):
+    """
+    Export every histogram in the Prometheus text format, as summaries.
+
+    :rtype: str
+    """
+    lines = ['# HELP exchangelib_latency_seconds Request latency per endpoint and stage.',
+             '# TYPE exchangelib_latency_seconds summary']
+    order = dict((stage, i) for i, stage in enumerate(STAGES))
+    keys = sorted(_histograms, key=lambda key: (key[0], order.get(key[1], len(order)), key[1]))
+    for label, stage in keys:
+        hist = _histograms[(label, stage)]
+        tags = 'endpoint="{}",stage="{}"'.format(label, stage)
+        for p in percents:
+            lines.append('exchangelib_latency_seconds{{{},quantile="{}"}} {:.6f}'.format(
+                tags, p / 100.0, hist.percentile(p)))
+        lines.append('exchangelib_latency_seconds_sum{{{}}} {:.6f}'.format(tags, hist.sum))
+        lines.append('exchangelib_latency_seconds_count{{{}}} {}'.format(tags, hist.count))
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    _histograms.clear()
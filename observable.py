@@ -1,8 +1,15 @@
 # !/usr/bin/env python
 
 import logging
-from collections import defaultdict
+import bisect
+import types
+import warnings
+import weakref
+from collections import deque
 from functools import wraps
+from itertools import count
+
+from exchangelib.compat import string_types
 
 log = logging.getLogger(__name__)
 
@@ -17,30 +24,69 @@ log = logging.getLogger(__name__)
 # is there any way to do that?
 # todo consider adding the possibility to listen to inputs instead of outputs, or even both
 
+# Filter operators for listen(), as in listen('trade', listener, amount__gte=1).
+# A filter without an operator, like direction='bid', is an equality test.
+OPERATORS = {'eq': lambda value, arg: value == arg,
+             'in': lambda value, arg: value in arg,
+             'gt': lambda value, arg: value > arg,
+             'gte': lambda value, arg: value >= arg,
+             'lt': lambda value, arg: value < arg,
+             'lte': lambda value, arg: value <= arg,
+             'between': lambda value, arg: arg[0] <= value <= arg[1]}
+
+# Operators subscriptions can be indexed by, best first. The first filter a subscription has with one of these is
+# used to find it, any others are checked afterwards.
+_INDEXED = ('eq', 'in', 'between', 'gte', 'gt', 'lte', 'lt')
+
+_missing = object()
+
 
 class Observable(object):
     def __init__(self):
-        self._listeners = defaultdict(set)
+        # method name -> _Dispatcher, for methods with listeners
+        self._dispatchers = dict()
 
-    def listen(self, method_name, listener):
+    def listen(self, method_name, listener, weak=False, delivery=None, **filters):
         """
         Bind a callable to listen to a method - it gets called with the return value whenever that method is called.
+
+        Filters limit the calls to results with matching fields, e.g. amount__gte=1, price__between=(240, 260),
+        change='created' or direction__in=('bid', 'ask'). See OPERATORS. Results missing a filtered field never
+        match. Subscriptions are indexed by their filters, so listeners that don't match aren't even looked at.
+
+        Exceptions raised by a listener are logged, and don't stop the others from being called.
+
+        By default listeners are called right away, in the call of the method. A delivery mode decouples a slow
+        listener from the source and from other listeners instead: 'queue' (see Queue), 'conflate' (Conflate)
+        or 'batch' (Batch), or an instance of one of those to set its options.
+
         :type method_name: str
-        :raises ValueError: if method_name is not a valid method name, or if listener is not callable.
+        :param weak: hold the listener with a weak reference, so it is unsubscribed once nothing else refers to it.
+            Bound methods (including those of builtins, like list.append) are held by their instance. Weakly held
+            functions get a RuntimeWarning, since lambdas and nested functions are usually gone by the time anything
+            is dispatched. Listeners are held strongly by default, until unlisten().
+        :param delivery: None to call the listener directly, or a delivery mode
+        :type delivery: str or Delivery or None
+        :returns: the subscription
+        :rtype: Subscription
+        :raises ValueError: if method_name is not a valid method name, if listener is not callable,
+            or on an unknown filter operator.
         """
         if not callable(listener):
             raise ValueError("'{}' is an invalid listener since it is not callable.".format(listener))
         elif not hasattr(self, method_name):
             raise ValueError("{} is not a method".format(method_name))
 
-        method_listeners = self._listeners[method_name]
-        """:type: set"""
-        method_listeners.add(listener)
-
-        if len(method_listeners) == 1:
-            first = True
+        # made first, since bad filters or delivery modes raise ValueError
+        subscription = Subscription(listener, filters, weak, on_dead=self._make_reaper(method_name),
+                                    delivery=delivery)
 
+        first = method_name not in self._dispatchers
+        if first:
             # If this is the first listener, then set up the method wrapper
+            dispatcher = self._dispatchers[method_name] = _Dispatcher()
+            # restored once the last listener is gone, usually there is nothing to restore
+            dispatcher.replaced = vars(self).get(method_name, _missing)
 
             # method_name verified to exist at top
             method = getattr(self, method_name)
@@ -50,41 +96,59 @@ class Observable(object):
                 # todo should i be ignoring null results from func call?
                 result = method(*args, **kwargs)
                 if result:
-                    for l in method_listeners:
-                        l(result)
+                    dispatcher.dispatch(result)
+                return result
             # Replace the original method with the wrapper
             setattr(self, method_name, method_wrapper)
-        else:
-            first = False
+
+        self._dispatchers[method_name].add(subscription)
         self.hook_listen(method_name, listener, is_first=first)
+        return subscription
 
     def unlisten(self, method_name, listener):
-        # todo add :raises: documentation for (un)listen
+        """
+        Stop a listener from being called. Removes every subscription the listener has to the method.
+
+        :param listener: the listener, or a Subscription returned by listen()
+        :raises ValueError: if the method has no listeners
+        """
+        dispatcher = self._dispatchers.get(method_name)
+        if not dispatcher:
+            raise ValueError("No listeners registered for {}".format(method_name))
+        # todo, valueerror? listener was not bound
+        for subscription in dispatcher.subscriptions():
+            if subscription is listener or subscription.listener == listener:
+                dispatcher.remove(subscription)
+        self._unlistened(method_name, listener)
 
-        # Get any existing listeners
-        method_listeners = self._listeners[method_name]
-        """:type: set"""
+    def listeners(self, method_name):
+        """:returns: the live listeners of a method"""
+        dispatcher = self._dispatchers.get(method_name)
+        if not dispatcher:
+            return []
+        return [s.listener for s in dispatcher.subscriptions() if s.listener is not None]
 
-        if method_listeners:
-            # Remove the listener
-            try:
-                method_listeners.remove(listener)
-            except KeyError:
-                pass
-                # todo, valueerror? listener was not bound
-
-            # If this was the last listener, then remove the method wrapper
-            if not method_listeners:
-                is_last = True
-                self._listeners.pop(method_name, None)
-                # todo error handling for getattr calls
-                method = getattr(self, method_name)
-                setattr(self, method_name, method.__wrapped__)
+    def _unlistened(self, method_name, listener):
+        # If this was the last listener, then remove the method wrapper
+        is_last = not self._dispatchers[method_name]
+        if is_last:
+            replaced = self._dispatchers.pop(method_name).replaced
+            if replaced is _missing:
+                delattr(self, method_name)
             else:
-                is_last = False
-            self.hook_unlisten(method_name, listener, is_last=is_last)
-        else:
-            raise ValueError("No listeners registered for {}".format(method_name))
+                setattr(self, method_name, replaced)
+        self.hook_unlisten(method_name, listener, is_last=is_last)
+
+    def _make_reaper(self, method_name):
+        # only a weak reference to self, so dead listeners can't keep the observable alive either
+        observable = weakref.ref(self)
+
+        def reap(subscription):
+            owner = observable()
+            dispatcher = owner._dispatchers.get(method_name) if owner is not None else None
+            if dispatcher is not None and dispatcher.remove(subscription):
+                owner._unlistened(method_name, None)
+        return reap
 
     def hook_listen(self, method_name, listener, is_first=False):
         """
@@ -96,8 +160,473 @@ class Observable(object):
 
     def hook_unlisten(self, method_name, listener, is_last=False):
         """
-        Meant to be overriden, called by unlisten()
+        Meant to be overriden, called by unlisten(), and with listener None when a weakly held listener dies.
 
         :type method_name: str
         :param is_last: whether the last listener for this method was just removed.
         """
+
+
+class Subscription(object):
+    """A listener and the filters a result has to pass for the listener to be called with it."""
+
+    _sequence = count()
+
+    def __init__(self, listener, filters=None, weak=False, on_dead=None, delivery=None):
+        """
+        :param filters: dict of field__operator -> argument, see Observable.listen
+        :param on_dead: called with the subscription when a weakly held listener is garbage collected
+        :param delivery: delivery mode, see Observable.listen
+        """
+        self.order = next(Subscription._sequence)
+        self.filters = list()
+        for key, arg in (filters or {}).items():
+            field, _, op = key.rpartition('__')
+            if not field:
+                field, op = key, 'eq'
+            elif op not in OPERATORS:
+                raise ValueError("Unknown filter operator '{}' in {}".format(op, key))
+            if op == 'in':
+                try:
+                    arg = frozenset(arg)
+                except TypeError:
+                    # unhashable values, checked but not indexed
+                    arg = tuple(arg)
+            self.filters.append((field, op, arg))
+        self.calls = 0
+        self.errors = 0
+
+        if isinstance(delivery, string_types):
+            if delivery not in DELIVERY_MODES:
+                raise ValueError("Unknown delivery mode '{}'".format(delivery))
+            delivery = DELIVERY_MODES[delivery]()
+        self.delivery = delivery
+        if delivery is not None:
+            delivery.bind(self.call)
+
+        self._listener = None
+        self._ref = None
+        if weak:
+            callback = (lambda _: on_dead(self)) if on_dead else None
+            try:
+                if isinstance(listener, types.MethodType) and listener.__self__ is not None:
+                    # bound methods are created on attribute access, so refer to the instance instead
+                    self._ref = (weakref.ref(listener.__self__, callback), listener.__func__)
+                elif isinstance(listener, types.BuiltinMethodType) and \
+                        not isinstance(listener.__self__, (types.ModuleType, type(None))):
+                    # the same for methods of builtin types, through the type's method descriptor
+                    self._ref = (weakref.ref(listener.__self__, callback),
+                                 getattr(type(listener.__self__), listener.__name__))
+                else:
+                    self._ref = (weakref.ref(listener, callback), None)
+            except (TypeError, AttributeError):
+                # instances of some builtins, like list, can't be weakly referenced
+                log.debug("Holding {} with a strong reference".format(listener))
+            else:
+                if isinstance(listener, types.FunctionType):
+                    warnings.warn("Listener {} is a function held with a weak reference, it stops being called once "
+                                  "nothing else refers to it. Pass weak=False to keep it.".format(listener),
+                                  RuntimeWarning, stacklevel=3)
+        if self._ref is None:
+            self._listener = listener
+
+    @property
+    def listener(self):
+        """:returns: the listener, or None if it was weakly held and has been garbage collected"""
+        if self._ref is None:
+            return self._listener
+        ref, func = self._ref
+        target = ref()
+        if target is None or func is None:
+            return target
+        return func.__get__(target, type(target))
+
+    def matches(self, result, skip=None):
+        """
+        :param skip: index of a filter that is already known to match
+        """
+        for index, (field, op, arg) in enumerate(self.filters):
+            if index == skip:
+                continue
+            value = _field(result, field)
+            if value is _missing or value is None:
+                return False
+            try:
+                if not OPERATORS[op](value, arg):
+                    return False
+            except TypeError:
+                return False
+        return True
+
+    def deliver(self, result):
+        """Pass a result on to the listener, now or through the delivery mode."""
+        if self.delivery is None:
+            self.call(result)
+        else:
+            self.delivery.push(result)
+
+    def call(self, result):
+        """:returns: what the listener returned, None if it raised an exception"""
+        # weakly held methods are called through their function, rather than making a bound method every time
+        if self._ref is None:
+            listener, args = self._listener, (result,)
+        else:
+            ref, func = self._ref
+            target = ref()
+            if target is None:
+                return
+            listener, args = (target, (result,)) if func is None else (func, (target, result))
+        self.calls += 1
+        try:
+            return listener(*args)
+        except Exception:
+            self.errors += 1
+            log.exception("Listener {} raised an exception".format(self.listener))
+
+    def close(self):
+        """Called once the subscription is removed, dropping anything still waiting to be delivered."""
+        if self.delivery is not None:
+            self.delivery.cancel()
+
+    def stats(self):
+        stats = {'calls': self.calls, 'errors': self.errors}
+        if self.delivery is not None:
+            stats.update(self.delivery.stats())
+        return stats
+
+    def primary_filter(self):
+        """:returns: index of the filter to index this subscription by, or None if none of its filters can be"""
+        best = None
+        for index, (_, op, arg) in enumerate(self.filters):
+            if not _indexable(op, arg):
+                continue
+            if best is None or _INDEXED.index(op) < _INDEXED.index(self.filters[best][1]):
+                best = index
+        return best
+
+
+def _indexable(op, arg):
+    if op == 'eq':
+        try:
+            hash(arg)
+        except TypeError:
+            return False
+    return op != 'in' or isinstance(arg, frozenset)
+
+
+def _field(result, name):
+    try:
+        return result[name]
+    except (KeyError, IndexError, TypeError):
+        return getattr(result, name, _missing)
+
+
+class _SortedIndex(object):
+    """Subscriptions sorted by a bound, for the gt/gte/lt/lte/between operators."""
+
+    def __init__(self):
+        self.bounds = list()
+        self.subscriptions = list()
+
+    def add(self, bound, subscription):
+        index = bisect.bisect_right(self.bounds, bound)
+        self.bounds.insert(index, bound)
+        self.subscriptions.insert(index, subscription)
+
+    def remove(self, subscription):
+        for index, existing in enumerate(self.subscriptions):
+            if existing is subscription:
+                del self.bounds[index]
+                del self.subscriptions[index]
+                return True
+        return False
+
+    def below(self, value, inclusive):
+        """Subscriptions with a bound under value (or equal to it if inclusive)"""
+        end = (bisect.bisect_right if inclusive else bisect.bisect_left)(self.bounds, value)
+        return self.subscriptions[:end]
+
+    def above(self, value, inclusive):
+        """Subscriptions with a bound over value (or equal to it if inclusive)"""
+        start = (bisect.bisect_left if inclusive else bisect.bisect_right)(self.bounds, value)
+        return self.subscriptions[start:]
+
+    def __len__(self):
+        return len(self.subscriptions)
+
+
+class _Dispatcher(object):
+    """The subscriptions to one method, indexed by field and filter so a result only reaches those it matches."""
+
+    def __init__(self):
+        self.replaced = _missing
+        # replaced rather than changed, so dispatch can go through them without copying
+        self.unfiltered = ()
+        # subscriptions with filters that can't be indexed, e.g. on unhashable values, checked on every result
+        self.unindexed = ()
+        # field -> value -> list of subscriptions, for eq and in filters
+        self.by_value = dict()
+        # (field, op) -> _SortedIndex, for the other operators
+        self.by_bound = dict()
+        # subscription -> (index of the filter its index already checks, where it is stored)
+        self._where = dict()
+
+    def add(self, subscription):
+        primary = subscription.primary_filter()
+        if primary is None:
+            if subscription.filters:
+                self.unindexed += (subscription,)
+                self._where[subscription] = (None, 'unindexed')
+            else:
+                self.unfiltered += (subscription,)
+                self._where[subscription] = (None, None)
+            return
+        field, op, arg = subscription.filters[primary]
+        # the index fully checks the filter, except for the upper end of between
+        checked = primary if op != 'between' else None
+        if op in ('eq', 'in'):
+            values = self.by_value.setdefault(field, {})
+            keys = arg if op == 'in' else (arg,)
+            for key in keys:
+                values.setdefault(key, []).append(subscription)
+            self._where[subscription] = (checked, ('value', field, keys))
+        else:
+            index = self.by_bound.setdefault((field, op), _SortedIndex())
+            index.add(arg[0] if op == 'between' else arg, subscription)
+            self._where[subscription] = (checked, ('bound', (field, op)))
+
+    def remove(self, subscription):
+        """:returns: whether the subscription was found"""
+        if subscription not in self._where:
+            return False
+        subscription.close()
+        _, where = self._where.pop(subscription)
+        if where is None:
+            self.unfiltered = tuple(s for s in self.unfiltered if s is not subscription)
+        elif where == 'unindexed':
+            self.unindexed = tuple(s for s in self.unindexed if s is not subscription)
+        elif where[0] == 'value':
+            _, field, keys = where
+            values = self.by_value[field]
+            for key in keys:
+                values[key].remove(subscription)
+                if not values[key]:
+                    del values[key]
+            if not values:
+                del self.by_value[field]
+        else:
+            index = self.by_bound[where[1]]
+            index.remove(subscription)
+            if not index:
+                del self.by_bound[where[1]]
+        return True
+
+    def subscriptions(self):
+        return sorted(self._where, key=lambda s: s.order)
+
+    def dispatch(self, result):
+        if not self.by_value and not self.by_bound and not self.unindexed:
+            # nothing filtered, the common case
+            for subscription in self.unfiltered:
+                subscription.deliver(result)
+            return
+
+        candidates = list(self.unfiltered)
+        candidates.extend(self.unindexed)
+        for field, values in self.by_value.items():
+            value = _field(result, field)
+            if value is not _missing:
+                try:
+                    candidates.extend(values.get(value, ()))
+                except TypeError:
+                    # unhashable
+                    pass
+        for (field, op), index in self.by_bound.items():
+            value = _field(result, field)
+            if value is _missing or value is None:
+                continue
+            try:
+                if op in ('gte', 'gt', 'between'):
+                    candidates.extend(index.below(value, inclusive=op != 'gt'))
+                else:
+                    candidates.extend(index.above(value, inclusive=op == 'lte'))
+            except TypeError:
+                # not comparable with the bounds
+                pass
+
+        # subscriptions are called in the order they were made
+        candidates.sort(key=lambda s: s.order)
+        for subscription in candidates:
+            if subscription.matches(result, skip=self._where[subscription][0]):
+                subscription.deliver(result)
+
+    def __len__(self):
+        return len(self._where)
+
+
+class Delivery(object):
+    """
+    Base for delivery modes. Results are handed to the listener in a later reactor iteration, so a slow listener
+    doesn't hold up the source or other listeners. Each iteration delivers whatever is waiting, up to budget
+    listener calls, before letting the reactor get on with other work. When the listener returns a Deferred,
+    nothing more is delivered until it fires.
+
+    Counters: delivered (results passed to the listener), dropped (results that never will be) and batches
+    (listener calls).
+    """
+
+    def __init__(self, clock=None, budget=100):
+        """
+        :param clock: IReactorTime provider, defaults to the reactor
+        :param budget: most listener calls per reactor iteration
+        """
+        self._clock = clock
+        self.budget = budget
+        self._call = None
+        self._timer = None
+        self._busy = False
+        self.delivered = 0
+        self.dropped = 0
+        self.batches = 0
+
+    @property
+    def clock(self):
+        if self._clock is None:
+            from twisted.internet import reactor
+            self._clock = reactor
+        return self._clock
+
+    def bind(self, call):
+        """:raises ValueError: if already used by another subscription"""
+        if self._call is not None:
+            raise ValueError("A delivery mode can only be used by one subscription")
+        self._call = call
+
+    def push(self, result):
+        raise NotImplementedError()
+
+    def pending(self):
+        """:returns: how many results are waiting"""
+        raise NotImplementedError()
+
+    def _take(self):
+        """:returns: what to call the listener with next, counting it as delivered"""
+        raise NotImplementedError()
+
+    def _clear(self):
+        raise NotImplementedError()
+
+    def cancel(self):
+        if self._timer is not None and self._timer.active():
+            self._timer.cancel()
+        self._timer = None
+        self.dropped += self.pending()
+        self._clear()
+
+    def stats(self):
+        return {'pending': self.pending(), 'delivered': self.delivered, 'dropped': self.dropped,
+                'batches': self.batches}
+
+    def _schedule(self):
+        if self._timer is None and not self._busy and self.pending():
+            self._timer = self.clock.callLater(0, self._run)
+
+    def _run(self):
+        self._timer = None
+        for _ in range(self.budget):
+            if not self.pending():
+                return
+            self.batches += 1
+            returned = self._call(self._take())
+            if hasattr(returned, 'addBoth'):
+                self._busy = True
+                returned.addBoth(self._finished)
+                return
+        # more waiting than the budget allows for in one go
+        self._schedule()
+
+    def _finished(self, result):
+        self._busy = False
+        if hasattr(result, 'getErrorMessage'):
+            log.warning("Listener Deferred failed: {}".format(result.getErrorMessage()))
+        self._schedule()
+
+
+class Queue(Delivery):
+    """Delivers results one at a time, in order. Past maxlen waiting, the oldest are dropped."""
+
+    def __init__(self, maxlen=1000, clock=None, budget=100):
+        super(Queue, self).__init__(clock, budget)
+        self.maxlen = maxlen
+        self._queue = deque()
+
+    def push(self, result):
+        if len(self._queue) >= self.maxlen:
+            self._queue.popleft()
+            self.dropped += 1
+        self._queue.append(result)
+        self._schedule()
+
+    def pending(self):
+        return len(self._queue)
+
+    def _take(self):
+        self.delivered += 1
+        return self._queue.popleft()
+
+    def _clear(self):
+        self._queue.clear()
+
+    def stats(self):
+        stats = super(Queue, self).stats()
+        stats['maxlen'] = self.maxlen
+        return stats
+
+
+class Conflate(Queue):
+    """
+    Only delivers the latest result, e.g. for orderbook snapshots.
+    Results replaced before they were delivered count as dropped.
+    """
+
+    def __init__(self, clock=None):
+        super(Conflate, self).__init__(1, clock)
+
+
+class Batch(Delivery):
+    """
+    Delivers everything that arrived since the last delivery as a single list, so a listener gets all the results
+    from one reactor iteration (or from while its last Deferred was running) in one call. Past maxlen waiting,
+    the oldest are dropped.
+    """
+
+    def __init__(self, maxlen=10000, clock=None):
+        super(Batch, self).__init__(clock)
+        self.maxlen = maxlen
+        self._batch = deque()
+
+    def push(self, result):
+        if len(self._batch) >= self.maxlen:
+            self._batch.popleft()
+            self.dropped += 1
+        self._batch.append(result)
+        self._schedule()
+
+    def pending(self):
+        return len(self._batch)
+
+    def _take(self):
+        batch, self._batch = list(self._batch), deque()
+        self.delivered += len(batch)
+        return batch
+
+    def _clear(self):
+        self._batch = deque()
+
+    def stats(self):
+        stats = super(Batch, self).stats()
+        stats['maxlen'] = self.maxlen
+        return stats
+
+
+DELIVERY_MODES = {'queue': Queue, 'conflate': Conflate, 'batch': Batch}
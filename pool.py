@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+import logging
+from collections import defaultdict, deque
+
+from twisted.internet import defer
+from twisted.web.client import HTTPConnectionPool
+
+from exchangelib import metrics
+
+log = logging.getLogger(__name__)
+
+# Defaults for the shared pool used by every request made through utils
+MAX_PERSISTENT_PER_HOST = 4
+MAX_IN_FLIGHT_PER_HOST = 8
+CACHED_CONNECTION_TIMEOUT = 120
+
+
+class ConnectionPool(HTTPConnectionPool):
+    """HTTPConnectionPool that counts how often connections get reused, per host."""
+
+    def __init__(self, reactor, persistent=True):
+        HTTPConnectionPool.__init__(self, reactor, persistent)
+        self.requested = defaultdict(int)
+        self.created = defaultdict(int)
+
+    def getConnection(self, key, endpoint):
+        # key is (scheme, host, port)
+        self.requested[key[1]] += 1
+        return HTTPConnectionPool.getConnection(self, key, endpoint)
+
+    def _newConnection(self, key, endpoint):
+        self.created[key[1]] += 1
+        span = metrics.current_span()
+        start = metrics.now()
+        d = HTTPConnectionPool._newConnection(self, key, endpoint)
+        if span is not None:
+            def connected(connection):
+                span.record('connect', metrics.now() - start)
+                return connection
+            d.addCallback(connected)
+        return d
+
+
+class HostLimiter(object):
+    """
+    Caps the number of requests in flight to each host, queueing the rest in order.
+
+    max_in_flight can be changed at any time. A higher limit starts queued requests right away, a lower one lets
+    the requests already running finish and holds new ones until the host is under it.
+    """
+
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT_PER_HOST):
+        self._max_in_flight = max_in_flight
+        # host -> requests running
+        self._in_flight = defaultdict(int)
+        # host -> deque of Deferreds waiting for a slot, fired once they have one
+        self._waiting = defaultdict(deque)
+
+    @property
+    def max_in_flight(self):
+        return self._max_in_flight
+
+    @max_in_flight.setter
+    def max_in_flight(self, max_in_flight):
+        self._max_in_flight = max_in_flight
+        for host in list(self._waiting):
+            self._start_waiting(host)
+
+    def run(self, host, func, *args, **kwargs):
+        """
+        Run func once the host has a free slot, holding the slot until its Deferred fires.
+
+        :returns: a Deferred firing with func's result
+        :rtype: defer.Deferred
+        """
+        if self._in_flight[host] < self._max_in_flight and not self._waiting.get(host):
+            self._in_flight[host] += 1
+            slot = defer.succeed(None)
+        else:
+            slot = defer.Deferred(lambda d: self._cancel(host, d))
+            self._waiting[host].append(slot)
+
+        def start(_):
+            return defer.maybeDeferred(func, *args, **kwargs).addBoth(self._finished, host)
+        return slot.addCallback(start)
+
+    def _cancel(self, host, slot):
+        waiting = self._waiting.get(host)
+        if waiting is not None:
+            waiting.remove(slot)
+            if not waiting:
+                del self._waiting[host]
+
+    def _finished(self, result, host):
+        self._in_flight[host] -= 1
+        self._start_waiting(host)
+        return result
+
+    def _start_waiting(self, host):
+        waiting = self._waiting.get(host)
+        while waiting and self._in_flight[host] < self._max_in_flight:
+            self._in_flight[host] += 1
+            slot = waiting.popleft()
+            if not waiting:
+                del self._waiting[host]
+            slot.callback(None)
+        if not self._in_flight[host]:
+            del self._in_flight[host]
+
+    def in_flight(self, host):
+        return self._in_flight.get(host, 0)
+
+    def queued(self, host):
+        return len(self._waiting.get(host, ()))
+
+    @property
+    def hosts(self):
+        return set(self._in_flight) | set(self._waiting)
+
+
+_pool = None
+_limiter = HostLimiter()
+
+
+def configure(max_persistent_per_host=None, max_in_flight_per_host=None, cached_connection_timeout=None):
+    """
+    Change the settings for the shared connection pool. Connections that are already open aren't affected.
+
+    :param max_persistent_per_host: how many idle connections to keep open per host
+    :param max_in_flight_per_host: how many requests can be running at once per host, others are queued
+    :param cached_connection_timeout: seconds before an idle connection is closed
+    """
+    global MAX_PERSISTENT_PER_HOST, MAX_IN_FLIGHT_PER_HOST, CACHED_CONNECTION_TIMEOUT
+    if max_persistent_per_host is not None:
+        MAX_PERSISTENT_PER_HOST = max_persistent_per_host
+    if cached_connection_timeout is not None:
+        CACHED_CONNECTION_TIMEOUT = cached_connection_timeout
+    if max_in_flight_per_host is not None:
+        MAX_IN_FLIGHT_PER_HOST = max_in_flight_per_host
+        _limiter.max_in_flight = max_in_flight_per_host
+    if _pool is not None:
+        _pool.maxPersistentPerHost = MAX_PERSISTENT_PER_HOST
+        _pool.cachedConnectionTimeout = CACHED_CONNECTION_TIMEOUT
+
+
+def get_pool():
+    """
+    Get the shared connection pool, creating it on first use.
+
+    :rtype: ConnectionPool
+    """
+    global _pool
+    if _pool is None:
+        from twisted.internet import reactor
+        _pool = ConnectionPool(reactor, persistent=True)
+        _pool.maxPersistentPerHost = MAX_PERSISTENT_PER_HOST
+        _pool.cachedConnectionTimeout = CACHED_CONNECTION_TIMEOUT
+    return _pool
+
+
+def limit(host, func, *args, **kwargs):
+    """Run func through the shared per-host concurrency limit, see HostLimiter.run"""
+    return _limiter.run(host, func, *args, **kwargs)
+
+
+def stats():
+    """
+    Connection reuse and concurrency stats for each host.
+
+    :returns: dict of host -> dict with keys requested, created, reused, in_flight and queued
+    """
+    hosts = set(_limiter.hosts)
+    if _pool is not None:
+        hosts.update(_pool.requested)
+    result = dict()
+    for host in hosts:
+        requested = _pool.requested.get(host, 0) if _pool else 0
+        created = _pool.created.get(host, 0) if _pool else 0
+        result[host] = {'requested': requested,
+                        'created': created,
+                        'reused': requested - created,
+                        'in_flight': _limiter.in_flight(host),
+                        'queued': _limiter.queued(host)}
+    return result
+
+
+def close():
+    """
+    Close every cached connection.
+
+    :rtype: defer.Deferred
+    """
+    if _pool is not None:
+        return _pool.closeCachedConnections()
+    return defer.succeed(None)
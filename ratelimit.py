@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+import logging
+import heapq
+from itertools import count
+
+log = logging.getLogger(__name__)
+
+# Priority lanes, lower goes first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+# (requests per second, burst size) for each exchange API host. Hosts that aren't listed aren't limited.
+# Bitstamp allows 600 requests per 10 minutes and Bitfinex around 90 a minute, the others are guesses.
+LIMITS = {'www.bitstamp.net': (1, 10),
+          'api.bitfinex.com': (1.5, 10),
+          'btc-e.com': (2, 10),
+          'market.huobi.com': (2, 10)}
+
+
+class HostScheduler(object):
+    """
+    Token bucket for a single host. Requests run right away while there are tokens, otherwise they wait in a
+    queue ordered by priority and then by arrival.
+    """
+
+    def __init__(self, rate, burst, clock=None):
+        """
+        :param rate: tokens added per second
+        :param burst: most tokens that can be saved up
+        :param clock: IReactorTime provider, defaults to the reactor
+        """
+        self.rate = float(rate)
+        self.burst = burst
+        self._clock = clock
+        self.tokens = float(burst)
+        self._last_refill = None
+
+        self._queue = list()
+        self._sequence = count()
+        self._drain_call = None
+
+        self.waited = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def clock(self):
+        if self._clock is None:
+            from twisted.internet import reactor
+            self._clock = reactor
+        return self._clock
+
+    def schedule(self, func, priority=PRIORITY_NORMAL):
+        """
+        Run func when the rate limit allows it.
+
+        :returns: a Deferred firing with func's result
+        :rtype: defer.Deferred
+        """
+        # imported here, since the asyncio backend (see aio) imports this module through utils without Twisted
+        from twisted.internet import defer
+        self._refill()
+        if not self._queue and self.tokens >= 1:
+            self.tokens -= 1
+            return defer.maybeDeferred(func)
+
+        d = defer.Deferred(lambda d: self._cancel(entry))
+        entry = (priority, next(self._sequence), self.clock.seconds(), func, d)
+        heapq.heappush(self._queue, entry)
+        self._schedule_drain()
+        return d
+
+    def _cancel(self, entry):
+        # a cancelled request gives up its place in the queue, rather than a token when it comes up
+        if entry in self._queue:
+            self._queue.remove(entry)
+            heapq.heapify(self._queue)
+
+    def queued(self, priority=None):
+        """Number of requests waiting, optionally only those with a specific priority."""
+        if priority is None:
+            return len(self._queue)
+        return sum(1 for item in self._queue if item[0] == priority)
+
+    def _refill(self):
+        now = self.clock.seconds()
+        if self._last_refill is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def _schedule_drain(self):
+        if self._drain_call is None or not self._drain_call.active():
+            delay = max(0, (1 - self.tokens) / self.rate)
+            self._drain_call = self.clock.callLater(delay, self._drain)
+
+    def _drain(self):
+        from twisted.internet import defer
+        self._refill()
+        while self._queue and self.tokens >= 1:
+            self.tokens -= 1
+            _, _, enqueued, func, d = heapq.heappop(self._queue)
+            wait = self.clock.seconds() - enqueued
+            self.waited += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            defer.maybeDeferred(func).chainDeferred(d)
+        if self._queue:
+            self._schedule_drain()
+
+    def stats(self):
+        lanes = (PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW)
+        return {'queued': self.queued(),
+                'queued_by_priority': dict((lane, self.queued(lane)) for lane in lanes),
+                'tokens': self.tokens,
+                'waited': self.waited,
+                'mean_wait': self.total_wait / self.waited if self.waited else 0.0,
+                'max_wait': self.max_wait}
+
+
+_schedulers = dict()
+
+
+def configure(host, rate, burst):
+    """
+    Set the rate limit for a host, replacing its scheduler. Requests already queued keep their old limit.
+
+    :param rate: requests per second, or None to stop limiting the host
+    """
+    if rate is None:
+        LIMITS.pop(host, None)
+    else:
+        LIMITS[host] = (rate, burst)
+    _schedulers.pop(host, None)
+
+
+def schedule(host, func, priority=PRIORITY_NORMAL):
+    """
+    Run func when the host's rate limit allows it, see HostScheduler.schedule.
+
+    :rtype: defer.Deferred
+    """
+    if host not in LIMITS:
+        from twisted.internet import defer
+        return defer.maybeDeferred(func)
+    if host not in _schedulers:
+        _schedulers[host] = HostScheduler(*LIMITS[host])
+    return _schedulers[host].schedule(func, priority)
+
+
+def stats():
+    """:returns: dict of host -> queue depth and wait time stats"""
+    return dict((host, scheduler.stats()) for host, scheduler in _schedulers.items())
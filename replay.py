@@ -0,0 +1,491 @@
+#!/usr/bin/env python
+"""
+Record live REST and Pusher traffic, and replay it later, optionally faster than real time.
+
+Recording::
+
+    recorder = Recorder('session.jsonl')
+    recorder.start()                            # everything going through utils._request
+    api = recorder.attach(BitstampWebsocketAPI2())  # before anything listens to it
+
+Replaying::
+
+    session = Replay('session.jsonl', speed=100)   # speed=None for as fast as possible
+    session.start()                                # serves REST responses from a local HTTP server
+    observer = BitstampObserver(api=session.websocket_api())
+    session.done.addCallback(lambda _: session.stop())
+
+Recordings are JSON lines: a header, then one entry per response or Pusher event with the seconds since the
+recording started.
+"""
+
+import base64
+import logging
+import json
+
+from twisted.internet import defer
+from twisted.web import server, resource
+
+from exchangelib import utils
+from exchangelib.compat import urlparse, parse_qsl, urlencode, string_types, text_type, native_str
+from exchangelib.errors import HTTPError
+
+log = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+# Pusher events delivered per reactor iteration when replaying as fast as possible
+FAST_BATCH = 100
+
+
+def request_key(method, url, params=None):
+    """
+    Key a request by method, host, path and query parameters, leaving out the scheme and parameter order.
+
+    :rtype: str
+    """
+    parsed = urlparse(url)
+    query = parse_qsl(parsed.query, keep_blank_values=True)
+    for name, value in (params or {}).items():
+        values = value if isinstance(value, (list, tuple)) else [value]
+        query.extend((name, v) for v in values)
+    query = sorted((_to_str(name), _to_str(value)) for name, value in query)
+    key = '{} {}{}'.format(method.upper(), parsed.hostname, parsed.path)
+    return key + '?' + urlencode(query) if query else key
+
+
+def _to_str(value):
+    # python 2's urlencode wants byte strings
+    return value.encode('utf-8') if isinstance(value, text_type) and text_type is not str else str(value)
+
+
+class Recorder(object):
+    """Writes responses and Pusher events to a recording as they arrive."""
+
+    def __init__(self, path, clock=None):
+        """
+        :param path: file to write the recording to, overwritten if it exists
+        :param clock: IReactorTime provider, defaults to the reactor
+        """
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.clock = clock
+        self.path = path
+        self.entries = 0
+        self._file = None
+        self._started = None
+        self._original_request = None
+
+    def start(self):
+        """Start recording, including every request made through utils."""
+        self._file = open(self.path, 'w')
+        self._started = self.clock.seconds()
+        self._write({'version': FORMAT_VERSION, 'started': self._started})
+        self._original_request = utils._request
+        utils._request = self._request
+
+    def stop(self):
+        if self._original_request is not None:
+            utils._request = self._original_request
+            self._original_request = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def attach(self, api):
+        """
+        Record the Pusher events delivered to a websocket API. Must be called before anything listens to it.
+
+        :type api: bitstamp.websocket.BitstampWebsocketAPI2
+        :returns: api
+        """
+        api._pusher = _RecordingPusher(api._pusher, self)
+        return api
+
+    def record_event(self, channel, event):
+        self._record({'type': 'pusher', 'channel': channel, 'event': event.name, 'data': event.data})
+
+    def _request(self, method, url, **kwargs):
+        params = kwargs.get('params')
+        collector = kwargs.get('collector')
+        chunks = list()
+        if collector is not None:
+            def collect(chunk):
+                chunks.append(chunk)
+                collector(chunk)
+            kwargs['collector'] = collect
+
+        def recorded(result):
+            body = b''.join(chunks) if collector is not None else result
+            self._record(dict({'type': 'http', 'method': method, 'url': url, 'params': params, 'status': 200},
+                              **_body_fields(body)))
+            return result
+
+        def failed(failure):
+            if failure.check(HTTPError):
+                self._record(dict({'type': 'http', 'method': method, 'url': url, 'params': params,
+                                   'status': failure.value.code}, **_body_fields(failure.value.body)))
+            return failure
+        return self._original_request(method, url, **kwargs).addCallbacks(recorded, failed)
+
+    def _record(self, entry):
+        if self._file is None:
+            return
+        entry['t'] = self.clock.seconds() - self._started
+        self._write(entry)
+        self.entries += 1
+
+    def _write(self, entry):
+        self._file.write(json.dumps(entry, default=str) + '\n')
+
+
+def _body_fields(body):
+    """
+    Entry fields for a response body that survive JSON: bodies are kept as text, or base64 in body_base64 if they
+    aren't UTF-8.
+    """
+    if body is None:
+        return {'body': ''}
+    if isinstance(body, text_type):
+        return {'body': body}
+    try:
+        return {'body': body.decode('utf-8')}
+    except UnicodeDecodeError:
+        return {'body_base64': base64.b64encode(body).decode('ascii')}
+
+
+def _body(entry):
+    """:returns: the recorded body of an entry, as bytes"""
+    if 'body_base64' in entry:
+        return base64.b64decode(entry['body_base64'])
+    body = entry['body']
+    return body.encode('utf-8') if isinstance(body, text_type) else body
+
+
+class _RecordingPusher(object):
+    def __init__(self, pusher, recorder):
+        self._pusher = pusher
+        self._recorder = recorder
+
+    def subscribe(self, channel_name, *args, **kwargs):
+        channel = self._pusher.subscribe(channel_name, *args, **kwargs)
+        return _RecordingChannel(channel, channel_name, self._recorder)
+
+    def __getattr__(self, name):
+        return getattr(self._pusher, name)
+
+
+class _RecordingChannel(object):
+    def __init__(self, channel, name, recorder):
+        self._channel = channel
+        self._name = name
+        self._recorder = recorder
+
+    def _recording(self, listener):
+        def record(event):
+            # written out before the listener gets the chance to modify the event data
+            self._recorder.record_event(self._name, event)
+            return listener(event)
+        return record
+
+    def bind(self, event_name, listener):
+        return self._channel.bind(event_name, self._recording(listener))
+
+    def bind_all(self, listener):
+        return self._channel.bind_all(self._recording(listener))
+
+    def __getattr__(self, name):
+        return getattr(self._channel, name)
+
+
+def load(path):
+    """
+    Read a recording.
+
+    :returns: (header, entries)
+    :raises ValueError: if the file isn't a recording, or has an unsupported version
+    """
+    with open(path) as f:
+        lines = [line for line in f if line.strip()]
+    if not lines:
+        raise ValueError("'{}' is empty".format(path))
+    header = json.loads(lines[0])
+    if header.get('version') != FORMAT_VERSION:
+        raise ValueError("'{}' is not a version {} recording".format(path, FORMAT_VERSION))
+    return header, [json.loads(line) for line in lines[1:]]
+
+
+class Replay(object):
+    """
+    Plays back a recording: REST responses come from a local HTTP server that requests made through utils are
+    redirected to, and Pusher events are delivered to the FakePusher from pusher().
+
+    Time in the recording is scaled by speed, so at speed=100 ten minutes of events play in six seconds.
+    REST requests get the response recorded most recently before the current point in the recording.
+    With speed=None events are delivered as fast as possible, and each repeated request gets the next
+    recorded response in turn.
+    """
+
+    def __init__(self, path_or_entries, speed=1.0, clock=None, port=0):
+        """
+        :param path_or_entries: a recording file, or a list of entries
+        :param speed: playback speed factor, or None for as fast as possible
+        :param clock: IReactorTime and IReactorTCP provider, defaults to the reactor
+        :param port: port for the HTTP server, by default any free one
+        """
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.clock = clock
+        self.speed = speed
+        self.port = port
+
+        entries = load(path_or_entries)[1] if isinstance(path_or_entries, string_types) else path_or_entries
+        entries = sorted(entries, key=lambda entry: entry['t'])
+        self.events = [entry for entry in entries if entry['type'] == 'pusher']
+        self.responses = dict()
+        for entry in entries:
+            if entry['type'] == 'http':
+                key = request_key(entry['method'], entry['url'], entry.get('params'))
+                self.responses.setdefault(key, []).append(entry)
+        self._served = dict()
+
+        self.done = defer.Deferred()
+        self.delivered = 0
+        self.dropped = 0
+        self.requests = 0
+        self.unmatched = 0
+
+        self._pusher = FakePusher()
+        self._cursor = 0
+        self._timer = None
+        self._started = None
+        self._listening = None
+        self._original_request = None
+
+    def pusher(self):
+        """:rtype: FakePusher"""
+        return self._pusher
+
+    def websocket_api(self):
+        """:returns: a BitstampWebsocketAPI2 that gets its events from this replay"""
+        from exchangelib.bitstamp.websocket import BitstampWebsocketAPI2
+        return BitstampWebsocketAPI2(pusher=self._pusher)
+
+    def start(self):
+        """Start the HTTP server, redirect utils requests to it and start delivering events."""
+        site = server.Site(_ReplayResource(self))
+        self._listening = self.clock.listenTCP(self.port, site, interface='127.0.0.1')
+        self._original_request = utils._request
+        utils._request = self._request
+        self._started = self.clock.seconds()
+        self._schedule()
+
+    def stop(self):
+        """:rtype: defer.Deferred"""
+        if self._timer is not None and self._timer.active():
+            self._timer.cancel()
+        self._timer = None
+        if self._original_request is not None:
+            utils._request = self._original_request
+            self._original_request = None
+        if self._listening is not None:
+            listening, self._listening = self._listening, None
+            return defer.maybeDeferred(listening.stopListening)
+        return defer.succeed(None)
+
+    @property
+    def position(self):
+        """Seconds into the recording that playback has reached."""
+        if self._started is None:
+            return 0
+        if self.speed is None:
+            return self.events[self._cursor - 1]['t'] if self._cursor else 0
+        return (self.clock.seconds() - self._started) * self.speed
+
+    def response_for(self, key):
+        """
+        :returns: the recorded entry to answer a request with, or None
+        """
+        recorded = self.responses.get(key)
+        if not recorded:
+            return None
+        if self.speed is None:
+            index = self._served.get(key, 0)
+            self._served[key] = index + 1
+            return recorded[min(index, len(recorded) - 1)]
+        position = self.position
+        chosen = recorded[0]
+        for entry in recorded:
+            if entry['t'] > position:
+                break
+            chosen = entry
+        return chosen
+
+    def _request(self, method, url, **kwargs):
+        parsed = urlparse(url)
+        local = 'http://127.0.0.1:{}/{}{}'.format(self._listening.getHost().port, parsed.hostname, parsed.path)
+        if parsed.query:
+            local += '?' + parsed.query
+        return self._original_request(method, local, **kwargs)
+
+    def _schedule(self):
+        if self._cursor >= len(self.events):
+            self._timer = None
+            if not self.done.called:
+                self.done.callback(self)
+            return
+        if self.speed is None:
+            delay = 0
+        else:
+            due = self._started + self.events[self._cursor]['t'] / float(self.speed)
+            delay = max(0, due - self.clock.seconds())
+        self._timer = self.clock.callLater(delay, self._deliver_due)
+
+    def _deliver_due(self):
+        if self.speed is None:
+            end = min(len(self.events), self._cursor + FAST_BATCH)
+        else:
+            position = self.position
+            end = self._cursor
+            while end < len(self.events) and self.events[end]['t'] <= position:
+                end += 1
+        while self._cursor < end:
+            entry = self.events[self._cursor]
+            self._cursor += 1
+            if self._pusher.deliver(entry['channel'], entry['event'], entry['data']):
+                self.delivered += 1
+            else:
+                self.dropped += 1
+        self._schedule()
+
+
+class _ReplayResource(resource.Resource):
+    isLeaf = True
+
+    def __init__(self, replay):
+        resource.Resource.__init__(self)
+        self.replay = replay
+
+    def render(self, request):
+        self.replay.requests += 1
+        # the path starts with the original host, see Replay._request
+        key = request_key(native_str(request.method), 'http:/' + native_str(request.uri))
+        entry = self.replay.response_for(key)
+        if entry is None:
+            self.replay.unmatched += 1
+            log.warning("No recorded response for {}".format(key))
+            request.setResponseCode(404)
+            return b''
+        request.setResponseCode(entry['status'])
+        return _body(entry)
+
+
+class ReplayEvent(object):
+    """Stands in for twistedpusher's Event"""
+
+    def __init__(self, name, data=None, channel=None):
+        self.name = name
+        self.data = data
+        self.channel = channel
+
+
+class FakePusher(object):
+    """Stands in for twistedpusher.Pusher, with events coming from Replay instead of a connection."""
+
+    def __init__(self):
+        self.channels = dict()
+
+    def subscribe(self, channel_name, json_data=False, **kwargs):
+        """
+        :param json_data: ignored, event data is replayed exactly as it was recorded
+        :rtype: FakeChannel
+        """
+        if channel_name not in self.channels:
+            self.channels[channel_name] = FakeChannel(channel_name)
+        return self.channels[channel_name]
+
+    def unsubscribe(self, channel_name):
+        self.channels.pop(channel_name, None)
+
+    def deliver(self, channel_name, event_name, data):
+        """
+        :returns: whether the event had a subscribed channel to go to
+        :rtype: bool
+        """
+        channel = self.channels.get(channel_name)
+        if channel is None:
+            return False
+        channel.emit(ReplayEvent(event_name, data, channel_name))
+        return True
+
+
+class FakeChannel(object):
+    def __init__(self, name):
+        self.name = name
+        self._listeners = dict()
+        self._all_listeners = list()
+
+    def bind(self, event_name, listener):
+        self._listeners.setdefault(event_name, []).append(listener)
+
+    def bind_all(self, listener):
+        self._all_listeners.append(listener)
+
+    def unbind(self, event_name, listener):
+        if listener in self._listeners.get(event_name, ()):
+            self._listeners[event_name].remove(listener)
+
+    def emit(self, event):
+        for listener in self._listeners.get(event.name, []) + self._all_listeners:
+            listener(event)
+
+
+def main():
+    """Record a Bitstamp session, or replay one into a BitstampObserver and report the event rate."""
+    import argparse
+    import twisted.python.log
+    from twisted.internet import reactor
+    from exchangelib.bitstamp.observer import BitstampObserver
+    from exchangelib.bitstamp.websocket import BitstampWebsocketAPI2
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('action', choices=['record', 'play'])
+    parser.add_argument('path')
+    parser.add_argument('--seconds', type=float, default=600, help="how long to record for")
+    parser.add_argument('--speed', type=float, default=None, help="playback speed, default as fast as possible")
+    args = parser.parse_args()
+
+    twisted.python.log.PythonLoggingObserver().start()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.action == 'record':
+        recorder = Recorder(args.path)
+        recorder.start()
+        # seeded, so the orderbook snapshot is in the recording
+        observer = BitstampObserver(api=recorder.attach(BitstampWebsocketAPI2()))
+        observer.start()
+
+        def finish():
+            recorder.stop()
+            print("Recorded {} entries to {}".format(recorder.entries, args.path))
+            reactor.stop()
+        reactor.callLater(args.seconds, finish)
+    else:
+        session = Replay(args.path, speed=args.speed)
+        session.start()
+        observer = BitstampObserver(api=session.websocket_api())
+        observer.start()
+
+        def finish(_):
+            elapsed = reactor.seconds() - session._started
+            print("Delivered {} events ({} dropped) in {:.2f}s, {:.0f} events/s; {} requests served. "
+                  "Best bid {}, ask {}".format(session.delivered, session.dropped, elapsed,
+                                                session.delivered / max(elapsed, 1e-9), session.requests,
+                                                observer.highestbid, observer.lowestask))
+            return session.stop().addBoth(lambda _: reactor.stop())
+        session.done.addCallback(finish)
+    reactor.run()
+
+
+if __name__ == '__main__':
+    main()
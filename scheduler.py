@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+
+import logging
+import heapq
+import random
+import weakref
+from itertools import count
+
+from twisted.internet import defer
+from twisted.python.failure import Failure
+
+log = logging.getLogger(__name__)
+
+
+class PollJob(object):
+    """
+    A function polled by a PollScheduler. Created with PollScheduler.add, stopped with stop().
+
+    Stats (see stats()) are kept for runs, skipped runs, errors and latency, and for adaptive jobs how often
+    results change. Only adaptive jobs compare results, and keep the last one to compare the next with.
+    """
+
+    def __init__(self, scheduler, interval, target, processor=None, args=(), kwargs=None, jitter=0,
+                 max_interval=None, backoff=2, adaptive=False, latency_factor=4):
+        self.scheduler = scheduler
+        self.target = target
+        self.processor = processor
+        self.args = args
+        self.kwargs = kwargs or {}
+
+        self.base_interval = interval
+        self.interval = interval
+        self.max_interval = max_interval if max_interval is not None else interval * 16
+        self.jitter = jitter
+        self.backoff = backoff
+        self.adaptive = adaptive
+        self.latency_factor = latency_factor
+
+        self.running = False
+        self.stopped = False
+        self.next_run = None
+        self.failures = 0
+        self._last_result = None
+        self._started_at = None
+
+        self.runs = 0
+        self.skipped = 0
+        self.errors = 0
+        self.changes = 0
+        self.last_latency = None
+        self.mean_latency = None
+
+    def stop(self):
+        """Stop polling. A call that is already running is left to finish."""
+        if not self.stopped:
+            self.stopped = True
+            self.scheduler._remove(self)
+
+    def stats(self):
+        return {'interval': self.interval,
+                'runs': self.runs,
+                'skipped': self.skipped,
+                'errors': self.errors,
+                'changes': self.changes,
+                'running': self.running,
+                'last_latency': self.last_latency,
+                'mean_latency': self.mean_latency}
+
+    def _run(self, now):
+        if self.running:
+            # the last call hasn't finished, don't pile another on top of it
+            self.skipped += 1
+            return
+        self.running = True
+        self.runs += 1
+        self._started_at = now
+        result = defer.maybeDeferred(self.target, *self.args, **self.kwargs)
+        # added before the processor sees the result, and passes it through unchanged
+        result.addBoth(self._finished)
+        if self.processor:
+            self.processor(result)
+        else:
+            # nothing else will handle the failure
+            result.addErrback(self._log_failure)
+
+    def _log_failure(self, failure):
+        log.warning("Polling {} failed: {}".format(self.target, failure.getErrorMessage()))
+
+    def _finished(self, result):
+        self.running = False
+        interval = self.interval
+        latency = self.scheduler.clock.seconds() - self._started_at
+        self.last_latency = latency
+        self.mean_latency = latency if self.mean_latency is None else 0.8 * self.mean_latency + 0.2 * latency
+
+        if isinstance(result, Failure):
+            self.errors += 1
+            self.failures += 1
+            self.interval = min(self.max_interval, self.base_interval * self.backoff ** self.failures)
+        else:
+            self.failures = 0
+            if self.adaptive:
+                changed = result != self._last_result
+                self._last_result = result
+                if changed:
+                    self.changes += 1
+                self.interval = self._adapt(changed)
+            else:
+                self.interval = self.base_interval
+        if self.interval != interval and not self.stopped:
+            # the next run was scheduled with the old interval when this one started
+            self.scheduler._reschedule(self, self._started_at + self.interval)
+        return result
+
+    def _adapt(self, changed):
+        if changed:
+            # data is moving, poll faster again
+            interval = max(self.base_interval, self.interval / 2.0)
+        else:
+            interval = self.interval * 1.5
+        # don't poll faster than the endpoint can answer
+        interval = max(interval, self.mean_latency * self.latency_factor)
+        return min(self.max_interval, interval)
+
+
+class PollScheduler(object):
+    """
+    Runs any number of PollJobs using a single timer, set for whichever job is due next.
+    """
+
+    def __init__(self, clock=None):
+        """:param clock: IReactorTime provider, defaults to the reactor"""
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.clock = clock
+        self._queue = list()
+        self._sequence = count()
+        self._jobs = set()
+        self._timer = None
+
+    def add(self, interval, target, processor=None, args=(), kwargs=None, now=True, jitter=0, **options):
+        """
+        Start polling a function.
+
+        :param interval: seconds between calls of target
+        :param target: function to call, with args and kwargs
+        :param processor: called with a Deferred for each call's result (or failure)
+        :param now: whether the first call happens right away, or after interval
+        :param jitter: fraction of interval to randomly delay the first call by, to spread out jobs started together
+        :param options: max_interval (default 16 * interval), backoff (interval multiplier per consecutive error),
+            adaptive (slow down while results don't change, and keep the interval above latency_factor times
+            the average call latency)
+        :rtype: PollJob
+
+        :raises ValueError: if target or processor are not callable
+        """
+        if not callable(target) or (processor is not None and not callable(processor)):
+            raise ValueError("Target and processor must be callable")
+        job = PollJob(self, interval, target, processor, args, kwargs, jitter, **options)
+        self._jobs.add(job)
+
+        current = self.clock.seconds()
+        delay = 0 if now else interval
+        if jitter:
+            delay += random.uniform(0, jitter * interval)
+        if delay:
+            self._push(job, current + delay)
+        else:
+            job._run(current)
+            self._push(job, current + job.interval)
+        return job
+
+    @property
+    def jobs(self):
+        return set(self._jobs)
+
+    def stats(self):
+        """:returns: a list of (job, stats dict) for every job"""
+        return [(job, job.stats()) for job in self._jobs]
+
+    def _remove(self, job):
+        self._jobs.discard(job)
+        if not self._jobs and self._timer is not None and self._timer.active():
+            self._timer.cancel()
+            self._timer = None
+            self._queue = list()
+
+    def _reschedule(self, job, when):
+        when = max(when, self.clock.seconds())
+        if when != job.next_run:
+            self._push(job, when)
+
+    def _push(self, job, when, reset_timer=True):
+        """Schedule a job's next run, replacing any other (entries in the queue for other times are skipped)"""
+        job.next_run = when
+        heapq.heappush(self._queue, (when, next(self._sequence), job))
+        if reset_timer:
+            self._reset_timer()
+
+    def _reset_timer(self):
+        if not self._queue:
+            return
+        delay = max(0, self._queue[0][0] - self.clock.seconds())
+        if self._timer is not None and self._timer.active():
+            if self._timer.getTime() <= self._queue[0][0]:
+                return
+            self._timer.reset(delay)
+        else:
+            self._timer = self.clock.callLater(delay, self._run_due)
+
+    def _run_due(self):
+        self._timer = None
+        now = self.clock.seconds()
+        while self._queue and self._queue[0][0] <= now:
+            when, _, job = heapq.heappop(self._queue)
+            if job.stopped or when != job.next_run:
+                continue
+            job._run(now)
+            # keep to the original schedule unless it has fallen behind
+            next_run = when + job.interval
+            if next_run <= now:
+                next_run = now + job.interval
+            self._push(job, next_run, reset_timer=False)
+        self._reset_timer()
+
+
+# one scheduler for each reactor (tests use several clocks)
+_schedulers = weakref.WeakKeyDictionary()
+
+
+def default_scheduler():
+    """:rtype: PollScheduler"""
+    from twisted.internet import reactor
+    if reactor not in _schedulers:
+        _schedulers[reactor] = PollScheduler(reactor)
+    return _schedulers[reactor]
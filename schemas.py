@@ -35,7 +35,8 @@ HuobiMarketDetails = {'last': Decimal, 'open': Decimal, 'close': Decimal, 'high'
                       'volume': Decimal, 'basis_volume': Decimal, 'change_pct': Decimal,
                       'bids': [Order], 'asks': [Order], 'trades': TradeList}
 
-BitstampOrderChange = {'change': str, 'price': Decimal, 'amount': Decimal, 'timestamp': int, 'direction': str}
+BitstampOrderChange = {'change': str, 'price': Decimal, 'amount': Decimal, 'timestamp': int, 'direction': str,
+                       '?id': int, '?microtimestamp': int}
 
 # These are only for Bitfinex, might want to rename
 LendStats = {'amount_lent': Decimal, 'rate': Decimal, 'timestamp': int}
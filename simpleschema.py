@@ -1,26 +1,52 @@
 #!/usr/bin/env python
 
 import logging
-import collections
 import functools
+from collections import OrderedDict
 
-from twisted.internet import defer
+from exchangelib import metrics
+from exchangelib.compat import string_types, Iterable
 
 log = logging.getLogger(__name__)
 
 
+class Validated(object):
+    """
+    Base for result types that do their own conversions, such as book.OrderBook.
+    returns() passes instances through as they are instead of validating them against the schema.
+    """
+    __slots__ = ()
+
+
+class ConversionError(ValueError):
+    """
+    A value that couldn't be converted to its schema type, raised when it's first read from a lazy result
+    (see compile_lazy). path holds the keys and list indexes leading to the value from the top of the result.
+    """
+    def __init__(self, value, kind, cause):
+        super(ConversionError, self).__init__(value, kind, cause)
+        self.value = value
+        self.kind = kind
+        self.cause = cause
+        self.path = []
+
+    def __str__(self):
+        where = ''.join('[{!r}]'.format(step) for step in self.path) or 'value'
+        return "Can't convert {} = {!r} to {}: {}".format(where, self.value, self.kind.__name__, self.cause)
+
+
 def remap(data, schema):
     """Change key names in a data structure."""
     if isinstance(schema, dict):
         if not isinstance(data, dict):
             raise TypeError("Expected a dict")
         else:
-            for key in data.keys():
+            for key in list(data.keys()):
                 if key in schema:
                     data[schema[key]] = data.pop(key)
             return data
     elif isinstance(schema, list):
-        if not isinstance(data, collections.Iterable):
+        if not isinstance(data, Iterable):
             raise TypeError("Expected a list")
         else:
             new_list = list()
@@ -32,74 +58,421 @@ def remap(data, schema):
 
 
 def validate(data, schema):
-    """"""
-    if isinstance(schema, dict):
-        # todo consider optimizing the actual conversions to check whether the type is already correct
-        # '?ASDF' syntax to indicate an optional schema key 'ASDF' was inspired by Valideer
+    """
+    Convert data in place to the types given by a schema.
 
-        # schema requires a dict as data
-        if not isinstance(data, dict):
-            raise TypeError("Expected a dict")
+    Compiled validators are cached per schema, so repeated calls with the same schema object only walk it once.
+
+    :raises TypeError: if the data doesn't have the structure of the schema
+    :raises ValueError: if a required key is missing, or on a bad schema entry
+    """
+    return _compiled(schema)(data)
+
+
+def compile(schema):
+    """
+    Turn a schema into a function that validates data against it.
+
+    The schema is walked once here, including parsing the '?key' optional key syntax,
+    so the returned validator only has to do the actual conversions.
 
-        for k in schema:
-            # temp storage to avoid issues with the '?' being removed from k
-            schema_item = schema[k]
+    :type schema: dict or list
+    :returns: a validator, called with the data and returning the converted data
+    :rtype: callable
 
+    :raises TypeError: if the schema is not a list or dict
+    :raises ValueError: on a bad schema entry
+    """
+    if isinstance(schema, dict):
+        # '?ASDF' syntax to indicate an optional schema key 'ASDF' was inspired by Valideer
+        fields = list()
+        for k, schema_item in schema.items():
             # Check if it's an optional key, which are strings starting with '?'
-            if isinstance(k, basestring) and k.startswith('?'):
+            if isinstance(k, string_types) and k.startswith('?'):
                 k = k[1:]
                 optional = True
             else:
                 optional = False
+            fields.append((k, _compile_entry(schema_item, k), optional))
+        fields = tuple(fields)
 
-            if k not in data:
-                if not optional:
+        def validate_dict(data):
+            # schema requires a dict as data
+            if not isinstance(data, dict):
+                raise TypeError("Expected a dict")
+            for k, convert, optional in fields:
+                if k in data:
+                    data[k] = convert(data[k])
+                elif not optional:
                     raise ValueError("No key '{}' in data".format(k))
-                else:
-                    continue
-
-            if isinstance(schema_item, type):
-                # todo add try/except here
-                data[k] = schema_item(data[k])
-            elif isinstance(schema_item, (list, dict)):
-                data[k] = validate(data[k], schema_item)
-            else:
-                raise ValueError("bad schema entry '{}' in key {}".format(schema[k], k))
-        # todo check for extra keys in data in a strict mode!
-        return data
+            # todo check for extra keys in data in a strict mode!
+            return data
+        return validate_dict
 
     elif isinstance(schema, list):
         # todo handle multiple possible schemas for list entries
-        if not isinstance(data, collections.Iterable):
-            raise TypeError("Expected a list")
-        #if len(schema) > 1 or len(schema) <= 0:
-        #    raise TypeError("list schemas must only have 1 option currently")
+        if not schema or not isinstance(schema[0], (type, dict, list)):
+            raise ValueError("bad schema entry for a list")
+        convert = _compile_entry(schema[0])
 
-        new_data = list()
-        if isinstance(schema[0], type):
-            for item in data:
-                # todo add try/except here
-                new_data.append(schema[0](item))
-        elif isinstance(schema[0], (dict, list)):
-            for item in data:
-                new_data.append(validate(item, schema[0]))
-        else:
+        def validate_list(data):
+            if not isinstance(data, Iterable):
+                raise TypeError("Expected a list")
+            return [convert(item) for item in data]
+        return validate_list
+    else:
+        raise TypeError("Bad schema, expected a list or dict")
+
+
+def _compile_entry(schema_item, key=None):
+    """Get the conversion function for a single schema entry, either a type or a nested schema."""
+    if isinstance(schema_item, type):
+        # todo add try/except here
+        return _converter(schema_item)
+    elif isinstance(schema_item, (list, dict)):
+        return compile(schema_item)
+    else:
+        raise ValueError("bad schema entry '{}' in key {}".format(schema_item, key))
+
+
+def _converter(kind):
+    """Convert to a type, skipping the conversion when the value already has that exact type."""
+    def convert(value):
+        if type(value) is kind:
+            return value
+        return kind(value)
+    return convert
+
+
+def compile_lazy(schema):
+    """
+    Like compile, but the returned function converts nothing up front: it wraps the data in a LazyDict or
+    LazyList, which convert each value the first time it's read and keep the result. Only the structure of the
+    top level and its required keys are checked right away, the rest when it's read.
+
+    A value that can't be converted raises ConversionError when it's read.
+
+    :type schema: dict or list
+    :rtype: callable
+
+    :raises TypeError: if the schema is not a list or dict
+    :raises ValueError: on a bad schema entry
+    """
+    if isinstance(schema, dict):
+        converters = dict()
+        required = list()
+        for k, schema_item in schema.items():
+            if isinstance(k, string_types) and k.startswith('?'):
+                k = k[1:]
+            else:
+                required.append(k)
+            converters[k] = _compile_lazy_entry(schema_item, k)
+        required = tuple(required)
+
+        def wrap_dict(data):
+            if isinstance(data, LazyDict):
+                return data
+            if not isinstance(data, dict):
+                raise TypeError("Expected a dict")
+            for k in required:
+                if k not in data:
+                    raise ValueError("No key '{}' in data".format(k))
+            return LazyDict(data, converters)
+        return wrap_dict
+
+    elif isinstance(schema, list):
+        if not schema or not isinstance(schema[0], (type, dict, list)):
             raise ValueError("bad schema entry for a list")
-        return new_data
+        convert = _compile_lazy_entry(schema[0])
+
+        def wrap_list(data):
+            if isinstance(data, LazyList):
+                return data
+            if not isinstance(data, Iterable):
+                raise TypeError("Expected a list")
+            return LazyList(data, convert)
+        return wrap_list
     else:
         raise TypeError("Bad schema, expected a list or dict")
 
 
+def _compile_lazy_entry(schema_item, key=None):
+    if isinstance(schema_item, type):
+        convert = _converter(schema_item)
+
+        def convert_value(value):
+            try:
+                return convert(value)
+            except (TypeError, ValueError, ArithmeticError) as e:
+                # decimal's InvalidOperation is an ArithmeticError
+                raise ConversionError(value, schema_item, e)
+        return convert_value
+    elif isinstance(schema_item, (list, dict)):
+        return compile_lazy(schema_item)
+    else:
+        raise ValueError("bad schema entry '{}' in key {}".format(schema_item, key))
+
+
+class LazyDict(dict):
+    """
+    A dict of raw values, converted to their schema types as they're read. Made by compile_lazy.
+
+    Reading goes through __getitem__, get, items, values and iteration over items, so most code can't tell
+    the difference. Code that reads a dict's storage directly, such as json.dumps or dict(d), sees the raw
+    values for anything not read yet: call resolve() first. Comparing, copying and pickling resolve.
+    """
+    __slots__ = ('_converters', '_path')
+
+    def __init__(self, data, converters):
+        dict.__init__(self, data)
+        self._converters = converters
+        # keys and indexes from the top of the result, for error messages
+        self._path = ()
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        convert = self._converters.get(key)
+        if convert is None:
+            return value
+        try:
+            converted = convert(value)
+        except ConversionError as e:
+            e.path = list(self._path) + [key]
+            raise
+        # converters hand back values that already have their type, so each one is only converted once
+        if converted is not value:
+            dict.__setitem__(self, key, converted)
+            if isinstance(converted, (LazyDict, LazyList)):
+                converted._path = self._path + (key,)
+        return converted
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def pop(self, key, *default):
+        if key not in self:
+            return dict.pop(self, key, *default)
+        value = self[key]
+        dict.__delitem__(self, key)
+        return value
+
+    def values(self):
+        return [self[k] for k in self]
+
+    def items(self):
+        return [(k, self[k]) for k in self]
+
+    def itervalues(self):
+        return (self[k] for k in self)
+
+    def iteritems(self):
+        return ((k, self[k]) for k in self)
+
+    def resolve(self):
+        """Convert everything, including nested lazy values. :returns: self"""
+        for key in self._converters:
+            if key in self:
+                value = self[key]
+                if isinstance(value, (LazyDict, LazyList)):
+                    value.resolve()
+        return self
+
+    def copy(self):
+        return dict(self.resolve())
+
+    def __eq__(self, other):
+        _resolve(other)
+        return dict.__eq__(self.resolve(), other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        # as converted as it can be, repr shouldn't raise
+        try:
+            self.resolve()
+        except ConversionError:
+            pass
+        return dict.__repr__(self)
+
+    def __reduce__(self):
+        return dict, (dict(self.resolve()),)
+
+
+class LazyList(list):
+    """
+    A list of raw items, converted to their schema type as they're read. Made by compile_lazy.
+
+    Indexing, slicing and iterating convert, other list methods see the raw items: see LazyDict.
+    Slices are plain lists.
+    """
+    __slots__ = ('_convert', '_path')
+
+    def __init__(self, data, convert):
+        list.__init__(self, data)
+        self._convert = convert
+        self._path = ()
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        value = list.__getitem__(self, index)
+        if index < 0:
+            index += len(self)
+        try:
+            converted = self._convert(value)
+        except ConversionError as e:
+            e.path = list(self._path) + [index]
+            raise
+        if converted is not value:
+            list.__setitem__(self, index, converted)
+            if isinstance(converted, (LazyDict, LazyList)):
+                converted._path = self._path + (index,)
+        return converted
+
+    def __getslice__(self, i, j):
+        # python 2 only, for slices without a step
+        return self[i:j:]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __reversed__(self):
+        for i in range(len(self) - 1, -1, -1):
+            yield self[i]
+
+    def __contains__(self, value):
+        return any(item == value for item in self)
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def pop(self, index=-1):
+        value = self[index]
+        list.pop(self, index)
+        return value
+
+    def resolve(self):
+        """Convert everything, including nested lazy values. :returns: self"""
+        for item in self:
+            if isinstance(item, (LazyDict, LazyList)):
+                item.resolve()
+        return self
+
+    def __eq__(self, other):
+        _resolve(other)
+        return list.__eq__(self.resolve(), other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        # as converted as it can be, repr shouldn't raise
+        try:
+            self.resolve()
+        except ConversionError:
+            pass
+        return list.__repr__(self)
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+
+def resolve(data):
+    """Convert whatever is left unconverted in a result from a lazy returns(), before handing it to code that
+    reads containers' storage directly, such as json.dumps. Anything else is passed through.
+    :returns: data"""
+    return _resolve(data)
+
+
+def _resolve(data):
+    if isinstance(data, (LazyDict, LazyList)):
+        data.resolve()
+    return data
+
+
+# Compiled validators for schemas used with validate(), keyed by id() and least recently used first. The schema is
+# kept alongside its validator so the id can't be reused by another object while the entry exists.
+_validators = OrderedDict()
+# most validators kept, so schemas made on the fly don't pile up
+MAX_VALIDATORS = 256
+
+
+def _compiled(schema):
+    key = id(schema)
+    entry = _validators.pop(key, None)
+    if entry is not None and entry[0] is schema:
+        validator = entry[1]
+    else:
+        validator = compile(schema)
+    _validators[key] = (schema, validator)
+    if len(_validators) > MAX_VALIDATORS:
+        _validators.popitem(last=False)
+    return validator
+
+
 # possibly rename this... adapt_result? validate_result?
 # todo reconsider this optional-deferred scheme...
-def returns(schema, strictness=2):
+def returns(schema, strictness=2, lazy=False, timed=True):
+    """
+    Decorator that validates the return value of a function (or what its Deferred fires with) against a schema.
+    The schema is compiled once, when the function is decorated.
+
+    With lazy, results are converted as they're read instead (see compile_lazy), which is much cheaper when
+    only part of a large result is used, e.g. the top of a full orderbook. The decorated function also takes a
+    lazy keyword argument of its own to choose per call, e.g. ``bitstamp.data.orderbook(lazy=True)``, which is
+    not passed on to it.
+
+    Each call is timed as a metrics.Span labelled with the function's name, which also collects the timings
+    of any request the function makes with utils.get_json. Pass timed=False for functions called too often for
+    that to be worth it, like websocket event handlers.
+    """
+    validators = {False: compile(schema), True: compile_lazy(schema)}
+    default_lazy = lazy
+
+    def adapt(data, span, lazy):
+        if span is None:
+            return data if isinstance(data, Validated) else validators[lazy](data)
+        start = metrics.now()
+        if span.parsed_at is not None:
+            # time between the response being parsed and getting here is the function's own processing
+            span.record('remap', start - span.parsed_at)
+        if not isinstance(data, Validated):
+            data = validators[lazy](data)
+        end = metrics.now()
+        span.record('validate', end - start)
+        span.record('total', end - span.started)
+        return data
+
     def factory(func):
+        label = _metrics_label(func)
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            ret = func(*args, **kwargs)
-            if isinstance(ret, defer.Deferred):
-                return ret.addCallback(validate, schema)
+            lazy = bool(kwargs.pop('lazy', default_lazy))
+            if timed:
+                span = metrics.Span(label)
+                with metrics.activate(span):
+                    ret = func(*args, **kwargs)
             else:
-                return validate(ret, schema)
+                span = None
+                ret = func(*args, **kwargs)
+            # a Deferred, or what aio hands out in place of one
+            if hasattr(ret, 'addCallback'):
+                return ret.addCallback(adapt, span, lazy)
+            else:
+                return adapt(ret, span, lazy)
         return wrapper
     return factory
+
+
+def _metrics_label(func):
+    module = func.__module__ or ''
+    if module.startswith('exchangelib.'):
+        module = module[len('exchangelib.'):]
+    return '{}.{}'.format(module, func.__name__)
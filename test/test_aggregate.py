@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+from collections import OrderedDict
+from decimal import Decimal
+from twisted.trial import unittest
+from twisted.internet import defer, task
+from zope.interface import implementer
+
+from exchangelib import aggregate
+from exchangelib.book import OrderBook
+from exchangelib.interfaces import IDataAPI
+
+
+@implementer(IDataAPI)
+class FakeAPI(object):
+    def __init__(self, result):
+        """:param result: returned by every call, or a function making it (e.g. a failed Deferred) for each one"""
+        self.result = result
+        self.calls = list()
+
+    def _result(self):
+        return self.result() if callable(self.result) else self.result
+
+    def ticker(self, pair='btcusd'):
+        self.calls.append(pair)
+        return self._result()
+
+    def orderbook(self, pair='btcusd', columnar=False, depth=None):
+        self.calls.append((pair, depth))
+        return self._result()
+
+    def trades(self, pair='btcusd'):
+        return self._result()
+
+
+class FanOutTestCase(unittest.TestCase):
+    def setUp(self):
+        self.slow = defer.Deferred()
+        self.apis = {'fast': FakeAPI(defer.succeed('fast result')),
+                     'slow': FakeAPI(self.slow),
+                     'broken': FakeAPI(lambda: defer.fail(ValueError()))}
+        # only the fakes, without the default exchanges
+        self.patch(aggregate, '_exchanges', OrderedDict())
+        self.patch(aggregate, '_defaults_loaded', True)
+        for name, api in self.apis.items():
+            aggregate.register(name, api)
+
+    def test_register_requires_data_api(self):
+        self.assertRaises(ValueError, aggregate.register, 'bad', object())
+
+    def test_register_keeps_defaults(self):
+        """Registering an exchange before anything else doesn't stop the default ones being loaded."""
+        self.patch(aggregate, '_exchanges', OrderedDict())
+        self.patch(aggregate, '_defaults_loaded', False)
+        self.patch(aggregate, 'import_module', lambda path: FakeAPI(path))
+        aggregate.register('custom', self.apis['fast'])
+        self.assertEqual(list(aggregate.exchanges()), list(aggregate.DEFAULT_EXCHANGES) + ['custom'])
+
+    def test_unknown_name(self):
+        self.failureResultOf(aggregate.fan_out('ticker', names=['fast', 'nope']), ValueError)
+
+    def test_waits_for_all(self):
+        got = list()
+        d = aggregate.fan_out('ticker', pairs={'slow': 'ltcusd'}, on_result=lambda *r: got.append(r))
+        self.assertEqual(got, [('fast', 'fast result')])
+        self.assertEqual(self.apis['slow'].calls, ['ltcusd'])
+        self.assertFalse(d.called)
+        self.slow.callback('slow result')
+        d.addCallback(self.assertEqual, {'fast': 'fast result', 'slow': 'slow result'})
+        return d
+
+    def test_on_result_fails(self):
+        logged = list()
+        self.patch(aggregate.log, 'exception', lambda msg, *args, **kwargs: logged.append(msg))
+
+        def on_result(name, result):
+            raise KeyError(name)
+        d = aggregate.fan_out('ticker', names=['fast', 'broken'], on_result=on_result)
+        self.assertEqual(self.successResultOf(d), {'fast': 'fast result'})
+        self.assertEqual(len(logged), 1)
+
+    def test_deadline(self):
+        clock = task.Clock()
+        d = aggregate.fan_out('ticker', deadline=1, clock=clock)
+        clock.advance(1)
+        d.addCallback(self.assertEqual, {'fast': 'fast result'})
+        # a late result doesn't break anything
+        self.slow.callback('late')
+        return d
+
+
+class ConsolidateTestCase(unittest.TestCase):
+    def test_merges_by_price(self):
+        books = {'a': OrderBook.from_levels([[10, 1], [8, 1]], [[11, 1], [13, 1]]),
+                 'b': {'bids': [{'price': Decimal(9), 'amount': Decimal(2)}],
+                       'asks': [{'price': Decimal(12), 'amount': Decimal(2)}]}}
+        merged = aggregate.consolidate(books)
+        self.assertEqual([(l['price'], l['venue']) for l in merged['bids']], [(10, 'a'), (9, 'b'), (8, 'a')])
+        self.assertEqual([(l['price'], l['venue']) for l in merged['asks']], [(11, 'a'), (12, 'b'), (13, 'a')])
+        self.assertEqual(len(aggregate.consolidate(books, depth=2)['asks']), 2)
+
+
+class ConsolidatedOrderbookTestCase(unittest.TestCase):
+    def setUp(self):
+        book = OrderBook.from_levels([[10, 1], [9, 1]], [[11, 1], [12, 1]])
+        self.apis = OrderedDict([('usd', FakeAPI(book)), ('cny', FakeAPI(book)), ('any', FakeAPI(book))])
+        self.apis['usd'].PAIRS = ['btcusd', 'ltcusd']
+        self.apis['cny'].PAIRS = ['btccny']
+        self.patch(aggregate, '_exchanges', self.apis)
+        self.patch(aggregate, '_defaults_loaded', True)
+
+    def test_same_currency_by_default(self):
+        merged = self.successResultOf(aggregate.consolidated_orderbook(depth=2))
+        self.assertEqual(sorted(level['venue'] for level in merged['bids']), ['any', 'usd'])
+        self.assertEqual(self.apis['usd'].calls, [('btcusd', 2)])
+        self.assertEqual(self.apis['any'].calls, [('btcusd', 2)])
+        self.assertEqual(self.apis['cny'].calls, [])
+
+    def test_pairs_pick_exchanges(self):
+        self.successResultOf(aggregate.consolidated_orderbook({'cny': 'btccny'}))
+        self.assertEqual(self.apis['cny'].calls, [('btccny', None)])
+        self.assertEqual(self.apis['usd'].calls, [])
+
+    def test_mixed_currencies(self):
+        self.failureResultOf(aggregate.consolidated_orderbook({'usd': 'btcusd', 'cny': 'btccny'}), ValueError)
+        # any is left out of the dict, so gets btcusd
+        self.failureResultOf(aggregate.consolidated_orderbook({'cny': 'btccny'}, names=['cny', 'any']), ValueError)
+        self.assertEqual(self.apis['usd'].calls, [])
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+import json
+import sys
+import threading
+import unittest
+
+try:
+    import asyncio
+    from exchangelib import aio
+except (ImportError, SyntaxError):
+    aio = None
+
+from exchangelib import utils, errors
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+@unittest.skipIf(aio is None, "the asyncio backend needs Python 3")
+class CallTestCase(unittest.TestCase):
+    def setUp(self):
+        self.requests = list()
+        self.spans = list()
+        self.responses = dict()
+        original = aio._request
+
+        # no async def, so this module still compiles on Python 2
+        def fake_request(method, url, params=None, span=None, **kwargs):
+            self.requests.append((method, url, params))
+            self.spans.append(span)
+            response = asyncio.get_running_loop().create_future()
+            if isinstance(self.responses[url], Exception):
+                response.set_exception(self.responses[url])
+            else:
+                response.set_result(self.responses[url])
+            return response
+        aio._request = fake_request
+        self.addCleanup(setattr, aio, '_request', original)
+
+    def test_bitstamp_orderbook(self):
+        from exchangelib.bitstamp import data
+        self.responses['https://www.bitstamp.net/api/order_book/'] = json.dumps(
+            {'timestamp': '100', 'bids': [['250.5', '1']], 'asks': [['251', '2']]}).encode()
+        book = run(aio.DataAPI(data).orderbook())
+        self.assertEqual(self.requests, [('get', 'https://www.bitstamp.net/api/order_book/', {'group': 1})])
+        self.assertEqual(str(book['bids'][0]['price']), '250.5')
+        self.assertEqual(book['timestamp'], 100)
+
+    def test_same_result_as_twisted_callbacks(self):
+        """The callbacks and schema validation run just like they do on a Deferred."""
+        from exchangelib.bitstamp import data
+        self.responses['https://www.bitstamp.net/api/transactions/'] = (
+            b'[{"tid": 1, "date": "5", "price": "2", "amount": "3"}]')
+        trades = run(aio.call(data.trades))
+        self.assertEqual(trades, [{'id': 1, 'timestamp': 5, 'price': 2, 'amount': 3}])
+
+    def test_btce_single_pair(self):
+        from exchangelib.btce import data_v3
+        url = data_v3._make_url('depth', 'btcusd')
+        self.responses[url] = b'{"btc_usd": {"bids": [[1, 2]], "asks": [[3, 4]]}}'
+        book = run(aio.call(data_v3.orderbook, columnar=True))
+        self.assertEqual(book.best_ask, 3)
+
+    def test_span_passed(self):
+        """The span is no longer current by the time the request is made, so it's passed along."""
+        from exchangelib.bitstamp import data
+        self.responses['https://www.bitstamp.net/api/eur_usd/'] = b'{"buy": "1.1", "sell": "1.2"}'
+        run(aio.call(data.eur_usd))
+        self.assertEqual(self.spans[0].parent.label, 'bitstamp.data.eur_usd')
+
+    def test_errors_raised(self):
+        from exchangelib.bitstamp import data
+        self.responses['https://www.bitstamp.net/api/ticker/'] = errors.HTTPError("Not found", 404)
+        with self.assertRaises(errors.HTTPError):
+            run(aio.call(data.ticker))
+
+    def test_errback_handles(self):
+        url = 'http://example.com/'
+        self.responses[url] = errors.HTTPError("Gone", 410)
+
+        def func():
+            return utils.get_json(url).addErrback(lambda failure: failure.trap(errors.HTTPError) and 'handled')
+        self.assertEqual(run(aio.call(func)), 'handled')
+
+    def test_capture_released(self):
+        from exchangelib.bitstamp import data
+        self.responses['https://www.bitstamp.net/api/eur_usd/'] = b'{"buy": "1.1", "sell": "1.2"}'
+        run(aio.call(data.eur_usd))
+        self.assertIsNone(utils.capture)
+
+    def test_forex_update(self):
+        from exchangelib import forex
+        source = forex.ECBData()
+        self.responses[source.url] = b'{"rates": {"EUR": "0.9"}}'
+        rates = run(aio.update(source))
+        self.assertEqual(str(rates['EUR']), '0.9')
+        # fresh data now, so nothing to do
+        self.assertIsNone(run(aio.update(source)))
+        self.assertEqual(len(self.requests), 1)
+
+
+@unittest.skipIf(aio is None, "the asyncio backend needs Python 3")
+class TransportTestCase(unittest.TestCase):
+    """Requests against a local HTTP server."""
+
+    def setUp(self):
+        from http.server import HTTPServer, BaseHTTPRequestHandler
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith('/missing'):
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = json.dumps({'path': self.path, 'agent': self.headers['User-Agent']}).encode()
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.server_address[1])
+
+    def fetch(self, coroutine):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.run_until_complete(aio.close())
+            loop.close()
+
+    def test_timings(self):
+        from exchangelib import metrics
+        span = metrics.Span('x')
+        self.fetch(aio._request('get', self.url + 'ticker', span=span))
+        self.assertEqual(sorted(span.stages), ['body', 'ttfb'])
+
+    def test_get_json(self):
+        data = self.fetch(aio.get_json(self.url + 'ticker', {'a': 1}))
+        self.assertEqual(data['path'], '/ticker?a=1')
+        self.assertTrue(data['agent'].startswith('exchangelib/'))
+
+    def test_collector(self):
+        chunks = list()
+        self.assertIsNone(self.fetch(aio.get(self.url + 'ticker', collector=chunks.append)))
+        self.assertEqual(json.loads(b''.join(chunks).decode())['path'], '/ticker')
+
+    def test_http_error(self):
+        with self.assertRaises(errors.HTTPError) as raised:
+            self.fetch(aio.get(self.url + 'missing'))
+        self.assertEqual(raised.exception.code, 404)
+
+
+@unittest.skipIf(aio is None, "the asyncio backend needs Python 3")
+class ImportTestCase(unittest.TestCase):
+    def test_no_twisted(self):
+        import subprocess
+        code = ("import sys; from exchangelib import aio; import exchangelib.bitstamp.data, exchangelib.bitfinex, "
+                "exchangelib.btce, exchangelib.huobi; sys.exit('twisted' in sys.modules)")
+        self.assertEqual(subprocess.call([sys.executable, '-c', code]), 0)
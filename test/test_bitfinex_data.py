@@ -1,5 +1,7 @@
 # !/usr/bin/env python
 
+import mock
+from twisted.internet import defer
 from twisted.trial import unittest
 from zope.interface.verify import verifyObject
 
@@ -11,3 +13,7 @@ class DataTestCase(unittest.TestCase):
     def test_implements_data_api(self):
         verifyObject(IDataAPI, data)
 
+    def test_orderbook_limits_sent(self):
+        with mock.patch('exchangelib.bitfinex.data.get_json', return_value=defer.Deferred()) as get_json:
+            data.orderbook(depth=20, limit_asks=5)
+        self.assertEqual(get_json.call_args[1]['params'], {'limit_bids': 20, 'limit_asks': 5, 'group': 1})
@@ -0,0 +1,108 @@
+# !/usr/bin/env python
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+from twisted.trial import unittest
+from twisted.internet import defer, task
+
+import treq
+
+from exchangelib import utils, ratelimit, pool
+from exchangelib.bitfinex import private
+from exchangelib.errors import HTTPError
+
+
+class NonceTestCase(unittest.TestCase):
+    def test_strictly_increasing(self):
+        self.patch(time, 'time', lambda: 1000.0)
+        nonces = private.NonceGenerator()
+        self.assertEqual([nonces.next() for _ in range(3)], [1000000000, 1000000001, 1000000002])
+
+    def test_never_goes_back(self):
+        now = [1000.0]
+        self.patch(time, 'time', lambda: now[0])
+        nonces = private.NonceGenerator()
+        first = nonces.next()
+        now[0] -= 5
+        self.assertEqual(nonces.next(), first + 1)
+
+    def test_shared_file(self):
+        if private.fcntl is None:
+            raise unittest.SkipTest("needs fcntl")
+        self.patch(time, 'time', lambda: 1000.0)
+        path = os.path.abspath(self.mktemp())
+        first, second = private.NonceGenerator(path), private.NonceGenerator(path)
+        self.assertEqual([first.next(), second.next(), first.next()], [1000000000, 1000000001, 1000000002])
+
+
+class SignTestCase(unittest.TestCase):
+    def test_signature(self):
+        auth = private.Auth('key', 'secret')
+        signed = auth.sign({'request': '/v1/orders'})
+        payload = json.loads(signed['data'])
+        self.assertEqual(payload['nonce'], auth.nonce)
+
+        packed = signed['headers']['X-BFX-PAYLOAD']
+        self.assertEqual(base64.standard_b64decode(packed).decode('utf-8'), signed['data'])
+        expected = hmac.new(b'secret', packed.encode('ascii'), hashlib.sha384).hexdigest()
+        self.assertEqual(signed['headers']['X-BFX-SIGNATURE'], expected)
+        # the precomputed key state isn't used up
+        self.assertNotEqual(auth.sign({})['headers']['X-BFX-SIGNATURE'], expected)
+
+
+class PipelineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.auth = private.Auth('key', 'secret', max_in_flight=2)
+        self.pending = list()
+        self.patch(private, 'post', self.post)
+
+    def post(self, url, priority, signer):
+        d = defer.Deferred()
+        self.pending.append((signer, d))
+        return d
+
+    def test_window(self):
+        results = [private.active_orders(self.auth) for _ in range(3)]
+        self.assertEqual(len(self.pending), 2)
+        self.pending[0][1].callback('orders')
+        self.assertEqual(len(self.pending), 3)
+        self.assertEqual(self.successResultOf(results[0]), 'orders')
+
+    def test_retries_nonce_errors(self):
+        d = private.active_orders(self.auth)
+        self.pending[0][1].errback(HTTPError("Bad", 400, b'{"message": "Nonce is too small."}'))
+        self.assertEqual(len(self.pending), 2)
+        self.assertEqual(self.auth.nonce_errors, 1)
+        self.pending[1][1].callback('orders')
+        self.assertEqual(self.successResultOf(d), 'orders')
+
+    def test_other_errors_not_retried(self):
+        d = private.active_orders(self.auth)
+        self.pending[0][1].errback(HTTPError("Bad", 400, b'{"message": "Invalid order"}'))
+        self.assertEqual(len(self.pending), 1)
+        self.failureResultOf(d, HTTPError)
+
+
+class SignerTestCase(unittest.TestCase):
+    def test_signed_when_sent(self):
+        """A request queued behind the rate limit is signed when it leaves the queue."""
+        sent = list()
+        clock = task.Clock()
+        scheduler = ratelimit.HostScheduler(rate=1, burst=1, clock=clock)
+        self.patch(treq, 'request', lambda method, url, **kwargs: sent.append(kwargs) or defer.Deferred())
+        self.patch(ratelimit, 'schedule', lambda host, func, priority: scheduler.schedule(func, priority))
+        self.patch(pool, 'get_pool', lambda: None)
+        self.patch(pool, 'limit', lambda host, func: func())
+
+        auth = private.Auth('key', 'secret')
+        utils.post('http://example.com/first')
+        utils.post('http://example.com/private', signer=lambda: auth.sign({}))
+        self.assertEqual(auth.nonce, 0)
+        clock.advance(1)
+        self.assertEqual(sent[1]['headers']['X-BFX-APIKEY'], 'key')
+        self.assertTrue(sent[1]['headers']['User-Agent'].startswith('exchangelib/'))
+        self.assertEqual(json.loads(sent[1]['data'])['nonce'], auth.nonce)
@@ -2,6 +2,7 @@
 
 from mock import Mock, patch
 from twisted.trial import unittest
+from twisted.internet import defer
 from zope.interface.verify import verifyObject
 
 from exchangelib import bitstamp
@@ -15,7 +16,18 @@ class DataTestCase(unittest.TestCase):
     @patch('treq.request')
     def test_url_generation_with_ticker(self, mock_get):
         """Simple test to ensure URL generation works."""
+        # the response never arrives, it's only the URL that matters
+        mock_get.return_value = defer.Deferred()
         correct_url = 'https://www.bitstamp.net/api/ticker/'
         bitstamp.ticker()
         actual_url = mock_get.call_args[0][1]
-        self.assertEqual(correct_url, actual_url, "Incorrect URL generated")
\ No newline at end of file
+        self.assertEqual(correct_url, actual_url, "Incorrect URL generated")
+
+    def test_orderbook_depth(self):
+        book = {'timestamp': '1', 'bids': [['3', '1'], ['2', '1'], ['1', '1']], 'asks': [['4', '1'], ['5', '1']]}
+        with patch('exchangelib.bitstamp.data.get_json', side_effect=lambda **kwargs: defer.succeed(dict(book))):
+            limited = self.successResultOf(bitstamp.orderbook(depth=2))
+            columnar = self.successResultOf(bitstamp.orderbook(depth=1, columnar=True))
+        self.assertEqual([order['price'] for order in limited['bids']], [3, 2])
+        self.assertEqual(len(limited['asks']), 2)
+        self.assertEqual((len(columnar.bids), len(columnar.asks)), (1, 1))
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+from decimal import Decimal
+from twisted.trial import unittest
+from twisted.internet import defer, task
+
+from exchangelib.bitstamp.livebook import LiveOrderBook
+from exchangelib.bitstamp.observer import BitstampObserver
+from exchangelib.bitstamp.websocket import BitstampWebsocketAPI2
+from exchangelib.replay import FakePusher
+
+
+def change(kind, direction, price, amount, order_id, timestamp=100, microtimestamp=None):
+    data = {'change': kind, 'direction': direction, 'price': Decimal(price), 'amount': Decimal(amount),
+            'id': order_id, 'timestamp': timestamp}
+    if microtimestamp is not None:
+        data['microtimestamp'] = microtimestamp
+    return data
+
+
+class LiveOrderBookTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.snapshots = list()
+        self.book = LiveOrderBook(resync_after=2, min_resync_interval=10, clock=self.clock)
+        self.book.start(self.request_snapshot)
+
+    def request_snapshot(self):
+        self.snapshots.append(defer.Deferred())
+        return self.snapshots[-1]
+
+    @property
+    def snapshot(self):
+        return self.snapshots[-1]
+
+    def seed(self, timestamp=50, **extra):
+        book = {'bids': [{'price': Decimal(10), 'amount': Decimal(1)},
+                                         {'price': Decimal(9), 'amount': Decimal(2)}],
+                                'asks': [{'price': Decimal(11), 'amount': Decimal(3)}],
+                                'timestamp': timestamp}
+        book.update(extra)
+        self.snapshot.callback(book)
+
+    def test_seeded_from_snapshot(self):
+        self.assertFalse(self.book.synced)
+        self.seed()
+        self.assertTrue(self.book.synced)
+        self.assertEqual(self.book.best_bid, Decimal(10))
+        self.assertEqual(self.book.best_ask, Decimal(11))
+
+    def test_create_change_delete(self):
+        """Individual order events move the best bid and ask."""
+        self.seed()
+        self.book.on_order_change(change('created', 'bid', '10.5', '1', 1))
+        self.assertEqual(self.book.best_bid, Decimal('10.5'))
+        self.book.on_order_change(change('changed', 'bid', '10.5', '0.25', 1))
+        self.assertEqual(self.book.bids.amount(Decimal('10.5')), Decimal('0.25'))
+        self.book.on_order_change(change('deleted', 'bid', '10.5', '0.25', 1))
+        self.assertEqual(self.book.best_bid, Decimal(10))
+        self.book.on_order_change(change('deleted', 'ask', '11', '3', 2))
+        self.assertIsNone(self.book.best_ask)
+
+    def test_events_buffered_until_snapshot(self):
+        """Events received before the snapshot are replayed if they're newer than it."""
+        self.book.on_order_change(change('created', 'ask', '10.8', '1', 1, timestamp=40))
+        self.book.on_order_change(change('created', 'ask', '10.9', '1', 2, timestamp=60))
+        self.assertIsNone(self.book.best_ask)
+        self.seed(timestamp=50)
+        self.assertNotIn(Decimal('10.8'), self.book.asks)
+        self.assertEqual(self.book.best_ask, Decimal('10.9'))
+
+    def test_reconcile(self):
+        """Partial snapshots correct the levels they cover."""
+        self.seed()
+        changed = self.book.reconcile({'bids': [{'price': Decimal(10), 'amount': Decimal(5)}],
+                                       'asks': [{'price': Decimal('10.9'), 'amount': Decimal(1)}]})
+        self.assertEqual(changed, 2)
+        self.assertEqual(self.book.top(), {'bids': [{'price': Decimal(10), 'amount': Decimal(5)},
+                                                    {'price': Decimal(9), 'amount': Decimal(2)}],
+                                           'asks': [{'price': Decimal('10.9'), 'amount': Decimal(1)},
+                                                    {'price': Decimal(11), 'amount': Decimal(3)}]})
+
+    def test_snapshot_second_replayed(self):
+        """Events from the snapshot's own second aren't dropped, and ones before it still update known orders."""
+        self.book.on_order_change(change('created', 'ask', '10.8', '1', 1, timestamp=40))
+        self.book.on_order_change(change('created', 'ask', '10.9', '1', 2, timestamp=50))
+        self.seed(timestamp=50)
+        self.assertEqual(self.book.best_ask, Decimal('10.9'))
+        # order 1 was in the snapshot, its amount is known now
+        self.book.on_order_change(change('changed', 'ask', '10.8', '0.5', 1))
+        self.assertEqual(self.book.unknown_changes, 0)
+
+    def test_microtimestamps(self):
+        """Events are sequenced by microtimestamp when they and the snapshot have one."""
+        self.book.on_order_change(change('created', 'ask', '10.8', '1', 1, timestamp=50, microtimestamp=50000100))
+        self.book.on_order_change(change('created', 'ask', '10.9', '1', 2, timestamp=50, microtimestamp=50000300))
+        self.seed(timestamp=50, microtimestamp='50000200')
+        self.assertNotIn(Decimal('10.8'), self.book.asks)
+        self.assertEqual(self.book.best_ask, Decimal('10.9'))
+
+    def test_repeated_events(self):
+        """Applying the same event twice has no further effect."""
+        self.seed()
+        for _ in range(2):
+            self.book.on_order_change(change('created', 'bid', '10.5', '1', 1))
+        self.assertEqual(self.book.bids.amount(Decimal('10.5')), 1)
+        for _ in range(2):
+            self.book.on_order_change(change('deleted', 'ask', '11', '1', 2))
+        self.assertEqual(self.book.asks.amount(Decimal(11)), 2)
+
+    def test_pre_snapshot_order_changed(self):
+        """Changes to orders from before the snapshot are exact after the first one, and trigger a resync."""
+        self.seed()
+        self.book.on_order_change(change('changed', 'bid', '9', '1.5', 7))
+        self.assertEqual(self.book.unknown_changes, 1)
+        self.book.on_order_change(change('changed', 'bid', '9', '0.5', 7))
+        self.assertEqual(self.book.bids.amount(Decimal(9)), 1)
+
+        self.clock.advance(10)
+        self.book.on_order_change(change('changed', 'ask', '11', '2', 8))
+        self.assertEqual((self.book.resyncs, self.book.synced, len(self.snapshots)), (1, False, 2))
+        self.book.on_order_change(change('changed', 'bid', '9', '0.25', 7, timestamp=200))
+        self.snapshot.callback({'bids': [{'price': Decimal(9), 'amount': Decimal('1.5')}],
+                                'asks': [{'price': Decimal(11), 'amount': Decimal(2)}], 'timestamp': 150})
+        self.assertEqual(self.book.top(), {'bids': [{'price': Decimal(9), 'amount': Decimal('1.25')}],
+                                           'asks': [{'price': Decimal(11), 'amount': Decimal(2)}]})
+
+    def test_failed_snapshot_retried(self):
+        """Failed snapshots are retried with backoff, holding events back meanwhile."""
+        self.snapshot.errback(IOError("down"))
+        self.book.on_order_change(change('created', 'bid', '10.5', '1', 1))
+        self.clock.advance(1)
+        self.snapshot.errback(IOError("down"))
+        self.clock.advance(1)
+        self.assertEqual(len(self.snapshots), 2)
+        self.clock.advance(1)
+        self.seed()
+        self.assertTrue(self.book.synced)
+        self.assertEqual(self.book.best_bid, Decimal('10.5'))
+        self.assertEqual(self.book.failed_snapshots, 0)
+
+
+class ObserverTestCase(unittest.TestCase):
+    def setUp(self):
+        self.pusher = FakePusher()
+        self.observer = BitstampObserver(api=BitstampWebsocketAPI2(pusher=self.pusher))
+        self.clock = self.observer.live_book.clock = task.Clock()
+        self.snapshot = defer.Deferred()
+
+    def test_not_seeded_by_default(self):
+        self.assertIsNone(self.observer.live_book._snapshot)
+
+    def test_stale_live_book(self):
+        """Prices come from the order_book channel while the live book isn't synced or hasn't been updated."""
+        self.pusher.deliver('order_book', 'data', {'bids': [['250', '1']], 'asks': [['251', '1']]})
+        self.observer.live_book.start(lambda: self.snapshot)
+        self.assertEqual(self.observer.highestbid, 250)
+        self.snapshot.callback({'bids': [{'price': Decimal(249), 'amount': Decimal(1)}], 'asks': []})
+        self.assertEqual(self.observer.highestbid, 249)
+        self.clock.advance(61)
+        self.assertEqual(self.observer.highestbid, 250)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+import random
+from decimal import Decimal
+from twisted.trial import unittest
+
+from exchangelib import simpleschema, schemas
+from exchangelib.book import OrderBook, BookSide, PriceLevels
+
+
+class OrderBookTestCase(unittest.TestCase):
+    def setUp(self):
+        self.book = OrderBook.from_levels([['10.5', '1'], ['10.0', '2.5']], [['11', '0.5']], '1425040254')
+
+    def test_from_levels(self):
+        """Levels are split into parallel lists of Decimals."""
+        self.assertEqual(self.book.bids.prices, [Decimal('10.5'), Decimal('10.0')])
+        self.assertEqual(self.book.bids.amounts, [Decimal(1), Decimal('2.5')])
+        self.assertEqual(self.book.timestamp, 1425040254)
+
+    def test_to_dict_matches_schema_validation(self):
+        """to_dict gives the same result as validating the list-of-dicts structure."""
+        as_dicts = {'bids': [{'price': '10.5', 'amount': '1'}, {'price': '10.0', 'amount': '2.5'}],
+                    'asks': [{'price': '11', 'amount': '0.5'}], 'timestamp': '1425040254'}
+        self.assertEqual(self.book.to_dict(), simpleschema.validate(as_dicts, schemas.OrderBook))
+        self.assertEqual(OrderBook.from_dict(self.book.to_dict()).to_dict(), self.book.to_dict())
+
+    def test_spread_and_mid(self):
+        self.assertEqual(self.book.spread, Decimal('0.5'))
+        self.assertEqual(self.book.mid, Decimal('10.75'))
+        self.assertIsNone(OrderBook().spread)
+
+    def test_dict_style_access(self):
+        self.assertEqual(self.book['bids'][0], {'price': Decimal('10.5'), 'amount': Decimal(1)})
+        self.assertRaises(KeyError, self.book.__getitem__, 'to_dict')
+
+    def test_truncate(self):
+        self.book.truncate(1)
+        self.assertEqual(len(self.book.bids), 1)
+        self.assertEqual(len(self.book.asks), 1)
+
+    def test_returns_passes_through(self):
+        """simpleschema.returns doesn't try to validate a columnar book."""
+        @simpleschema.returns(schemas.OrderBook)
+        def get_book():
+            return self.book
+        self.assertIs(get_book(), self.book)
+
+    def test_mismatched_lengths(self):
+        self.assertRaises(ValueError, BookSide, [1, 2], [1])
+
+
+class PriceLevelsTestCase(unittest.TestCase):
+    def test_best_price(self):
+        bids = PriceLevels(descending=True)
+        asks = PriceLevels()
+        for price in (3, 1, 2):
+            bids.set(Decimal(price), Decimal(1))
+            asks.set(Decimal(price), Decimal(1))
+        self.assertEqual(bids.best, 3)
+        self.assertEqual(asks.best, 1)
+        self.assertEqual([level['price'] for level in bids.top(2)], [3, 2])
+
+    def test_levels_removed_when_empty(self):
+        levels = PriceLevels()
+        levels.add(Decimal(5), Decimal(1))
+        levels.add(Decimal(5), Decimal(-1))
+        self.assertNotIn(Decimal(5), levels)
+        self.assertEqual(len(levels), 0)
+        self.assertIsNone(levels.best)
+
+    def test_deep_book_stays_sorted(self):
+        """Levels come out in order after many inserts and removals at random prices."""
+        rng = random.Random(1)
+        bids, asks, expected = PriceLevels(descending=True), PriceLevels(), set()
+        for _ in range(3000):
+            price = Decimal(rng.randint(1, 1000))
+            amount = Decimal(rng.choice([0, 1, 2]))
+            for levels in (bids, asks):
+                levels.set(price, amount)
+            if amount:
+                expected.add(price)
+            else:
+                expected.discard(price)
+        self.assertEqual([level['price'] for level in asks.top()], sorted(expected))
+        self.assertEqual([level['price'] for level in bids.top()], sorted(expected, reverse=True))
+        self.assertEqual(len(bids), len(expected))
+
+    def test_replace_range_bids(self):
+        bids = PriceLevels(descending=True)
+        for price in (1, 2, 3, 4):
+            bids.set(Decimal(price), Decimal(1))
+        self.assertEqual(bids.replace_range([{'price': Decimal(3), 'amount': Decimal(5)}], 2, 3), 2)
+        self.assertEqual(bids.top(), [{'price': 4, 'amount': 1}, {'price': 3, 'amount': 5},
+                                      {'price': 1, 'amount': 1}])
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+from decimal import Decimal
+import mock
+from twisted.trial import unittest
+from twisted.internet import defer, task
+from zope.interface.verify import verifyObject
+
+from exchangelib.btce import data_v3
+from exchangelib.errors import APIError
+from exchangelib.interfaces import IDataAPI
+
+TICKER = {'high': 1, 'low': 1, 'avg': 1, 'vol': 1, 'vol_cur': 1, 'last': 1,
+          'buy': 1, 'sell': 1, 'updated': 1}
+
+
+class DataTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.response = defer.Deferred()
+        patcher = mock.patch('exchangelib.btce.data_v3.get_json', return_value=self.response)
+        self.get_json = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_implements_data_api(self):
+        verifyObject(IDataAPI, data_v3)
+
+    def test_single_pair_calls_are_batched(self):
+        """Single pair calls in the same reactor iteration share one request."""
+        with mock.patch('twisted.internet.reactor', self.clock):
+            btc = data_v3.ticker('btcusd')
+            ltc = data_v3.ticker('ltcusd')
+        self.assertFalse(self.get_json.called)
+        self.clock.advance(0)
+        self.assertEqual(self.get_json.call_count, 1)
+        self.assertEqual(self.get_json.call_args[1]['url'], 'https://btc-e.com/api/3/ticker/btc_usd-ltc_usd/')
+
+        self.response.callback({'btc_usd': dict(TICKER, last=300), 'ltc_usd': dict(TICKER, last=3)})
+        btc.addCallback(lambda t: self.assertEqual(t['last'], Decimal(300)))
+        ltc.addCallback(lambda t: self.assertEqual(t['bid'], Decimal(1)))
+        return defer.gatherResults([btc, ltc])
+
+    def test_missing_pair_fails(self):
+        with mock.patch('twisted.internet.reactor', self.clock):
+            d = data_v3.ticker('btcusd')
+        self.clock.advance(0)
+        self.response.callback({'error': 'Invalid pair name', 'success': 0})
+        return self.assertFailure(d, APIError)
+
+    def test_batch(self):
+        """Batch calls return validated data for each pair."""
+        d = data_v3.orderbook_batch(['btcusd', 'ltcusd'], limit_orders=20)
+        self.assertEqual(self.get_json.call_args[1]['url'], 'https://btc-e.com/api/3/depth/btc_usd-ltc_usd/')
+        self.assertEqual(self.get_json.call_args[1]['params'], {'limit': 20})
+        self.response.callback({'btc_usd': {'bids': [[1, 2]], 'asks': []},
+                                'ltc_usd': {'bids': [], 'asks': [[3, 4]]}})
+        d.addCallback(lambda books: self.assertEqual(books['ltcusd']['asks'],
+                                                     [{'price': Decimal(3), 'amount': Decimal(4)}]))
+        return d
+
+    def test_depth_limit_sent(self):
+        with mock.patch('twisted.internet.reactor', self.clock):
+            data_v3.orderbook('btcusd', depth=20)
+            data_v3.orderbook('ltcusd', depth=20)
+            data_v3.orderbook('btcusd', depth=50)
+        self.clock.advance(0)
+        # pairs with the same limit share a request
+        requests = sorted((call[1]['params']['limit'], call[1]['url']) for call in self.get_json.call_args_list)
+        self.assertEqual(requests, [(20, 'https://btc-e.com/api/3/depth/btc_usd-ltc_usd/'),
+                                    (50, 'https://btc-e.com/api/3/depth/btc_usd/')])
+
+    def test_same_pair_twice(self):
+        """Callers asking for the same pair each get a result, though processing changes the data in place."""
+        with mock.patch('twisted.internet.reactor', self.clock):
+            first = data_v3.trades('btcusd')
+            second = data_v3.trades('btcusd')
+        self.clock.advance(0)
+        self.response.callback({'btc_usd': [{'type': 'bid', 'price': 1, 'amount': 2, 'tid': 3, 'timestamp': 4}]})
+        results = defer.gatherResults([first, second])
+        results.addCallback(lambda trades: self.assertEqual(trades[0], trades[1]))
+        return results
+
+    def test_bad_pair(self):
+        with mock.patch('twisted.internet.reactor', self.clock):
+            self.assertRaises(ValueError, data_v3.ticker, 'bad')
+            d = data_v3.ticker('btcusd')
+        self.clock.advance(0)
+        self.assertEqual(self.get_json.call_args[1]['url'], 'https://btc-e.com/api/3/ticker/btc_usd/')
+        self.response.callback({'btc_usd': TICKER})
+        return d
+
+    def test_request_setup_fails(self):
+        """An exception setting up the batched request fails every caller in the batch."""
+        self.get_json.side_effect = RuntimeError("setup")
+        with mock.patch('twisted.internet.reactor', self.clock):
+            btc = data_v3.ticker('btcusd')
+            ltc = data_v3.ticker('ltcusd')
+        self.clock.advance(0)
+        return defer.gatherResults([self.assertFailure(btc, RuntimeError), self.assertFailure(ltc, RuntimeError)])
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from exchangelib.cache import ResponseCache
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.time = 0
+        self.cache = ResponseCache(max_entries=2, now=lambda: self.time)
+        self.fetches = list()
+
+    def fetcher(self, url, params):
+        d = defer.Deferred()
+        self.fetches.append(d)
+        return d
+
+    def results(self, d):
+        got = list()
+        d.addCallback(got.append)
+        return got
+
+    def test_coalesces_concurrent_requests(self):
+        """Identical requests made while one is in flight share it."""
+        first = self.results(self.cache.fetch(self.fetcher, 'http://a/', {'x': 1}))
+        second = self.results(self.cache.fetch(self.fetcher, 'http://a/', {'x': 1}))
+        self.cache.fetch(self.fetcher, 'http://a/', {'x': 2})
+        self.assertEqual(len(self.fetches), 2)
+        self.fetches[0].callback('body')
+        self.assertEqual(first, ['body'])
+        self.assertEqual(second, ['body'])
+        self.assertEqual(self.cache.coalesced, 1)
+
+    def test_failures_reach_every_caller(self):
+        first = self.cache.fetch(self.fetcher, 'http://a/')
+        second = self.cache.fetch(self.fetcher, 'http://a/')
+        self.fetches[0].errback(ValueError())
+        self.assertFailure(first, ValueError)
+        self.assertFailure(second, ValueError)
+        self.assertEqual(len(self.cache), 0)
+        return defer.gatherResults([first, second])
+
+    def test_ttl(self):
+        """Responses are cached for the TTL of the longest matching prefix."""
+        self.cache.set_ttl('http://a/', 10)
+        self.cache.set_ttl('http://a/nocache', 0)
+        self.cache.fetch(self.fetcher, 'http://a/ticker')
+        self.fetches[0].callback('body')
+        self.assertEqual(self.results(self.cache.fetch(self.fetcher, 'http://a/ticker')), ['body'])
+        self.assertEqual(len(self.fetches), 1)
+
+        self.time = 11
+        self.cache.fetch(self.fetcher, 'http://a/ticker')
+        self.assertEqual(len(self.fetches), 2)
+
+        self.cache.fetch(self.fetcher, 'http://a/nocache')
+        self.fetches[2].callback('body')
+        self.cache.fetch(self.fetcher, 'http://a/nocache')
+        self.assertEqual(len(self.fetches), 4)
+
+    def test_lru_and_purge(self):
+        self.cache.default_ttl = 10
+        for url in ('http://a/1', 'http://a/2', 'http://a/1', 'http://a/3'):
+            self.cache.fetch(self.fetcher, url)
+            if not self.fetches[-1].called:
+                self.fetches[-1].callback(url)
+        self.assertEqual(len(self.cache), 2)
+        # 2 was least recently used, so it was the one dropped
+        self.cache.fetch(self.fetcher, 'http://a/1')
+        self.assertEqual(len(self.fetches), 3)
+        self.cache.purge()
+        self.assertEqual(len(self.cache), 0)
+
+    def test_cancelled_caller(self):
+        """A caller cancelling leaves the others waiting on the fetch."""
+        first = self.cache.fetch(self.fetcher, 'http://a/')
+        second = self.results(self.cache.fetch(self.fetcher, 'http://a/'))
+        first.cancel()
+        self.fetches[0].callback('body')
+        self.assertEqual(second, ['body'])
+        return self.assertFailure(first, defer.CancelledError)
+
+    def test_list_params(self):
+        first = self.results(self.cache.fetch(self.fetcher, 'http://a/', {'pair': ['btcusd', 'ltcusd']}))
+        second = self.results(self.cache.fetch(self.fetcher, 'http://a/', {'pair': ['btcusd', 'ltcusd']}))
+        self.assertEqual(len(self.fetches), 1)
+        self.fetches[0].callback('body')
+        self.assertEqual((first, second), (['body'], ['body']))
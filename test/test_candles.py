@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+from decimal import Decimal
+from twisted.trial import unittest
+from twisted.internet import task
+
+from exchangelib.candles import CandleBuilder
+from exchangelib.scheduler import PollScheduler
+
+
+def trade(timestamp, price, amount=1, trade_id=None):
+    data = {'timestamp': timestamp, 'price': Decimal(price), 'amount': Decimal(amount)}
+    if trade_id is not None:
+        data['id'] = trade_id
+    return data
+
+
+class CandleBuilderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.builder = CandleBuilder(periods=('1m', 300))
+        self.candles = list()
+        self.builder.listen('candle', self.candles.append)
+
+    def test_ohlc(self):
+        for t in [trade(60, 250, 1), trade(70, 255, 2), trade(80, 245, 1), trade(110, 251, '0.5')]:
+            self.builder.add_trade(t)
+        self.assertEqual(self.candles, [])
+        self.assertEqual(self.builder.open_candle('1m'), {
+            'period': 60, 'timestamp': 60, 'open': 250, 'high': 255, 'low': 245, 'close': 251,
+            'volume': Decimal('4.5')})
+
+        self.builder.add_trade(trade(125, 260))
+        self.assertEqual(len(self.candles), 1)
+        self.assertEqual((self.candles[0]['timestamp'], self.candles[0]['close']), (60, 251))
+
+    def test_periods_close_separately(self):
+        five_minute = list()
+        self.builder.listen('candle', five_minute.append, period=300)
+        for timestamp in range(0, 601, 30):
+            self.builder.add_trade(trade(timestamp, 250))
+        self.assertEqual([c['timestamp'] for c in five_minute], [0, 300])
+        self.assertEqual([c['period'] for c in self.candles].count(60), 10)
+        self.assertEqual(five_minute[0]['volume'], 10)
+
+    def test_gap_and_late_trades(self):
+        self.builder.add_trade(trade(10, 250))
+        self.builder.add_trade(trade(200, 251))
+        # the 1m candle at 0 closed, no candles for 60 and 120
+        self.assertEqual([c['timestamp'] for c in self.candles], [0])
+        self.builder.add_trade(trade(20, 249))
+        self.assertEqual(self.builder.late, 1)
+        self.assertEqual(self.builder.open_candle(300)['low'], 249)
+        self.assertEqual(self.builder.open_candle('1m')['low'], 251)
+
+    def test_polled_trades(self):
+        # newest first, as Bitstamp returns them, and overlapping
+        self.builder.add_trades([trade(70, 252, trade_id=3), trade(65, 251, trade_id=2), trade(61, 250, trade_id=1)])
+        self.builder.add_trades([trade(75, 253, trade_id=4), trade(70, 252, trade_id=3)])
+        candle = self.builder.open_candle('1m')
+        self.assertEqual((candle['open'], candle['close'], candle['volume']), (250, 253, 4))
+
+    def test_ids_out_of_order(self):
+        """Trades with lower ids than ones already added still count, repeats don't."""
+        self.builder.add_trade(trade(61, 250, trade_id=5))
+        self.builder.add_trade(trade(62, 251, trade_id=4))
+        self.builder.add_trade(trade(62, 251, trade_id=4))
+        self.assertEqual(self.builder.open_candle('1m')['volume'], 2)
+
+    def test_ids_forgotten(self):
+        self.builder.add_trade(trade(10, 250, trade_id=1))
+        self.builder.add_trade(trade(320, 250, trade_id=2))
+        self.builder.add_trade(trade(390, 250, trade_id=3))
+        # trade 1 can't go into any candle any more
+        self.assertEqual(self.builder._seen, {2, 3})
+
+    def test_timer_closes(self):
+        clock = task.Clock()
+        clock.advance(100)
+        self.builder.add_trade(trade(100, 250))
+        self.builder.start(poll_scheduler=PollScheduler(clock))
+        self.addCleanup(self.builder.stop)
+        clock.advance(19)
+        self.assertEqual(self.candles, [])
+        clock.advance(1)
+        self.assertEqual([c['timestamp'] for c in self.candles], [60])
+        self.assertIsNone(self.builder.open_candle('1m'))
+
+    def test_bad_period(self):
+        self.assertRaises(ValueError, CandleBuilder, periods=('1m', '2 weeks'))
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+
+import os
+from decimal import Decimal
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from exchangelib import forex, book
+
+
+class ConverterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.converter = forex.ForexConverter()
+        self.converter.datasources['FXCM'].rates = {'EUR': '0.9', 'CNY': '8'}
+        self.converter.datasources['ECB'].rates = {'EUR': '0.8', 'GBP': '0.75'}
+        for datasource in self.converter.datasources.values():
+            self.patch(datasource, 'update', lambda: defer.succeed(None))
+
+    def test_update_rates_rebuilds(self):
+        self.assertEqual(self.converter._matrix, {})
+        self.converter.update_rates()
+        self.assertEqual(self.converter._matrix['USD']['EUR'], Decimal('0.9'))
+        # the first data source with both currencies wins
+        self.assertEqual(self.converter.rate('CNY', 'EUR'), Decimal('0.9') / Decimal('8'))
+        self.assertEqual(self.converter.rate('EUR', 'GBP'), Decimal('0.75') / Decimal('0.8'))
+        self.assertEqual(self.converter.rate('gbp', 'usd'), 1 / Decimal('0.75'))
+
+    def test_same_rates_as_data_sources(self):
+        expected = dict(((base, quote), self.converter.rate(base, quote))
+                        for base in ('USD', 'EUR', 'CNY', 'GBP') for quote in ('USD', 'EUR', 'CNY', 'GBP')
+                        if (base, quote) not in (('CNY', 'GBP'), ('GBP', 'CNY')))
+        self.converter.rebuild_matrix()
+        for (base, quote), rate in expected.items():
+            self.assertEqual(self.converter.rate(base, quote), rate)
+
+    def test_unknown(self):
+        self.converter.rebuild_matrix()
+        self.assertRaises(ValueError, self.converter.rate, 'CNY', 'GBP')
+        self.assertRaises(TypeError, self.converter.rate, 1, 'USD')
+
+    def test_convert_many(self):
+        self.converter.rebuild_matrix()
+        self.assertEqual(self.converter.convert_many([Decimal(16), Decimal(8)], 'CNY', 'USD'), [2, 1])
+
+    def test_convert_many_numpy(self):
+        if forex.numpy is None:
+            raise unittest.SkipTest("numpy isn't installed")
+        self.converter.rebuild_matrix()
+        exact = forex.numpy.array([Decimal('16.000000000000000001')], dtype=object)
+        self.assertEqual(list(self.converter.convert_many(exact, 'CNY', 'USD')), [Decimal('2.000000000000000000125')])
+        floats = self.converter.convert_many(forex.numpy.array([16.0, 8.0]), 'CNY', 'USD')
+        self.assertEqual(floats.tolist(), [2.0, 1.0])
+
+    def test_lowercase(self):
+        self.converter.rebuild_matrix()
+        self.assertEqual(self.converter.rate('cny', 'usd'), self.converter.rate('CNY', 'USD'))
+
+    def test_convert_book(self):
+        self.converter.rebuild_matrix()
+        orders = {'bids': [{'price': Decimal(1600), 'amount': Decimal(1)}], 'asks': [], 'timestamp': 5}
+        self.assertEqual(self.converter.convert_book(orders, 'CNY', 'USD'),
+                         {'bids': [{'price': 200, 'amount': 1}], 'asks': [], 'timestamp': 5})
+        self.assertEqual(orders['bids'][0]['price'], 1600)
+
+        columnar = self.converter.convert_book(book.OrderBook.from_dict(orders), 'CNY', 'USD')
+        self.assertEqual((columnar.best_bid, columnar.timestamp), (200, 5))
+
+    def test_convert_trades(self):
+        self.converter.rebuild_matrix()
+        trades = [{'price': Decimal(16), 'amount': Decimal(2), 'timestamp': 1}]
+        self.assertEqual(self.converter.convert_trades(trades, 'CNY', 'USD'),
+                         [{'price': 2, 'amount': 2, 'timestamp': 1}])
+
+
+def rates_xml(quotes):
+    return ''.join(['<?xml version="1.0" encoding="UTF-8"?>\n<Rates>'] +
+                   ['<Rate Symbol="{}"><Bid>{}</Bid><Ask>{}</Ask><High>0</High></Rate>'.format(*quote)
+                    for quote in quotes] + ['</Rates>']).encode('utf-8')
+
+
+class FXCMTestCase(unittest.TestCase):
+    def setUp(self):
+        self.body = None
+        self.patch(forex.utils, 'get', self.get)
+        self.converter = forex.ForexConverter()
+        self.fxcm = self.converter.datasources['FXCM']
+        self.changes = list()
+        self.fxcm.listen('rates_changed', self.changes.append)
+
+    def get(self, url, params=None, collector=None):
+        # in small chunks, splitting elements
+        for i in range(0, len(self.body), 7):
+            collector(self.body[i:i + 7])
+        return defer.succeed(None)
+
+    def update(self, quotes):
+        self.body = rates_xml(quotes)
+        self.fxcm.last_updated = None
+        results = list()
+        self.fxcm.update().addCallback(results.append)
+        return results[0]
+
+    def test_streamed_parse(self):
+        changed = self.update([('EURUSD', '1.1', '1.3'), ('USDJPY', '100', '102'), ('Copper', '2', '2'),
+                               ('SPX500', '1', '2')])
+        self.assertEqual(changed, {'EUR': 1 / Decimal('1.2'), 'JPY': 101, 'XCP': Decimal('0.5')})
+        self.assertEqual(self.fxcm.rates['USD'], 1)
+        self.assertEqual(self.changes, [changed])
+
+    def test_only_changes(self):
+        self.update([('EURUSD', '1.1', '1.3'), ('USDJPY', '100', '102')])
+        self.assertIsNone(self.update([('EURUSD', '1.1', '1.3'), ('USDJPY', '100', '102')]))
+        self.assertEqual(self.update([('EURUSD', '1.1', '1.3'), ('USDJPY', '100', '104')]), {'JPY': 102})
+        self.assertEqual(len(self.changes), 2)
+        self.assertEqual(set(self.fxcm.rates), set(['USD', 'EUR', 'JPY']))
+
+    def test_failed_update_kept_nothing(self):
+        """Quotes from a response that failed part way aren't taken as seen by the next update."""
+        quotes = [('EURUSD', '1.1', '1.3'), ('USDJPY', '100', '102')]
+        body = rates_xml(quotes)
+        self.body = body[:len(body) - 20]
+        self.fxcm.last_updated = None
+        self.assertFailure(self.fxcm.update(), forex.ElementTree.ParseError)
+        self.assertEqual(self.update(quotes), {'EUR': 1 / Decimal('1.2'), 'JPY': 101})
+
+    def test_dropped_from_feed(self):
+        self.update([('EURUSD', '1.1', '1.3'), ('USDJPY', '100', '102')])
+        self.assertEqual(self.update([('EURUSD', '1.1', '1.3')]), {'JPY': None})
+        self.assertEqual(set(self.fxcm.rates), set(['USD', 'EUR']))
+        self.assertRaises(ValueError, self.converter.rate, 'JPY', 'USD')
+
+    def test_matrix_refreshed(self):
+        self.converter.datasources['ECB'].rates = {'JPY': '90', 'GBP': '0.75'}
+        self.update([('USDJPY', '100', '102'), ('GBPUSD', '1', '1')])
+        self.converter.rebuild_matrix()
+        self.update([('USDJPY', '110', '110'), ('GBPUSD', '1', '1')])
+        self.assertEqual(self.converter.rate('GBP', 'JPY'), 110)
+        self.assertEqual(self.converter.rate('JPY', 'USD'), 1 / Decimal(110))
+        refreshed = self.converter._matrix
+        self.assertEqual(self.converter.rebuild_matrix(), refreshed)
+
+    def test_dropped_currency(self):
+        ecb = self.converter.datasources['ECB']
+        ecb.rates = {'GBP': '0.75', 'SEK': '8'}
+        self.converter.rebuild_matrix()
+        ecb.rates = {'GBP': '0.75'}
+        self.assertRaises(ValueError, self.converter.rate, 'SEK', 'USD')
+
+
+class SnapshotTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = self.mktemp()
+        self.patch(forex.utils, 'get_json', lambda url: defer.succeed({'rates': {'EUR': '0.9', 'GBP': 0.75}}))
+
+    def test_warm_start(self):
+        source = forex.ECBData(self.directory)
+        source.update()
+        self.assertTrue(os.path.exists(source.snapshot_path))
+
+        restarted = forex.ECBData(self.directory)
+        self.assertEqual(restarted.rates, {'USD': 1, 'EUR': Decimal('0.9'), 'GBP': Decimal('0.75')})
+        self.assertEqual(restarted.last_updated, source.last_updated)
+        self.assertFalse(restarted.needs_update())
+
+    def test_converter(self):
+        forex.ECBData(self.directory).update()
+        converter = forex.ForexConverter(snapshot_dir=self.directory)
+        self.assertEqual(converter._matrix['EUR']['GBP'], Decimal('0.75') / Decimal('0.9'))
+        self.assertIsNone(converter.datasources['FXCM'].last_updated)
+
+    def test_throttled(self):
+        now = [1000]
+        self.patch(forex.utils, 'now_in_utc_secs', lambda: now[0])
+        source = forex.ECBData(self.directory)
+        source.update_freq, source.snapshot_interval = 5, 60
+        source.update()
+        self.patch(forex.utils, 'get_json', lambda url: defer.succeed({'rates': {'EUR': '0.8'}}))
+        now[0] += source.update_freq
+        source.update()
+        self.assertEqual(forex.ECBData(self.directory).rates['EUR'], Decimal('0.9'))
+
+        source.flush_snapshot()
+        self.assertEqual(forex.ECBData(self.directory).rates['EUR'], Decimal('0.8'))
+        self.assertEqual(os.listdir(self.directory), ['ECBData.json'])
+
+    def test_too_old(self):
+        source = forex.ECBData(self.directory)
+        source.update()
+        self.patch(forex.utils, 'now_in_utc_secs', lambda: source.last_updated + source.max_snapshot_age + 1)
+        restarted = forex.ECBData(self.directory)
+        self.assertEqual((restarted.rates, restarted.last_updated), ({}, None))
+
+    def test_unreadable(self):
+        os.makedirs(self.directory)
+        with open(os.path.join(self.directory, 'ECBData.json'), 'w') as f:
+            f.write('{"rates": ')
+        source = forex.ECBData(self.directory)
+        self.assertEqual((source.rates, source.last_updated), ({}, None))
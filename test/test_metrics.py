@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+from twisted.trial import unittest
+
+from exchangelib import metrics, simpleschema
+
+
+class HistogramTestCase(unittest.TestCase):
+    def test_percentiles(self):
+        hist = metrics.Histogram()
+        for i in range(1, 101):
+            hist.record(i / 1000.0)
+        self.assertEqual(hist.count, 100)
+        # accurate to the bucket width
+        self.assertTrue(0.05 <= hist.percentile(50) <= 0.05 * 1.1)
+        self.assertTrue(0.099 <= hist.percentile(99) <= 0.1)
+        self.assertEqual(hist.percentile(100), 0.1)
+
+    def test_empty(self):
+        self.assertIsNone(metrics.Histogram().percentile(50))
+
+
+class SpanTestCase(unittest.TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def test_activate(self):
+        span = metrics.Span('x')
+        with metrics.activate(span):
+            self.assertIs(metrics.current_span(), span)
+        self.assertIsNone(metrics.current_span())
+
+    def test_returns_records_stages(self):
+        """Functions decorated with simpleschema.returns are timed under their name."""
+        @simpleschema.returns([int])
+        def numbers():
+            span = metrics.current_span()
+            span.parsed_at = metrics.now()
+            return ['1']
+        numbers()
+        label = 'test.test_metrics.numbers'
+        self.assertIn(label, metrics.labels())
+        for stage in ('remap', 'validate', 'total'):
+            self.assertEqual(metrics.histogram(label, stage).count, 1)
+        self.assertIn('endpoint="{}",stage="validate"'.format(label), metrics.export_text())
+
+    def test_child_spans(self):
+        """Child spans keep their own stages, and add them to the parent's."""
+        span = metrics.Span('x')
+        first, second = span.child(), span.child()
+        first.record('connect', 0.5)
+        second.record('ttfb', 0.25)
+        self.assertEqual(first.stages, {'connect': 0.5})
+        self.assertEqual(second.stages, {'ttfb': 0.25})
+        self.assertEqual(span.stages, {'connect': 0.5, 'ttfb': 0.25})
+        self.assertEqual(metrics.histogram('x', 'connect').count, 1)
+
+    def test_returns_untimed(self):
+        @simpleschema.returns([int], timed=False)
+        def numbers():
+            self.assertIsNone(metrics.current_span())
+            return ['1']
+        self.assertEqual(numbers(), [1])
+        self.assertEqual(metrics.labels(), [])
+
+    def test_get_json_labels(self):
+        """Requests made outside a span are labelled by the calling function, never by their URL."""
+        from twisted.internet import defer
+        from exchangelib import utils
+        self.patch(utils, 'get', lambda url, params=None, **kwargs: defer.succeed(b'[1]'))
+        utils.get_json('http://example.com/api/btc_usd-ltc_usd', headers={})
+        utils.get_json('http://example.com/api/btc_usd', headers={}, label='example')
+        self.assertEqual(sorted(metrics.labels()), ['example', 'test.test_metrics.test_get_json_labels'])
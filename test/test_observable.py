@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+
+import gc
+from collections import deque
+from decimal import Decimal
+from twisted.trial import unittest
+from twisted.internet import defer, task
+
+from exchangelib.observable import Observable, Queue, Conflate, Batch
+
+
+class Source(Observable):
+    def __init__(self):
+        super(Source, self).__init__()
+        self.unlistened = list()
+
+    def trade(self, data):
+        return data
+
+    def hook_unlisten(self, method_name, listener, is_last=False):
+        self.unlistened.append((method_name, is_last))
+
+
+class Recorder(object):
+    def __init__(self):
+        self.received = list()
+
+    def __call__(self, data):
+        self.received.append(data)
+
+    def method(self, data):
+        self.received.append(data)
+
+
+def trade(price, amount, direction='bid'):
+    return {'price': Decimal(price), 'amount': Decimal(amount), 'direction': direction}
+
+
+class ObservableTestCase(unittest.TestCase):
+    def setUp(self):
+        self.source = Source()
+
+    def test_unfiltered(self):
+        listener = Recorder()
+        self.source.listen('trade', listener)
+        self.assertEqual(self.source.trade(trade(1, 1)), trade(1, 1))
+        self.assertEqual(listener.received, [trade(1, 1)])
+
+    def test_empty_results_ignored(self):
+        listener = Recorder()
+        self.source.listen('trade', listener)
+        self.source.trade({})
+        self.assertEqual(listener.received, [])
+
+    def test_filters(self):
+        big, band, bids, both = Recorder(), Recorder(), Recorder(), Recorder()
+        self.source.listen('trade', big, amount__gte=1)
+        self.source.listen('trade', band, price__between=(240, 260))
+        self.source.listen('trade', bids, direction='bid')
+        self.source.listen('trade', both, direction__in=('bid', 'ask'), amount__lt=Decimal('0.5'))
+
+        trades = [trade(250, '0.1'), trade(230, 2, 'ask'), trade(270, 1), trade(260, '0.4', 'ask')]
+        for t in trades:
+            self.source.trade(t)
+        self.assertEqual(big.received, [trades[1], trades[2]])
+        self.assertEqual(band.received, [trades[0], trades[3]])
+        self.assertEqual(bids.received, [trades[0], trades[2]])
+        self.assertEqual(both.received, [trades[0], trades[3]])
+
+    def test_strict_bounds(self):
+        over, under = Recorder(), Recorder()
+        self.source.listen('trade', over, price__gt=250)
+        self.source.listen('trade', under, price__lte=250)
+        self.source.trade(trade(250, 1))
+        self.source.trade(trade(251, 1))
+        self.assertEqual([t['price'] for t in over.received], [251])
+        self.assertEqual([t['price'] for t in under.received], [250])
+
+    def test_missing_field_never_matches(self):
+        listener = Recorder()
+        self.source.listen('trade', listener, amount__gte=1)
+        self.source.trade({'price': 1})
+        self.assertEqual(listener.received, [])
+
+    def test_bad_operator(self):
+        self.assertRaises(ValueError, self.source.listen, 'trade', Recorder(), amount__around=1)
+
+    def test_exceptions_isolated(self):
+        def broken(data):
+            raise RuntimeError("broken")
+        listener = Recorder()
+        subscription = self.source.listen('trade', broken, weak=False)
+        self.source.listen('trade', listener)
+        self.source.trade(trade(1, 1))
+        self.assertEqual(len(listener.received), 1)
+        self.assertEqual(subscription.errors, 1)
+        self.flushLoggedErrors(RuntimeError)
+
+    def test_weak_listener_dropped(self):
+        listener = Recorder()
+        self.source.listen('trade', listener.method, weak=True)
+        self.source.trade(trade(1, 1))
+        self.assertEqual(len(listener.received), 1)
+        del listener
+        gc.collect()
+        self.assertEqual(self.source.listeners('trade'), [])
+        self.assertEqual(self.source.unlistened, [('trade', True)])
+        # the method wrapper is gone
+        self.assertNotIn('trade', vars(self.source))
+
+    def test_weak_function_warns(self):
+        def listener(data):
+            pass
+        self.source.listen('trade', listener, weak=True)
+        warnings = self.flushWarnings()
+        self.assertEqual(len(warnings), 1)
+        self.assertEqual(warnings[0]['category'], RuntimeWarning)
+
+        self.source.listen('trade', Recorder().method, weak=True)
+        self.source.listen('trade', listener)
+        self.assertEqual(self.flushWarnings(), [])
+
+    def test_unhashable_filter_values(self):
+        """Filters on unhashable values can't be indexed, but still work."""
+        exact, either = Recorder(), Recorder()
+        self.source.listen('trade', exact, levels=[1, 2])
+        self.source.listen('trade', either, levels__in=([1, 2], [3]))
+        self.source.trade({'levels': [1, 2]})
+        self.source.trade({'levels': [3]})
+        self.source.trade({'levels': [4]})
+        self.assertEqual(exact.received, [{'levels': [1, 2]}])
+        self.assertEqual(either.received, [{'levels': [1, 2]}, {'levels': [3]}])
+
+        self.source.unlisten('trade', exact)
+        self.source.unlisten('trade', either)
+        self.assertEqual(self.source.listeners('trade'), [])
+
+    def test_weak_builtin_method(self):
+        """Methods of builtin types are held by their instance, like other bound methods."""
+        received = deque()
+        self.source.listen('trade', received.append, weak=True)
+        gc.collect()
+        self.source.trade(trade(1, 1))
+        self.assertEqual(len(received), 1)
+        self.assertEqual(self.source.listeners('trade'), [received.append])
+        del received
+        gc.collect()
+        self.assertEqual(self.source.listeners('trade'), [])
+
+    def test_weak_unreferenceable_builtin(self):
+        received = list()
+        self.source.listen('trade', received.append, weak=True)
+        gc.collect()
+        self.source.trade(trade(1, 1))
+        self.assertEqual(len(received), 1)
+
+    def test_strong_by_default(self):
+        received = list()
+        self.source.listen('trade', lambda data: received.append(data))
+        self.source.listen('trade', Recorder())
+        gc.collect()
+        self.source.trade(trade(1, 1))
+        self.assertEqual(len(received), 1)
+        self.assertEqual(len(self.source.listeners('trade')), 2)
+
+    def test_unlisten(self):
+        first, second = Recorder(), Recorder()
+        self.source.listen('trade', first, amount__gte=1)
+        self.source.listen('trade', second)
+        self.source.unlisten('trade', first)
+        self.assertEqual(self.source.unlistened, [('trade', False)])
+        self.source.trade(trade(1, 1))
+        self.assertEqual((len(first.received), len(second.received)), (0, 1))
+        self.source.unlisten('trade', second)
+        self.assertEqual(self.source.unlistened[-1], ('trade', True))
+        self.assertRaises(ValueError, self.source.unlisten, 'trade', second)
+
+
+class DeliveryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.source = Source()
+        self.clock = task.Clock()
+        self.received = list()
+
+    def listen(self, delivery):
+        return self.source.listen('trade', self.received.append, delivery=delivery)
+
+    def test_queue_drops_oldest(self):
+        subscription = self.listen(Queue(maxlen=2, clock=self.clock))
+        for i in range(1, 4):
+            self.source.trade({'id': i})
+        # nothing is delivered in the method call itself
+        self.assertEqual(self.received, [])
+        self.clock.advance(0)
+        self.assertEqual(self.received, [{'id': 2}, {'id': 3}])
+        stats = subscription.stats()
+        self.assertEqual((stats['delivered'], stats['dropped'], stats['pending']), (2, 1, 0))
+
+    def test_queue_waits_for_deferred(self):
+        pending = list()
+
+        def slow(data):
+            pending.append(defer.Deferred())
+            return pending[-1]
+        subscription = self.source.listen('trade', slow, weak=False, delivery=Queue(clock=self.clock))
+        self.source.trade({'id': 1})
+        self.source.trade({'id': 2})
+        self.clock.advance(0)
+        self.clock.advance(0)
+        self.assertEqual(len(pending), 1)
+        pending[0].callback(None)
+        self.clock.advance(0)
+        self.assertEqual(len(pending), 2)
+        self.assertEqual(subscription.stats()['pending'], 0)
+
+    def test_conflate(self):
+        subscription = self.listen(Conflate(clock=self.clock))
+        for i in range(1, 4):
+            self.source.trade({'id': i})
+        self.clock.advance(0)
+        self.assertEqual(self.received, [{'id': 3}])
+        self.assertEqual(subscription.delivery.dropped, 2)
+
+    def test_batch(self):
+        subscription = self.listen(Batch(clock=self.clock))
+        self.source.trade({'id': 1})
+        self.source.trade({'id': 2})
+        self.clock.advance(0)
+        self.source.trade({'id': 3})
+        self.clock.advance(0)
+        self.assertEqual(self.received, [[{'id': 1}, {'id': 2}], [{'id': 3}]])
+        self.assertEqual((subscription.delivery.batches, subscription.delivery.delivered), (2, 3))
+
+    def test_drains_per_iteration(self):
+        """Everything waiting is delivered in one reactor iteration, up to the budget."""
+        scheduled = list()
+        self.patch(self.clock, 'callLater', lambda *args: scheduled.append(args) or task.Clock.callLater(
+            self.clock, *args))
+        self.listen(Queue(clock=self.clock, budget=2))
+        for i in range(5):
+            self.source.trade({'id': i})
+        self.clock.advance(0)
+        self.assertEqual(len(self.received), 5)
+        self.assertEqual(len(scheduled), 3)
+
+    def test_batch_maxlen(self):
+        subscription = self.listen(Batch(maxlen=2, clock=self.clock))
+        for i in range(3):
+            self.source.trade({'id': i})
+        self.clock.advance(0)
+        self.assertEqual(self.received, [[{'id': 1}, {'id': 2}]])
+        self.assertEqual(subscription.delivery.dropped, 1)
+
+    def test_mode_names(self):
+        subscription = self.source.listen('trade', self.received.append, delivery='conflate')
+        self.assertIsInstance(subscription.delivery, Conflate)
+        self.assertRaises(ValueError, self.source.listen, 'trade', self.received.append, delivery='later')
+        self.assertRaises(ValueError, self.source.listen, 'trade', self.received.append,
+                          delivery=subscription.delivery)
+
+    def test_unlisten_cancels(self):
+        subscription = self.listen(Queue(clock=self.clock))
+        self.source.trade({'id': 1})
+        self.source.unlisten('trade', self.received.append)
+        self.clock.advance(0)
+        self.assertEqual(self.received, [])
+        self.assertEqual(subscription.delivery.dropped, 1)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
@@ -5,6 +5,7 @@ from twisted.trial import unittest
 from twisted.internet import defer, task
 
 from exchangelib.utils import poll
+from exchangelib.scheduler import PollScheduler
 
 
 class PollTestCase(unittest.TestCase):
@@ -51,4 +52,90 @@ class PollTestCase(unittest.TestCase):
             self.assertTupleEqual(args, (1, "2", {3: 4}), "Poll target must be passed args")
             self.assertDictEqual(kwargs, {'a': 'b', 'c': 0xD}, "Poll target must be passed kwargs")
 
-        self.cleanup_loop = poll(1, target, lambda x: x, 1, "2", {3: 4}, a='b', c=0xD)
\ No newline at end of file
+        self.cleanup_loop = poll(1, target, lambda x: x, 1, "2", {3: 4}, a='b', c=0xD)
+
+class PollSchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.t = lambda: None
+        self.clock = task.Clock()
+        self.scheduler = PollScheduler(self.clock)
+        self.calls = list()
+
+    def slow_target(self):
+        d = defer.Deferred()
+        self.calls.append(d)
+        return d
+
+    def test_skips_while_previous_call_running(self):
+        """A new call isn't started while the previous one is still running."""
+        job = self.scheduler.add(1, self.slow_target)
+        self.clock.advance(1)
+        self.clock.advance(1)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(job.skipped, 2)
+        self.calls[0].callback('x')
+        self.clock.advance(1)
+        self.assertEqual(len(self.calls), 2)
+        job.stop()
+
+    def test_backs_off_on_errors(self):
+        """The next call after an error waits for the backed off interval, counted from when the call started."""
+        job = self.scheduler.add(1, self.slow_target, max_interval=3)
+        self.calls[-1].errback(ValueError())
+        self.assertEqual((job.interval, job.next_run), (2, 2))
+        self.clock.advance(1)
+        self.assertEqual(len(self.calls), 1)
+        self.clock.advance(1)
+        self.assertEqual(len(self.calls), 2)
+        self.calls[-1].errback(ValueError())
+        self.assertEqual((job.interval, job.next_run), (3, 5))
+        self.clock.advance(3)
+        self.assertEqual(len(self.calls), 3)
+        self.calls[-1].callback('ok')
+        self.assertEqual((job.interval, job.next_run), (1, 6))
+        self.assertEqual(job.errors, 2)
+        job.stop()
+
+    def test_failures_logged_without_processor(self):
+        """Failures of jobs without a processor are logged, not left unhandled."""
+        job = self.scheduler.add(1, self.slow_target)
+        with mock.patch('exchangelib.scheduler.log') as log:
+            self.calls[-1].errback(ValueError("down"))
+        self.assertIn("down", log.warning.call_args[0][0])
+        self.assertEqual(job.errors, 1)
+        job.stop()
+
+    def test_adapts_to_unchanging_data(self):
+        """Adaptive jobs slow down while results stay the same."""
+        job = self.scheduler.add(1, lambda: 'same', adaptive=True)
+        self.clock.advance(1)
+        self.clock.advance(1)
+        self.assertGreater(job.interval, 1)
+        self.assertEqual(job.changes, 1)
+        job.stop()
+
+    def test_results_not_compared_unless_adaptive(self):
+        """Plain jobs neither compare results nor keep the last one."""
+        class Uncomparable(object):
+            def __eq__(self, other):
+                raise AssertionError("compared")
+            __ne__ = __eq__
+        job = self.scheduler.add(1, Uncomparable)
+        self.clock.advance(1)
+        self.assertEqual((job.runs, job.errors, job.changes), (2, 0, 0))
+        self.assertIsNone(job._last_result)
+        job.stop()
+
+    def test_single_timer(self):
+        """Many jobs share one timer."""
+        jobs = [self.scheduler.add(i + 1, self.t) for i in range(50)]
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        for job in jobs:
+            job.stop()
+        self.assertEqual(len(self.clock.getDelayedCalls()), 0)
+
+    def test_jitter_delays_first_call(self):
+        job = self.scheduler.add(10, self.slow_target, jitter=0.5)
+        self.assertEqual(len(self.calls), 0)
+        self.assertTrue(0 < job.next_run <= 5)
+        job.stop()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from exchangelib.pool import HostLimiter
+
+
+class HostLimiterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.limiter = HostLimiter(max_in_flight=2)
+        self.requests = list()
+
+    def request(self):
+        d = defer.Deferred()
+        self.requests.append(d)
+        return d
+
+    def test_queues_beyond_limit(self):
+        """Requests past the per-host limit wait until one finishes."""
+        for _ in range(3):
+            self.limiter.run('a.com', self.request)
+        self.assertEqual(len(self.requests), 2)
+        self.assertEqual(self.limiter.in_flight('a.com'), 2)
+        self.assertEqual(self.limiter.queued('a.com'), 1)
+
+        self.requests[0].callback(None)
+        self.assertEqual(len(self.requests), 3)
+        self.assertEqual(self.limiter.queued('a.com'), 0)
+
+    def test_hosts_are_independent(self):
+        for host in ('a.com', 'a.com', 'b.com'):
+            self.limiter.run(host, self.request)
+        self.assertEqual(len(self.requests), 3)
+        self.assertEqual(self.limiter.in_flight('b.com'), 1)
+        self.assertEqual(self.limiter.in_flight('c.com'), 0)
+
+    def test_passes_results_and_failures(self):
+        d = self.limiter.run('a.com', defer.succeed, 'result')
+        d.addCallback(self.assertEqual, 'result')
+        failed = self.limiter.run('a.com', defer.fail, ValueError())
+        self.assertFailure(failed, ValueError)
+        self.assertEqual(self.limiter.in_flight('a.com'), 0)
+        return failed
+
+    def test_raise_limit(self):
+        """A higher limit starts queued requests right away."""
+        for _ in range(4):
+            self.limiter.run('a.com', self.request)
+        self.limiter.max_in_flight = 3
+        self.assertEqual(len(self.requests), 3)
+        self.assertEqual((self.limiter.in_flight('a.com'), self.limiter.queued('a.com')), (3, 1))
+
+    def test_lower_limit(self):
+        """A lower limit holds new requests until the ones running are under it."""
+        for _ in range(3):
+            self.limiter.run('a.com', self.request)
+        self.limiter.max_in_flight = 1
+        self.requests[0].callback(None)
+        self.assertEqual(len(self.requests), 2)
+        self.assertEqual((self.limiter.in_flight('a.com'), self.limiter.queued('a.com')), (1, 1))
+        self.requests[1].callback(None)
+        self.assertEqual(len(self.requests), 3)
+        self.assertEqual((self.limiter.in_flight('a.com'), self.limiter.queued('a.com')), (1, 0))
+
+    def test_cancel_queued(self):
+        for _ in range(2):
+            self.limiter.run('a.com', self.request)
+        queued = self.limiter.run('a.com', self.request)
+        queued.cancel()
+        self.assertEqual(self.limiter.queued('a.com'), 0)
+        self.requests[0].callback(None)
+        self.assertEqual(len(self.requests), 2)
+        return self.assertFailure(queued, defer.CancelledError)
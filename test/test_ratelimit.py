@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+from twisted.trial import unittest
+from twisted.internet import defer, task
+
+from exchangelib.ratelimit import HostScheduler, PRIORITY_HIGH, PRIORITY_LOW
+
+
+class HostSchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.scheduler = HostScheduler(rate=1, burst=2, clock=self.clock)
+        self.ran = list()
+
+    def request(self, name, priority=PRIORITY_LOW):
+        return self.scheduler.schedule(lambda: self.ran.append(name) or name, priority)
+
+    def test_burst_runs_immediately(self):
+        self.request('a')
+        self.request('b')
+        self.request('c')
+        self.assertEqual(self.ran, ['a', 'b'])
+        self.assertEqual(self.scheduler.queued(), 1)
+
+    def test_queue_drains_at_rate(self):
+        for name in 'abcd':
+            self.request(name)
+        self.clock.advance(1)
+        self.assertEqual(self.ran, ['a', 'b', 'c'])
+        self.clock.advance(1)
+        self.assertEqual(self.ran, ['a', 'b', 'c', 'd'])
+        self.assertEqual(self.scheduler.stats()['max_wait'], 2)
+
+    def test_high_priority_goes_first(self):
+        for name in 'abc':
+            self.request(name)
+        d = self.request('private', PRIORITY_HIGH)
+        self.assertEqual(self.scheduler.queued(PRIORITY_HIGH), 1)
+        self.clock.advance(1)
+        self.assertEqual(self.ran, ['a', 'b', 'private'])
+        d.addCallback(self.assertEqual, 'private')
+
+    def test_cancel_queued(self):
+        """A cancelled request leaves the queue, and its slot goes to the next one."""
+        for name in 'ab':
+            self.request(name)
+        cancelled = self.request('c')
+        self.request('d')
+        cancelled.cancel()
+        self.assertEqual(self.scheduler.queued(), 1)
+        self.clock.advance(1)
+        self.assertEqual(self.ran, ['a', 'b', 'd'])
+        return self.assertFailure(cancelled, defer.CancelledError)
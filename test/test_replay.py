@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+import os
+from twisted.trial import unittest
+from twisted.internet import defer
+from twisted.test.proto_helpers import MemoryReactorClock
+
+from exchangelib import replay, utils, pool
+
+
+def event(t, name, data, channel='live_trades'):
+    return {'t': t, 'type': 'pusher', 'channel': channel, 'event': name, 'data': data}
+
+
+def response(t, url, body, status=200, params=None):
+    return {'t': t, 'type': 'http', 'method': 'get', 'url': url, 'params': params, 'status': status, 'body': body}
+
+
+class RequestKeyTestCase(unittest.TestCase):
+    def test_ignores_scheme_and_order(self):
+        self.assertEqual(replay.request_key('get', 'https://example.com/a?b=2&a=1'),
+                         replay.request_key('GET', 'http://example.com/a', {'a': 1, 'b': '2'}))
+
+    def test_path_matters(self):
+        self.assertNotEqual(replay.request_key('get', 'http://example.com/a'),
+                            replay.request_key('get', 'http://example.com/b'))
+
+
+class RecorderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = MemoryReactorClock()
+        self.path = self.mktemp()
+        self.patch(utils, '_request', lambda method, url, **kwargs: defer.succeed('{"last": "250.5"}'))
+        self.recorder = replay.Recorder(self.path, clock=self.clock)
+        self.addCleanup(self.recorder.stop)
+
+    def test_records_requests_and_events(self):
+        self.recorder.start()
+        pusher = replay.FakePusher()
+        received = list()
+
+        class API(object):
+            _pusher = pusher
+        self.recorder.attach(API)
+        API._pusher.subscribe('live_trades').bind('trade', received.append)
+
+        self.clock.advance(1.5)
+        utils.get('https://www.bitstamp.net/api/ticker/', {'a': 1})
+        self.clock.advance(1)
+        pusher.deliver('live_trades', 'trade', '{"price": 250}')
+        self.recorder.stop()
+
+        self.assertEqual(len(received), 1)
+        header, entries = replay.load(self.path)
+        self.assertEqual(header['version'], replay.FORMAT_VERSION)
+        self.assertEqual([(entry['t'], entry['type']) for entry in entries], [(1.5, 'http'), (2.5, 'pusher')])
+        self.assertEqual(entries[0]['body'], '{"last": "250.5"}')
+        self.assertEqual(entries[0]['params'], {'a': 1})
+        self.assertEqual(entries[1]['data'], '{"price": 250}')
+
+    def test_binary_bodies(self):
+        """Bodies are recorded as text, or as base64 if they aren't UTF-8, and replayed as the same bytes."""
+        bodies = [b'{"last": "250.5"}', b'\xff\xfe']
+        self.patch(utils, '_request', lambda method, url, **kwargs: defer.succeed(bodies.pop(0)))
+        self.recorder.start()
+        utils.get('https://www.bitstamp.net/api/ticker/')
+        utils.get('https://www.bitstamp.net/api/ticker/')
+        self.recorder.stop()
+
+        _, entries = replay.load(self.path)
+        self.assertEqual(entries[0]['body'], u'{"last": "250.5"}')
+        self.assertNotIn('body', entries[1])
+        self.assertEqual([replay._body(entry) for entry in entries], [b'{"last": "250.5"}', b'\xff\xfe'])
+
+    def test_stop_restores_request(self):
+        original = utils._request
+        self.recorder.start()
+        self.assertNotEqual(utils._request, original)
+        self.recorder.stop()
+        self.assertEqual(utils._request, original)
+
+
+class ReplayTimingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = MemoryReactorClock()
+        self.received = list()
+
+    def start(self, entries, speed):
+        session = replay.Replay(entries, speed=speed, clock=self.clock)
+        session.pusher().subscribe('live_trades').bind('trade', lambda e: self.received.append(e.data))
+        session.start()
+        self.addCleanup(session.stop)
+        return session
+
+    def test_speed_scales_time(self):
+        session = self.start([event(10, 'trade', 1), event(20, 'trade', 2)], speed=10)
+        self.clock.advance(0.9)
+        self.assertEqual(self.received, [])
+        self.clock.advance(0.1)
+        self.assertEqual(self.received, [1])
+        self.clock.advance(1)
+        self.assertEqual(self.received, [1, 2])
+        self.assertTrue(session.done.called)
+
+    def test_as_fast_as_possible(self):
+        session = self.start([event(i * 60, 'trade', i) for i in range(replay.FAST_BATCH + 5)], speed=None)
+        self.assertEqual(self.received, [])
+        self.clock.advance(0)
+        self.assertEqual(len(self.received), replay.FAST_BATCH + 5)
+        self.assertTrue(session.done.called)
+
+    def test_unsubscribed_dropped(self):
+        session = self.start([event(0, 'trade', 1, channel='order_book')], speed=None)
+        self.clock.advance(0)
+        self.assertEqual((session.delivered, session.dropped), (0, 1))
+
+    def test_response_follows_position(self):
+        url = 'https://www.bitstamp.net/api/ticker/'
+        session = self.start([response(0, url, 'a'), response(10, url, 'b')], speed=2)
+        key = replay.request_key('get', url)
+        self.assertEqual(session.response_for(key)['body'], 'a')
+        self.clock.advance(5)
+        self.assertEqual(session.response_for(key)['body'], 'b')
+
+    def test_response_in_turn_when_fast(self):
+        url = 'https://www.bitstamp.net/api/ticker/'
+        session = self.start([response(0, url, 'a'), response(10, url, 'b')], speed=None)
+        key = replay.request_key('get', url)
+        self.assertEqual([session.response_for(key)['body'] for _ in range(3)], ['a', 'b', 'b'])
+
+
+class ReplayServerTestCase(unittest.TestCase):
+    """Requests through utils are served by the local HTTP server."""
+
+    def setUp(self):
+        # a pool of our own, in case an earlier test created the shared one with a fake reactor
+        self.patch(pool, '_pool', None)
+        self.session = replay.Replay([response(0, 'https://www.bitstamp.net/api/ticker/', '{"last": "250.5"}',
+                                               params={'x': 1})], speed=None)
+        self.session.start()
+        self.addCleanup(pool.close)
+        self.addCleanup(self.session.stop)
+
+    @defer.inlineCallbacks
+    def test_served(self):
+        data = yield utils.get_json('https://www.bitstamp.net/api/ticker/', {'x': 1})
+        self.assertEqual(str(data['last']), '250.5')
+        self.assertEqual(self.session.requests, 1)
+
+    @defer.inlineCallbacks
+    def test_unmatched_404(self):
+        with self.assertRaises(utils.HTTPError):
+            yield utils.get('https://www.bitstamp.net/api/ticker/', {'x': 2})
+        self.assertEqual(self.session.unmatched, 1)
+
+
+class LoadTestCase(unittest.TestCase):
+    def test_rejects_other_files(self):
+        path = self.mktemp()
+        with open(path, 'w') as f:
+            f.write('{"something": "else"}\n')
+        self.assertRaises(ValueError, replay.load, path)
+        self.assertTrue(os.path.exists(path))
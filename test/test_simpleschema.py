@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+import copy
+from decimal import Decimal
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from exchangelib import simpleschema, schemas
+
+
+class CompileTestCase(unittest.TestCase):
+    def test_converts_orderbook(self):
+        """A compiled validator converts nested lists of dicts."""
+        validator = simpleschema.compile(schemas.OrderBook)
+        book = validator({'bids': [{'price': '1.5', 'amount': 2}], 'asks': [], 'timestamp': '123'})
+        self.assertEqual(book['bids'][0], {'price': Decimal('1.5'), 'amount': Decimal(2)})
+        self.assertIsInstance(book['bids'][0]['price'], Decimal)
+        self.assertEqual(book['timestamp'], 123)
+
+    def test_optional_keys(self):
+        """Keys starting with '?' are optional, other keys are required."""
+        validator = simpleschema.compile(schemas.Trade)
+        trade = validator({'price': '1', 'amount': '2', 'timestamp': 3})
+        self.assertNotIn('id', trade)
+        self.assertRaises(ValueError, validator, {'price': '1', 'amount': '2'})
+
+    def test_bad_data_structure(self):
+        """Data that doesn't match the schema's structure raises TypeError."""
+        self.assertRaises(TypeError, simpleschema.compile(schemas.Order), [1, 2])
+        self.assertRaises(TypeError, simpleschema.compile(schemas.OrderList), 5)
+
+    def test_bad_schema(self):
+        """Bad schemas are rejected when compiling rather than when validating."""
+        self.assertRaises(TypeError, simpleschema.compile, Decimal)
+        self.assertRaises(ValueError, simpleschema.compile, {'price': 'Decimal'})
+        self.assertRaises(ValueError, simpleschema.compile, [])
+
+    def test_validate_matches_compile(self):
+        """validate() gives the same results as a compiled validator."""
+        data = [{'price': '1', 'amount': '2', 'timestamp': '3', 'is_buy': 1}]
+        self.assertEqual(simpleschema.validate(copy.deepcopy(data), schemas.TradeList),
+                         simpleschema.compile(schemas.TradeList)(copy.deepcopy(data)))
+
+    def test_validators_bounded(self):
+        """Only the most recently used MAX_VALIDATORS compiled validators are kept."""
+        self.patch(simpleschema, '_validators', simpleschema.OrderedDict())
+        self.patch(simpleschema, 'MAX_VALIDATORS', 2)
+        first, second, third = [int], [float], [str]
+        for schema in (first, second, first, third):
+            simpleschema.validate([], schema)
+        self.assertEqual([entry[0] for entry in simpleschema._validators.values()], [first, third])
+
+
+class ReturnsTestCase(unittest.TestCase):
+    def test_validates_deferred_results(self):
+        """returns() validates what a returned Deferred fires with."""
+        @simpleschema.returns(schemas.ConversionRate)
+        def rate():
+            return defer.succeed({'buy': '1.1', 'sell': '1.2'})
+        rate().addCallback(self.assertEqual, {'buy': Decimal('1.1'), 'sell': Decimal('1.2')})
+
+    def test_validates_plain_results(self):
+        """returns() validates plain return values."""
+        @simpleschema.returns([int])
+        def numbers():
+            return ['1', '2']
+        self.assertEqual(numbers(), [1, 2])
+
+    def test_lazy_per_call(self):
+        """A lazy keyword argument picks lazy results for one call, and isn't passed to the function."""
+        @simpleschema.returns([int])
+        def numbers(count=2):
+            return ['1', '2'][:count]
+        result = numbers(lazy=True)
+        self.assertIsInstance(result, simpleschema.LazyList)
+        self.assertEqual(result, [1, 2])
+        self.assertNotIsInstance(numbers(1), simpleschema.LazyList)
+
+        @simpleschema.returns([int], lazy=True)
+        def lazy_numbers():
+            return ['1']
+        self.assertIsInstance(lazy_numbers(), simpleschema.LazyList)
+        self.assertNotIsInstance(lazy_numbers(lazy=False), simpleschema.LazyList)
+
+
+class LazyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.wrap = simpleschema.compile_lazy(schemas.OrderBook)
+        self.raw = {'bids': [{'price': '1.5', 'amount': '2'}, {'price': 'bad', 'amount': '1'}],
+                    'asks': [], 'timestamp': '123'}
+
+    def test_converts_on_access(self):
+        """Values are converted when read, and only once."""
+        book = self.wrap(self.raw)
+        bids = book['bids']
+        self.assertEqual(dict.__getitem__(bids[0], 'price'), '1.5')
+        price = bids[0]['price']
+        self.assertEqual(price, Decimal('1.5'))
+        self.assertIs(bids[0]['price'], price)
+        self.assertIs(book['bids'], bids)
+        self.assertEqual(book.get('timestamp'), 123)
+        self.assertEqual([level['amount'] for level in bids[:1]], [Decimal(2)])
+
+    def test_structure_checked_up_front(self):
+        """The top level's type and required keys are checked when wrapping, like compile does."""
+        self.assertRaises(TypeError, self.wrap, [])
+        self.assertRaises(ValueError, self.wrap, {'bids': []})
+
+    def test_conversion_error(self):
+        """Bad values raise a ConversionError saying where they are when they're read."""
+        book = self.wrap(self.raw)
+        self.assertEqual(book['bids'][0]['price'], Decimal('1.5'))
+        try:
+            book['bids'][1]['price']
+        except simpleschema.ConversionError as e:
+            self.assertEqual(e.path, ['bids', 1, 'price'])
+            self.assertIn("['bids'][1]['price'] = 'bad'", str(e))
+        else:
+            self.fail("No ConversionError")
+        self.assertRaises(ValueError, simpleschema.resolve, book)
+
+    def test_resolve(self):
+        """resolve converts everything, e.g. before json.dumps."""
+        self.raw['bids'].pop()
+        book = simpleschema.resolve(self.wrap(self.raw))
+        self.assertEqual(dict.__getitem__(book, 'timestamp'), 123)
+        self.assertIsInstance(list.__getitem__(book['bids'], 0)['amount'], Decimal)
+        self.assertEqual(book, simpleschema.compile(schemas.OrderBook)(self.raw))
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+import os
+import struct
+from decimal import Decimal
+from twisted.trial import unittest
+
+from exchangelib import book
+from exchangelib.tickstore import TickStore, to_fixed, from_fixed
+from exchangelib.replay import FakePusher
+from exchangelib.bitstamp.websocket import BitstampWebsocketAPI2
+from exchangelib.bitstamp.observer import BitstampObserver
+
+
+def trade(timestamp, price, amount, trade_id=None, is_buy=None):
+    data = {'timestamp': timestamp, 'price': Decimal(price), 'amount': Decimal(amount)}
+    if trade_id is not None:
+        data['id'] = trade_id
+    if is_buy is not None:
+        data['is_buy'] = is_buy
+    return data
+
+
+class TickStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = os.path.abspath(self.mktemp())
+        self.store = TickStore(self.root)
+        self.addCleanup(lambda: self.store.close())
+
+    def test_fixed_point(self):
+        self.assertEqual(to_fixed(Decimal('250.12345678')), 25012345678)
+        self.assertEqual(to_fixed(Decimal('0.000000005')), 0)
+        self.assertEqual(to_fixed(3), 300000000)
+        self.assertEqual(from_fixed(25012345678), Decimal('250.12345678'))
+
+    def test_trades_round_trip(self):
+        trades = [trade(100, '250.5', '0.01', 1, True), trade(101.25, '251', '2', 2, False), trade(102, '252', '1')]
+        self.assertIs(self.store.append_trades('bitstamp', 'btcusd', trades), trades)
+        self.assertEqual(self.store.trades('bitstamp', 'btcusd'), trades)
+        self.assertEqual(self.store.trades('bitstamp', 'btceur'), [])
+
+    def test_time_range(self):
+        self.store.append_trades('bitstamp', 'btcusd', [trade(t, 250, 1, t) for t in range(100, 200)])
+        found = self.store.trades('bitstamp', 'btcusd', start=150, end=160)
+        self.assertEqual([t['timestamp'] for t in found], list(range(150, 160)))
+        self.assertEqual(self.store.trades('bitstamp', 'btcusd', start=300), [])
+        self.assertEqual(len(self.store.trades('bitstamp', 'btcusd', end=100.5)), 1)
+
+    def test_overlapping_polls(self):
+        # newest first, like Bitstamp's transactions
+        self.store.append_trades('bitstamp', 'btcusd', [trade(102, 3, 1, 3), trade(101, 2, 1, 2)])
+        self.store.append_trades('bitstamp', 'btcusd', [trade(103, 4, 1, 4), trade(102, 3, 1, 3)])
+        self.assertEqual([t['id'] for t in self.store.trades('bitstamp', 'btcusd')], [2, 3, 4])
+        self.assertRaises(ValueError, self.store.append_trades, 'bitstamp', 'btcusd', [trade(50, 1, 1)])
+
+    def test_reopen(self):
+        self.store.append_trades('bitstamp', 'btcusd', [trade(100, 250, 1, 7)])
+        self.store.close()
+        self.store = TickStore(self.root)
+        self.store.append_trades('bitstamp', 'btcusd', [trade(100, 250, 1, 7), trade(101, 251, 1, 8)])
+        self.assertEqual([t['id'] for t in self.store.trades('bitstamp', 'btcusd')], [7, 8])
+
+    def test_partial_record_ignored(self):
+        self.store.append_trades('bitstamp', 'btcusd', [trade(100, 250, 1)])
+        with open(os.path.join(self.root, 'bitstamp', 'btcusd', 'trades.dat'), 'ab') as f:
+            f.write(b'\x01\x02\x03')
+        self.assertEqual(len(self.store.trades('bitstamp', 'btcusd')), 1)
+
+    def test_torn_record_then_append(self):
+        """A record torn by a crash is cut off on reopening, so later appends read back intact."""
+        self.store.append_trades('bitstamp', 'btcusd', [trade(100, 250, 1, 1)])
+        self.store.close()
+        with open(os.path.join(self.root, 'bitstamp', 'btcusd', 'trades.dat'), 'ab') as f:
+            f.write(b'\x01\x02\x03')
+        self.store = TickStore(self.root)
+        self.store.append_trades('bitstamp', 'btcusd', [trade(101, 251, 2, 2)])
+        self.assertEqual(self.store.trades('bitstamp', 'btcusd'), [trade(100, 250, 1, 1), trade(101, 251, 2, 2)])
+
+    def test_torn_book_then_append(self):
+        """Index entries for unfinished books and unindexed book data are dropped on reopening."""
+        first = {'timestamp': 100, 'bids': [{'price': Decimal(250), 'amount': Decimal(1)}], 'asks': []}
+        second = {'timestamp': 110, 'bids': [], 'asks': [{'price': Decimal(251), 'amount': Decimal(2)}]}
+        self.store.append_book('btce', 'btcusd', first)
+        self.store.close()
+        directory = os.path.join(self.root, 'btce', 'btcusd')
+        with open(os.path.join(directory, 'books.dat'), 'ab') as f:
+            f.write(b'\x00' * 20)
+        with open(os.path.join(directory, 'books.idx'), 'ab') as f:
+            # an entry for a book that's longer than what was written, and half an entry
+            f.write(struct.pack('<qqq', 105000000, os.path.getsize(os.path.join(directory, 'books.dat')) - 20, 40))
+            f.write(b'\x00' * 5)
+        self.store = TickStore(self.root)
+        self.store.append_book('btce', 'btcusd', second)
+        self.assertEqual(self.store.books('btce', 'btcusd'), [first, second])
+
+    def test_books(self):
+        first = {'timestamp': 100, 'bids': [{'price': Decimal('250.5'), 'amount': Decimal(1)}],
+                 'asks': [{'price': Decimal(251), 'amount': Decimal(2)}, {'price': Decimal(252), 'amount': Decimal(3)}]}
+        second = book.OrderBook.from_levels([['249', '4']], [], timestamp=110)
+        self.store.append_book('btce', 'btcusd', first)
+        self.store.append_book('btce', 'btcusd', second)
+
+        self.assertEqual(self.store.books('btce', 'btcusd', end=105), [first])
+        columnar = self.store.books('btce', 'btcusd', start=105, columnar=True)
+        self.assertEqual((columnar[0].best_bid, columnar[0].best_ask, columnar[0].timestamp), (249, None, 110))
+        self.assertRaises(ValueError, self.store.append_book, 'btce', 'btcusd', dict(first))
+
+    def test_orders(self):
+        orders = [{'price': Decimal(1), 'amount': Decimal(2), 'timestamp': Decimal('100.5')},
+                  {'price': Decimal(3), 'amount': Decimal(4)}]
+        self.store.append_orders('bitfinex', 'btcusd', orders, timestamp=200)
+        stored = self.store.orders('bitfinex', 'btcusd')
+        self.assertEqual([o['timestamp'] for o in stored], [Decimal('100.5'), 200])
+        self.assertEqual(self.store.count('bitfinex', 'btcusd'), {'trades': 0, 'orders': 2, 'books': 0})
+
+    def test_follow_observer(self):
+        pusher = FakePusher()
+        observer = BitstampObserver(seed_book=False, api=BitstampWebsocketAPI2(pusher=pusher))
+        self.store.follow(observer)
+        pusher.deliver('order_book', 'data', {'bids': [['250', '1']], 'asks': [['251', '1']]})
+        pusher.deliver('live_trades', 'trade', '{"id": 1, "price": "252", "amount": "2"}')
+        stored = self.store.trades('bitstamp', 'btcusd')
+        self.assertEqual((stored[0]['id'], stored[0]['is_buy']), (1, True))
+        self.assertEqual(self.store.count('bitstamp', 'btcusd')['books'], 1)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+from decimal import Decimal
+from twisted.trial import unittest
+
+from exchangelib.tradewindow import TradeWindow
+from exchangelib.replay import FakePusher
+from exchangelib.bitstamp.websocket import BitstampWebsocketAPI2
+from exchangelib.bitstamp.observer import BitstampObserver
+
+
+class TradeWindowTestCase(unittest.TestCase):
+    def setUp(self):
+        self.window = TradeWindow(windows=(10, 60), capacity=100)
+
+    def test_aggregates(self):
+        self.window.add(100, Decimal(250), Decimal(1), is_buy=True)
+        self.window.add(101, Decimal(260), Decimal(3), is_buy=False)
+        self.window.add(102, Decimal(255), Decimal(2))
+        stats = self.window.stats()
+        self.assertEqual(stats['window'], 10)
+        self.assertEqual(stats['count'], 3)
+        self.assertEqual(stats['volume'], 6)
+        self.assertEqual(stats['vwap'], Decimal(1540) / 6)
+        self.assertEqual((stats['buy_volume'], stats['sell_volume']), (1, 3))
+        self.assertEqual(stats['imbalance'], Decimal('-0.5'))
+
+    def test_windows_expire_separately(self):
+        self.window.add(100, Decimal(250), Decimal(1), is_buy=True)
+        self.window.add(105, Decimal(260), Decimal(1), is_buy=True)
+        self.window.add(112, Decimal(270), Decimal(2), is_buy=False)
+        short, long = self.window.stats(10), self.window.stats(60)
+        self.assertEqual((short['count'], short['volume'], short['vwap']), (2, 3, Decimal(800) / 3))
+        self.assertEqual((long['count'], long['volume']), (3, 4))
+        self.assertEqual(long['imbalance'], 0)
+
+        # nothing new, but time moves on
+        self.assertEqual(self.window.stats(10, now=200)['count'], 0)
+        self.assertIsNone(self.window.stats(10)['vwap'])
+        self.assertIsNone(self.window.stats(10)['imbalance'])
+        self.assertEqual(len(self.window), 0)
+
+    def test_no_drift(self):
+        for i in range(1000):
+            self.window.add(i, Decimal('250.01') + i, Decimal('0.1'), is_buy=i % 2 == 0)
+        stats = self.window.stats(10)
+        self.assertEqual(stats['count'], 10)
+        self.assertEqual(stats['volume'], Decimal('1.0'))
+        self.assertEqual(stats['vwap'], Decimal('250.01') + Decimal('994.5'))
+        self.assertEqual(stats['imbalance'], 0)
+        self.assertEqual(len(self.window), 60)
+
+    def test_capacity(self):
+        window = TradeWindow(windows=(60,), capacity=3)
+        for i in range(5):
+            window.add(100, Decimal(i), Decimal(1), trade_id=i)
+        self.assertEqual(len(window), 3)
+        self.assertEqual(window.overflowed, 2)
+        self.assertEqual(window.stats()['vwap'], 3)
+        self.assertEqual([trade['id'] for trade in window.trades()], [4, 3, 2])
+
+    def test_capacity_several_windows(self):
+        """Each trade pushed out counts once, however many windows it was in."""
+        window = TradeWindow(windows=(10, 60, 300), capacity=3)
+        for i in range(5):
+            window.add(100, Decimal(i), Decimal(1), trade_id=i)
+        self.assertEqual(window.overflowed, 2)
+
+    def test_trades(self):
+        self.window.add_trade({'timestamp': 100, 'price': Decimal(1), 'amount': Decimal(2), 'is_buy': True})
+        self.window.add_trade({'timestamp': 150, 'price': Decimal(3), 'amount': Decimal(4), 'id': 7})
+        self.assertEqual(self.window.trades(), [
+            {'timestamp': 150, 'price': 3, 'amount': 4, 'id': 7},
+            {'timestamp': 100, 'price': 1, 'amount': 2, 'is_buy': True}])
+        self.assertEqual(len(self.window.trades(10)), 1)
+        self.assertRaises(KeyError, self.window.stats, 30)
+
+
+class ObserverTestCase(unittest.TestCase):
+    def setUp(self):
+        self.pusher = FakePusher()
+        self.observer = BitstampObserver(seed_book=False, api=BitstampWebsocketAPI2(pusher=self.pusher))
+
+    def test_listeners_notified(self):
+        received = list()
+
+        def broken(trade):
+            raise RuntimeError("broken")
+
+        def listener(trade):
+            received.append(trade)
+        self.observer.add_trade_listener(broken)
+        self.observer.add_trade_listener(listener)
+        self.pusher.deliver('order_book', 'data', {'bids': [['250', '1']], 'asks': [['251', '1']]})
+        self.pusher.deliver('live_trades', 'trade', '{"id": 1, "price": "252", "amount": "2"}')
+
+        self.assertEqual(len(received), 1)
+        self.assertTrue(received[0]['is_buy'])
+        self.assertEqual(self.observer.recent_trades, received)
+        stats = self.observer.trade_stats()
+        self.assertEqual((stats['volume'], stats['imbalance']), (2, 1))
+        self.flushLoggedErrors(RuntimeError)
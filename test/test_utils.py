@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+
+from decimal import Decimal
+from twisted.trial import unittest
+
+from exchangelib import utils
+
+
+class ParseJsonTestCase(unittest.TestCase):
+    def tearDown(self):
+        utils.use_json_decoder()
+
+    def test_floats_are_exact_decimals(self):
+        """Every usable decoder parses floats as exact Decimals."""
+        for name in utils.JSON_DECODERS:
+            try:
+                utils.use_json_decoder(name)
+            except ValueError:
+                continue
+            parsed = utils.parse_json('{"price": 245.10, "amount": 0.30000001, "tid": 7}')
+            self.assertEqual(parsed, {'price': Decimal('245.10'), 'amount': Decimal('0.30000001'), 'tid': 7})
+            self.assertIsInstance(parsed['price'], Decimal)
+
+    def test_stdlib_fallback_always_available(self):
+        """The stdlib json decoder can always be used."""
+        self.assertEqual(utils.use_json_decoder('json'), 'json')
+
+    def test_unknown_decoder(self):
+        """Unknown decoder names are rejected."""
+        self.assertRaises(ValueError, utils.use_json_decoder, 'nope')
@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+"""
+Append-only on-disk store for trades, orders and order books, in fixed-point binary records.
+
+Prices and amounts are stored as int64 scaled by 1e8 (so up to 8 decimal places, and values up to about 9e10),
+timestamps as int64 microseconds. Every exchange and pair gets its own directory::
+
+    <root>/<exchange>/<pair>/trades.dat    timestamp, price, amount, id, side - 40 bytes per trade
+    <root>/<exchange>/<pair>/orders.dat    timestamp, price, amount - 24 bytes per order
+    <root>/<exchange>/<pair>/books.dat     timestamp, bid count, ask count, then price and amount per level
+    <root>/<exchange>/<pair>/books.idx     timestamp, offset and length of each book in books.dat
+
+Records have to be appended in time order, which makes each file (or the book index) sorted by timestamp, so time
+ranges are found by binary search. Reads go through mmap, decoding only the records in the range asked for.
+"""
+
+import logging
+import mmap
+import os
+import struct
+import time
+from decimal import Decimal, ROUND_HALF_EVEN
+
+from exchangelib.book import OrderBook, BookSide
+
+log = logging.getLogger(__name__)
+
+# fixed-point scale of prices and amounts
+SCALE = 10 ** 8
+_SCALE = Decimal(SCALE)
+_MICROS = 10 ** 6
+
+_TRADE = struct.Struct('<qqqqb7x')
+_ORDER = struct.Struct('<qqq')
+_BOOK_HEADER = struct.Struct('<qII')
+_BOOK_INDEX = struct.Struct('<qqq')
+
+_NO_ID = -1
+_SIDES = {True: 1, False: -1, None: 0}
+
+
+def to_fixed(value):
+    """
+    :type value: Decimal or int or str
+    :returns: value scaled by SCALE, rounded half to even past 8 decimal places
+    :rtype: int
+    """
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    return int((value * _SCALE).to_integral_value(ROUND_HALF_EVEN))
+
+
+def from_fixed(value):
+    """:rtype: Decimal"""
+    return Decimal(value) / _SCALE
+
+
+def _to_micros(timestamp):
+    if isinstance(timestamp, Decimal):
+        return int((timestamp * _MICROS).to_integral_value(ROUND_HALF_EVEN))
+    return int(round(timestamp * _MICROS))
+
+
+def _from_micros(micros):
+    # whole seconds come back as the ints schemas.Trade has, anything finer as a float like time.time()
+    if micros % _MICROS == 0:
+        return micros // _MICROS
+    return micros / float(_MICROS)
+
+
+class _RecordFile(object):
+    """
+    A file of fixed-width records starting with an int64 timestamp, appended to through a file object and read
+    through mmap.
+
+    A partly written record left by a crash mid-append is cut off when the file is opened, so records appended
+    after it stay aligned.
+    """
+
+    def __init__(self, path, record):
+        self.path = path
+        self.record = record
+        self._out = open(path, 'ab')
+        self._map = None
+        self._mapped_size = 0
+        torn = self.size() % record.size
+        if torn:
+            log.warning("Dropping {} bytes of a partly written record at the end of {}".format(torn, path))
+            self.truncate(self.size() - torn)
+
+    def append(self, data):
+        self._out.write(data)
+        self._out.flush()
+
+    def truncate(self, size):
+        """Cut the file down to size bytes"""
+        self._out.flush()
+        os.ftruncate(self._out.fileno(), size)
+
+    def size(self):
+        return os.path.getsize(self.path)
+
+    def __len__(self):
+        return self.size() // self.record.size
+
+    def view(self):
+        """:returns: an up to date mmap of the file, or None if it's empty"""
+        size = self.size()
+        if size != self._mapped_size:
+            self._unmap()
+            if size:
+                with open(self.path, 'rb') as f:
+                    self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mapped_size = size
+        return self._map
+
+    def unpack(self, index):
+        return self.record.unpack_from(self.view(), index * self.record.size)
+
+    def last(self):
+        count = len(self)
+        return self.unpack(count - 1) if count else None
+
+    def bisect(self, timestamp):
+        """:returns: index of the first record at or after timestamp (in microseconds)"""
+        view = self.view()
+        low, high = 0, len(self)
+        size = self.record.size
+        while low < high:
+            middle = (low + high) // 2
+            if struct.unpack_from('<q', view, middle * size)[0] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def range(self, start=None, end=None):
+        """:returns: first index and end index of the records from start (inclusive) to end (exclusive)"""
+        first = self.bisect(_to_micros(start)) if start is not None else 0
+        stop = self.bisect(_to_micros(end)) if end is not None else len(self)
+        return first, max(first, stop)
+
+    def records(self, start=None, end=None):
+        first, stop = self.range(start, end)
+        view, unpack, size = self.view(), self.record.unpack_from, self.record.size
+        for index in range(first, stop):
+            yield unpack(view, index * size)
+
+    def _unmap(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def close(self):
+        self._unmap()
+        self._out.close()
+
+
+class _Stream(object):
+    """The files of one exchange and pair."""
+
+    def __init__(self, path):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.trades = _RecordFile(os.path.join(path, 'trades.dat'), _TRADE)
+        self.orders = _RecordFile(os.path.join(path, 'orders.dat'), _ORDER)
+        # books vary in size, so they're read through the index, and this is treated as a file of bytes
+        self.books = _RecordFile(os.path.join(path, 'books.dat'), struct.Struct('<B'))
+        self.book_index = _RecordFile(os.path.join(path, 'books.idx'), _BOOK_INDEX)
+        self._recover_books()
+
+        last = self.trades.last()
+        self.last_trade = last[0] if last else None
+        self.last_id = last[3] if last and last[3] != _NO_ID else None
+        last = self.orders.last()
+        self.last_order = last[0] if last else None
+        last = self.book_index.last()
+        self.last_book = last[0] if last else None
+
+    def _recover_books(self):
+        """
+        Drop what a crash mid-append_book left behind: index entries for books that weren't completely written, and
+        book data without an index entry.
+        """
+        count, size = len(self.book_index), self.books.size()
+        while count:
+            _, offset, length = self.book_index.unpack(count - 1)
+            if offset + length <= size:
+                break
+            count -= 1
+        if count < len(self.book_index):
+            log.warning("Dropping {} index entries past the end of {}".format(
+                len(self.book_index) - count, self.books.path))
+            self.book_index.truncate(count * _BOOK_INDEX.size)
+        end = sum(self.book_index.unpack(count - 1)[1:]) if count else 0
+        if size > end:
+            log.warning("Dropping {} bytes of unindexed book data at the end of {}".format(size - end, self.books.path))
+            self.books.truncate(end)
+
+    def close(self):
+        for f in (self.trades, self.orders, self.books, self.book_index):
+            f.close()
+
+
+class TickStore(object):
+    """
+    Archive of trades, orders and order books, see the module docstring for the format.
+
+    The append methods return what they're given, so they can be added as callbacks to data API calls::
+
+        store = TickStore('/var/lib/ticks')
+        bitstamp.trades().addCallback(lambda trades: store.append_trades('bitstamp', 'btcusd', trades))
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._streams = dict()
+
+    def stream(self, exchange, pair):
+        key = (exchange, pair)
+        if key not in self._streams:
+            self._streams[key] = _Stream(os.path.join(self.root, exchange, pair))
+        return self._streams[key]
+
+    def append_trades(self, exchange, pair, trades):
+        """
+        Append trades, in time order whatever order they're given in. Trades with an id at or below the last
+        stored one are skipped, so overlapping polls of a trades() function can be appended as they are.
+
+        :type trades: schemas.TradeList
+        :returns: trades
+        :raises ValueError: if a trade (without an id to skip it by) is older than the last one stored
+        """
+        stream = self.stream(exchange, pair)
+        packed = list()
+        last_trade, last_id = stream.last_trade, stream.last_id
+        for trade in sorted(trades, key=lambda t: (t['timestamp'], t.get('id', _NO_ID))):
+            trade_id = trade.get('id')
+            if trade_id is not None and last_id is not None and trade_id <= last_id:
+                continue
+            timestamp = _to_micros(trade['timestamp'])
+            if last_trade is not None and timestamp < last_trade:
+                raise ValueError("Trade at {} is older than the last one stored for {} {}".format(
+                    trade['timestamp'], exchange, pair))
+            packed.append(_TRADE.pack(timestamp, to_fixed(trade['price']), to_fixed(trade['amount']),
+                                      _NO_ID if trade_id is None else trade_id, _SIDES[trade.get('is_buy')]))
+            last_trade = timestamp
+            if trade_id is not None:
+                last_id = trade_id
+        stream.trades.append(b''.join(packed))
+        stream.last_trade, stream.last_id = last_trade, last_id
+        return trades
+
+    def append_trade(self, exchange, pair, trade):
+        """Append a single trade, e.g. from a websocket, see append_trades"""
+        self.append_trades(exchange, pair, [trade])
+        return trade
+
+    def append_orders(self, exchange, pair, orders, timestamp=None):
+        """
+        :type orders: schemas.OrderList
+        :param timestamp: for orders without one, by default the current time
+        :returns: orders
+        :raises ValueError: if an order is older than the last one stored
+        """
+        stream = self.stream(exchange, pair)
+        default = _to_micros(timestamp if timestamp is not None else time.time())
+        packed = list()
+        last_order = stream.last_order
+        for order in orders:
+            stamp = _to_micros(order['timestamp']) if order.get('timestamp') is not None else default
+            if last_order is not None and stamp < last_order:
+                raise ValueError("Order at {} is older than the last one stored for {} {}".format(
+                    _from_micros(stamp), exchange, pair))
+            packed.append(_ORDER.pack(stamp, to_fixed(order['price']), to_fixed(order['amount'])))
+            last_order = stamp
+        stream.orders.append(b''.join(packed))
+        stream.last_order = last_order
+        return orders
+
+    def append_book(self, exchange, pair, book, timestamp=None):
+        """
+        :param book: schemas.OrderBook, or a columnar book.OrderBook
+        :param timestamp: if the book has none, by default the current time
+        :returns: book
+        :raises ValueError: if the book is older than the last one stored
+        """
+        stream = self.stream(exchange, pair)
+        book_timestamp = book.timestamp if isinstance(book, OrderBook) else book.get('timestamp')
+        if book_timestamp is not None:
+            timestamp = book_timestamp
+        stamp = _to_micros(timestamp if timestamp is not None else time.time())
+        if stream.last_book is not None and stamp < stream.last_book:
+            raise ValueError("Book at {} is older than the last one stored for {} {}".format(
+                _from_micros(stamp), exchange, pair))
+
+        bids, asks = _levels(book['bids']), _levels(book['asks'])
+        data = b''.join([_BOOK_HEADER.pack(stamp, len(bids) // 2, len(asks) // 2),
+                         struct.pack('<{}q'.format(len(bids) + len(asks)), *(bids + asks))])
+        offset = stream.books.size()
+        stream.books.append(data)
+        stream.book_index.append(_BOOK_INDEX.pack(stamp, offset, len(data)))
+        stream.last_book = stamp
+        return book
+
+    def trades(self, exchange, pair, start=None, end=None):
+        """
+        :param start: unix time of the first trade, inclusive
+        :param end: unix time to read up to, exclusive
+        :rtype: schemas.TradeList
+        """
+        result = list()
+        for timestamp, price, amount, trade_id, side in self.stream(exchange, pair).trades.records(start, end):
+            trade = {'timestamp': _from_micros(timestamp), 'price': from_fixed(price), 'amount': from_fixed(amount)}
+            if trade_id != _NO_ID:
+                trade['id'] = trade_id
+            if side:
+                trade['is_buy'] = side > 0
+            result.append(trade)
+        return result
+
+    def orders(self, exchange, pair, start=None, end=None):
+        """:rtype: schemas.OrderList, with timestamps"""
+        return [{'timestamp': Decimal(timestamp) / _MICROS, 'price': from_fixed(price), 'amount': from_fixed(amount)}
+                for timestamp, price, amount in self.stream(exchange, pair).orders.records(start, end)]
+
+    def books(self, exchange, pair, start=None, end=None, columnar=False):
+        """
+        :param columnar: get book.OrderBook instead of schemas.OrderBook dicts
+        :rtype: list
+        """
+        stream = self.stream(exchange, pair)
+        result = list()
+        index = list(stream.book_index.records(start, end))
+        if not index:
+            return result
+        view = stream.books.view()
+        for timestamp, offset, length in index:
+            _, bid_count, ask_count = _BOOK_HEADER.unpack_from(view, offset)
+            values = struct.unpack_from('<{}q'.format(2 * (bid_count + ask_count)), view,
+                                        offset + _BOOK_HEADER.size)
+            values = [from_fixed(value) for value in values]
+            split = 2 * bid_count
+            bids = BookSide(values[0:split:2], values[1:split:2])
+            asks = BookSide(values[split::2], values[split + 1::2])
+            book = OrderBook(bids, asks, _from_micros(timestamp))
+            result.append(book if columnar else book.to_dict())
+        return result
+
+    def count(self, exchange, pair):
+        """:returns: dict of how many trades, orders and books are stored"""
+        stream = self.stream(exchange, pair)
+        return {'trades': len(stream.trades), 'orders': len(stream.orders), 'books': len(stream.book_index)}
+
+    def follow(self, observer, exchange='bitstamp', pair='btcusd'):
+        """Archive every trade and order book a bitstamp.BitstampObserver sees"""
+        observer.add_trade_listener(lambda trade: self.append_trade(exchange, pair, trade))
+        observer.api.listen('orderbook', lambda book: self.append_book(exchange, pair, book), weak=False)
+
+    def close(self):
+        for stream in self._streams.values():
+            stream.close()
+        self._streams.clear()
+
+
+def _levels(side):
+    """Flatten an order book side into fixed-point price, amount, price, amount..."""
+    if isinstance(side, BookSide):
+        pairs = zip(side.prices, side.amounts)
+    else:
+        pairs = ((order['price'], order['amount']) for order in side)
+    values = list()
+    for price, amount in pairs:
+        values.append(to_fixed(price))
+        values.append(to_fixed(amount))
+    return values
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+import logging
+from array import array
+from decimal import Decimal
+
+log = logging.getLogger(__name__)
+
+BUY = 1
+SELL = -1
+UNKNOWN = 0
+
+
+class _Window(object):
+    """Running totals over the trades in the last `seconds`, from `tail` (a trade sequence number) onwards."""
+    __slots__ = ('seconds', 'tail', 'count', 'volume', 'notional', 'buy_volume', 'sell_volume')
+
+    def __init__(self, seconds, tail=0):
+        self.seconds = seconds
+        self.tail = tail
+        self.count = 0
+        self.volume = Decimal(0)
+        self.notional = Decimal(0)
+        self.buy_volume = Decimal(0)
+        self.sell_volume = Decimal(0)
+
+    def add(self, price, amount, side):
+        self.count += 1
+        self.volume += amount
+        self.notional += price * amount
+        if side == BUY:
+            self.buy_volume += amount
+        elif side == SELL:
+            self.sell_volume += amount
+
+    def remove(self, price, amount, side):
+        self.count -= 1
+        self.volume -= amount
+        self.notional -= price * amount
+        if side == BUY:
+            self.buy_volume -= amount
+        elif side == SELL:
+            self.sell_volume -= amount
+
+
+class TradeWindow(object):
+    """
+    The most recent trades, in a fixed size ring buffer, with rolling aggregates (volume, VWAP, trade count and
+    buy/sell imbalance) over several time windows at once.
+
+    Each window keeps running totals, updated as trades come in and as they age out of it, so adding a trade costs
+    O(1) per window however busy the market is. Totals are Decimals, so adding and removing trades doesn't drift.
+    Trades older than the longest window are dropped, as are the oldest ones once capacity is reached.
+    """
+
+    def __init__(self, windows=(60, 300, 900), capacity=100000):
+        """
+        :param windows: window lengths, in seconds
+        :param capacity: most trades to keep, whatever their age
+        """
+        if not windows:
+            raise ValueError("At least one window is needed")
+        self.capacity = capacity
+        self.windows = dict((seconds, _Window(seconds)) for seconds in windows)
+        self.longest = max(windows)
+
+        # parallel columns instead of a dict per trade
+        self._timestamps = array('d', [0.0]) * capacity
+        self._sides = array('b', [0]) * capacity
+        self._prices = [None] * capacity
+        self._amounts = [None] * capacity
+        self._ids = [None] * capacity
+        # sequence number of the next trade, and of the oldest one kept
+        self._head = 0
+        self._tail = 0
+        # trades pushed out by capacity while still inside a window
+        self.overflowed = 0
+
+    def add(self, timestamp, price, amount, is_buy=None, trade_id=None):
+        """
+        Add a trade. Trades should be added in time order, as stats are based on the latest timestamp seen.
+
+        :type price: Decimal
+        :type amount: Decimal
+        :param is_buy: True for buys, False for sells, None if unknown
+        """
+        if self._head - self._tail == self.capacity:
+            self._drop_oldest()
+        side = UNKNOWN if is_buy is None else (BUY if is_buy else SELL)
+        index = self._head % self.capacity
+        self._timestamps[index] = timestamp
+        self._sides[index] = side
+        self._prices[index] = price
+        self._amounts[index] = amount
+        self._ids[index] = trade_id
+        self._head += 1
+        for window in self.windows.values():
+            window.add(price, amount, side)
+        self.expire(timestamp)
+
+    def add_trade(self, trade):
+        """Add a trade dict, see schemas.Trade, with is_buy if the direction is known"""
+        self.add(trade['timestamp'], trade['price'], trade['amount'], trade.get('is_buy'), trade.get('id'))
+
+    def expire(self, now):
+        """Age trades out of the windows, and out of the buffer once they're older than the longest window."""
+        for window in self.windows.values():
+            cutoff = now - window.seconds
+            while window.tail < self._head and self._timestamps[window.tail % self.capacity] <= cutoff:
+                index = window.tail % self.capacity
+                window.remove(self._prices[index], self._amounts[index], self._sides[index])
+                window.tail += 1
+        self._release(self.windows[self.longest].tail)
+
+    def stats(self, window=None, now=None):
+        """
+        :param window: window length, defaults to the shortest
+        :param now: current time, to age out trades even if no new ones came in
+        :returns: dict with window, count, volume, vwap (None without trades), buy_volume, sell_volume and
+            imbalance (buy minus sell volume over their sum, None if no trades had a known direction)
+        :raises KeyError: for a window that isn't kept
+        """
+        if now is not None:
+            self.expire(now)
+        totals = self.windows[window if window is not None else min(self.windows)]
+        directional = totals.buy_volume + totals.sell_volume
+        return {'window': totals.seconds,
+                'count': totals.count,
+                'volume': totals.volume,
+                'vwap': totals.notional / totals.volume if totals.volume else None,
+                'buy_volume': totals.buy_volume,
+                'sell_volume': totals.sell_volume,
+                'imbalance': (totals.buy_volume - totals.sell_volume) / directional if directional else None}
+
+    def trades(self, window=None):
+        """
+        :param window: only trades in this window, by default every trade kept
+        :returns: trade dicts, newest first
+        """
+        start = self.windows[window].tail if window is not None else self._tail
+        result = list()
+        for sequence in range(self._head - 1, start - 1, -1):
+            index = sequence % self.capacity
+            trade = {'timestamp': self._timestamps[index], 'price': self._prices[index],
+                     'amount': self._amounts[index]}
+            if self._ids[index] is not None:
+                trade['id'] = self._ids[index]
+            if self._sides[index] != UNKNOWN:
+                trade['is_buy'] = self._sides[index] == BUY
+            result.append(trade)
+        return result
+
+    def __len__(self):
+        return self._head - self._tail
+
+    def _drop_oldest(self):
+        index = self._tail % self.capacity
+        in_window = False
+        for window in self.windows.values():
+            if window.tail == self._tail:
+                window.remove(self._prices[index], self._amounts[index], self._sides[index])
+                window.tail += 1
+                in_window = True
+        if in_window:
+            self.overflowed += 1
+        self._release(self._tail + 1)
+
+    def _release(self, tail):
+        # drop references to the Decimals of trades no window needs any more
+        while self._tail < tail:
+            index = self._tail % self.capacity
+            self._prices[index] = self._amounts[index] = self._ids[index] = None
+            self._tail += 1
@@ -3,49 +3,54 @@
 import logging
 from decimal import Decimal
 import json
+import sys
 import time
 import calendar
-import treq
-from twisted.internet import task, defer
+import functools
+from collections import OrderedDict
 
+from exchangelib import ratelimit, metrics
+from exchangelib.ratelimit import PRIORITY_NORMAL
+from exchangelib.compat import urlparse, string_types
 from exchangelib.errors import HTTPError
 from exchangelib.version import VERSION
 
+# The Twisted request machinery, imported by _load_twisted on first use, so importing utils (as aio and the data
+# API modules do) doesn't import Twisted. Without Twisted and treq, requests can only be made through aio.
+treq = pool = cache = scheduler = None
+
 log = logging.getLogger(__name__)
 
+# Set by aio while it runs a data API function: get_json, get and post then return
+# capture(method, url, parse_json=..., **kwargs) instead of making a request with Twisted.
+capture = None
+
 
 def poll(interval, target, processor, *args, **kwargs):
     """
     Run a function at intervals and process the results with another function.
 
+    Uses the shared scheduler.PollScheduler, so a call is skipped if the previous one hasn't finished yet.
+    Use the scheduler directly for jitter, error backoff and adaptive intervals.
+
     :param interval: how long to wait between calls of target, in seconds
     :type interval: int or float
     :param target: function to run, invoked with args and kwargs
     :param processor: function that receives Deferreds which fire with target's return value and exceptions
 
     :returns: an object with a method stop() that can be used to halt the polling early
-    :rtype: LoopingCall
+    :rtype: scheduler.PollJob
 
     :raises ValueError: if target or processor are not callable
     """
     # todo rethink passing deferred to processor? only reason is error processing...
-    # todo make processor optional
-    # todo make running it instantly optional ('now' on loop.start)
-    # a few options could be useful - such as 'now', 'iterations', and 'clock'.
-
-    if not callable(target) or not callable(processor):
+    if not callable(processor):
         raise ValueError("Target and processor must be callable")
+    _load_twisted()
+    return scheduler.default_scheduler().add(interval, target, processor, args=args, kwargs=kwargs)
 
-    def run():
-        result = defer.maybeDeferred(target, *args, **kwargs)
-        processor(result)
-
-    loop = task.LoopingCall(run)
-    loop.start(interval)
-    return loop
 
-
-def get_json(url, params=None,  **kwargs):
+def get_json(url, params=None, priority=PRIORITY_NORMAL, label=None, **kwargs):
     """
     GET a URL, parsing it as JSON.
 
@@ -53,8 +58,40 @@ def get_json(url, params=None,  **kwargs):
     :type url: str or unicode
     :param params: parameters to pass in the URL
     :type params: dict
+    :param priority: rate limiting priority lane, see ratelimit
+    :param label: metrics label for the request when there's no current metrics.Span, the calling function's
+        by default
+
+    Requests without extra options go through cache.response_cache, so identical requests share a single
+    GET while it is in flight, and responses can be cached for a while (see cache.set_ttl).
+
+    Timings are added to the current metrics.Span, or to a new one with the label. Labels aren't taken from the
+    URL, as URLs with parameters in the path would give an endless number of them.
     """
-    return get(url, params, **kwargs).addCallback(parse_json)
+    if capture is not None:
+        return capture('get', url, params=params, parse_json=True, **kwargs)
+    _load_twisted()
+
+    span = metrics.current_span()
+    own_span = span is None
+    if own_span:
+        span = metrics.Span(label or _caller_label())
+
+    with metrics.activate(span):
+        if kwargs:
+            d = get(url, params, priority=priority, **kwargs)
+        else:
+            d = cache.response_cache.fetch(lambda u, p: get(u, p, priority=priority), url, params)
+
+    def parse(data):
+        start = metrics.now()
+        parsed = parse_json(data)
+        span.parsed_at = metrics.now()
+        span.record('parse', span.parsed_at - start)
+        if own_span:
+            span.record('total', span.parsed_at - span.started)
+        return parsed
+    return d.addCallback(parse)
 
 
 def post_json(url, params=None):
@@ -69,30 +106,67 @@ def get(url, params=None, **kwargs):
     :type url: str or unicode
     :param params: parameters to pass in the URL
     :type params: dict
+    :param priority: rate limiting priority lane, see ratelimit
+    :param collector: called with each chunk of the body as it arrives, instead of the body being returned
 
-    :returns: the pages content
+    :returns: the pages content, or None with a collector
     :rtype: defer.Deferred
 
     :raises HTTPError: via errback if the GET was unsuccessful
     """
     params = params or {}
+    if capture is not None:
+        return capture('get', url, params=params, parse_json=False, **kwargs)
     return _request('get', url, params=params, **kwargs)
 
 
 def post(url, **kwargs):
+    if capture is not None:
+        return capture('post', url, parse_json=False, **kwargs)
     return _request('post', url, **kwargs)
 
 
 # todo redirect HTTPError to APIError if an errmsg was returned
 # todo TimeoutError handling and document what this raises
 # todo tune timeout
-def _request(method, url, **kwargs):
-    def handle(req):
+def _request(method, url, priority=PRIORITY_NORMAL, collector=None, signer=None, **kwargs):
+    """
+    Make an HTTP request once the host's rate limit allows it (see ratelimit), using the shared
+    connection pool and waiting for a free slot if too many requests to the same host are already in flight
+    (see pool).
+
+    With a collector, the body is passed to it chunk by chunk as it is received (see treq.collect), and the
+    Deferred fires with None once it's all there.
+
+    A signer is called right before the request is sent, after any queueing, and returns a dict of headers
+    and/or data to add to it. This keeps nonces in the order requests actually go out in.
+
+    Time spent queueing, connecting, waiting for the response and downloading the body is recorded
+    to the current metrics.Span, if there is one.
+    """
+    _load_twisted()
+    parent = metrics.current_span()
+    # this request's own timings, so the connect time taken off ttfb is only this request's
+    span = parent.child() if parent is not None else None
+    queued_at = metrics.now()
+
+    def handle(req, sent_at):
+        if span is not None:
+            headers_at = metrics.now()
+            # connection setup is recorded separately by the pool
+            span.record('ttfb', headers_at - sent_at - span.stages.get('connect', 0))
         if req.code != 200:
-            req.content().addCallback(log.debug)
-            raise HTTPError("Bad status code: {} for URL '{}'".format(req.code, url), req.code)
-        else:
-            return req.content()
+            def fail(body):
+                log.debug(body)
+                raise HTTPError("Bad status code: {} for URL '{}'".format(req.code, url), req.code, body)
+            return req.content().addCallbacks(fail, lambda failure: fail(None))
+        d = treq.collect(req, collector) if collector is not None else req.content()
+        if span is not None:
+            def downloaded(body):
+                span.record('body', metrics.now() - headers_at)
+                return body
+            d.addCallback(downloaded)
+        return d
 
     # set the User-Agent header if it isn't already set by the user
     if 'headers' not in kwargs:
@@ -100,12 +174,45 @@ def _request(method, url, **kwargs):
     if 'User-Agent' not in kwargs['headers']:
         kwargs['headers']['User-Agent'] = 'exchangelib/{}'.format(VERSION)
 
-    return treq.request(method, url, **kwargs).addCallback(handle)
+    kwargs.setdefault('pool', pool.get_pool())
+
+    def send():
+        request_kwargs = kwargs
+        if signer is not None:
+            signed = signer()
+            request_kwargs = dict(kwargs, headers=dict(kwargs['headers'], **signed.get('headers', {})))
+            if 'data' in signed:
+                request_kwargs['data'] = signed['data']
+        sent_at = metrics.now()
+        if span is not None:
+            span.record('queue', sent_at - queued_at)
+        with metrics.activate(span):
+            return treq.request(method, url, **request_kwargs).addCallback(handle, sent_at)
+    host = urlparse(url).hostname
+    return ratelimit.schedule(host, lambda: pool.limit(host, send), priority)
+
+
+def _load_twisted():
+    global treq, pool, cache, scheduler
+    if treq is None:
+        import treq as _treq
+        from exchangelib import pool as _pool, cache as _cache, scheduler as _scheduler
+        treq, pool, cache, scheduler = _treq, _pool, _cache, _scheduler
+
+
+def _caller_label():
+    # the function that called get_json, labelled like simpleschema.returns labels
+    frame = sys._getframe(2)
+    module = frame.f_globals.get('__name__', '')
+    if module.startswith('exchangelib.'):
+        module = module[len('exchangelib.'):]
+    return '{}.{}'.format(module, frame.f_code.co_name)
 
 
-# todo remove
 def parse_json(data):
-    """Parse a data blob as JSON.
+    """Parse a data blob as JSON, with floats parsed as Decimals.
+
+    Uses the decoder picked by use_json_decoder().
 
     :param data: the unparsed JSON
     :type data: str or unicode
@@ -113,7 +220,66 @@ def parse_json(data):
 
     :raises ValueError: if the JSON was unreadable
     """
-    return json.loads(data, parse_float=Decimal)
+    return _json_decode(data)
+
+
+def _stdlib_json_decoder():
+    return functools.partial(json.loads, parse_float=Decimal)
+
+
+def _simplejson_decoder():
+    import simplejson
+    import simplejson.scanner
+    # without its C extension simplejson is slower than the stdlib json module
+    if not simplejson.scanner.c_make_scanner:
+        raise ImportError("simplejson C speedups are unavailable")
+    return functools.partial(simplejson.loads, parse_float=Decimal)
+
+
+def _rapidjson_decoder():
+    import rapidjson
+    return functools.partial(rapidjson.loads, number_mode=rapidjson.NM_DECIMAL)
+
+
+# JSON decoder factories, fastest first. Only decoders that can parse floats exactly as Decimals are usable,
+# which rules out ujson and friends.
+JSON_DECODERS = OrderedDict([('rapidjson', _rapidjson_decoder),
+                             ('simplejson', _simplejson_decoder),
+                             ('json', _stdlib_json_decoder)])
+
+
+def use_json_decoder(name=None):
+    """
+    Pick the JSON decoder used by parse_json.
+
+    :param name: a key of JSON_DECODERS, or None to use the fastest one that is installed
+    :type name: str or None
+    :returns: the name of the decoder now in use
+    :rtype: str
+
+    :raises ValueError: if the named decoder is unknown or can't be imported
+    """
+    global _json_decode, json_decoder
+    if name is None:
+        candidates = JSON_DECODERS.keys()
+    elif name in JSON_DECODERS:
+        candidates = [name]
+    else:
+        raise ValueError("Unknown JSON decoder '{}'".format(name))
+
+    for candidate in candidates:
+        try:
+            _json_decode = JSON_DECODERS[candidate]()
+        except ImportError:
+            log.debug("JSON decoder '{}' is unavailable".format(candidate))
+        else:
+            json_decoder = candidate
+            return candidate
+    raise ValueError("JSON decoder '{}' is not installed".format(name))
+
+json_decoder = None
+_json_decode = None
+use_json_decoder()
 
 
 def now_in_utc_secs():
@@ -125,11 +291,11 @@ class Pair(object):
         self.base = self.quote = self.rate = None
         if len(args) == 1:
             self.from_string(args[0])
-        elif len(args) == 2 and isinstance(args[0], basestring) and isinstance(args[1], basestring):
+        elif len(args) == 2 and isinstance(args[0], string_types) and isinstance(args[1], string_types):
             (self.base, self.quote) = args
 
     def from_string(self, pair):
-        if len(pair) == 6 and isinstance(pair, basestring):
+        if len(pair) == 6 and isinstance(pair, string_types):
             self.base = pair[:3]
             self.quote = pair[3:]
         else: